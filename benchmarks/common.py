@@ -0,0 +1,81 @@
+"""Helpers shared by the benchmark scripts.
+
+Results are written as JSON::
+
+    {"meta": {...}, "benchmarks": {"<name>": {"median": s, "min": s, "runs": n}}}
+
+and can be compared against an earlier results file used as a baseline.
+"""
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {"median": statistics.median(samples), "min": min(samples), "runs": len(samples)}
+
+
+def measure(fn: Callable[[], object], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """Time ``fn`` ``repeat`` times after ``warmup`` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def meta() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(path: str, benchmarks: Dict[str, Dict[str, float]]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"meta": meta(), "benchmarks": benchmarks}, fh, indent=2, sort_keys=True)
+
+
+def compare(
+    benchmarks: Dict[str, Dict[str, float]], baseline_path: str, tolerance: float
+) -> List[str]:
+    """Return a line for each benchmark slower than baseline by over ``tolerance``."""
+    with open(baseline_path, "r", encoding="utf-8") as fh:
+        baseline = json.load(fh).get("benchmarks", {})
+    regressions = []
+    for name, result in sorted(benchmarks.items()):
+        base = baseline.get(name)
+        if not base or not base.get("median"):
+            continue
+        ratio = result["median"] / base["median"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{name}: {result['median'] * 1e3:.2f} ms vs {base['median'] * 1e3:.2f} ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def report(benchmarks: Dict[str, Dict[str, float]], output: Optional[str],
+           baseline: Optional[str], tolerance: float) -> int:
+    """Print results, write and compare them; return a process exit code."""
+    width = max((len(name) for name in benchmarks), default=0)
+    for name, result in sorted(benchmarks.items()):
+        print(f"{name:<{width}}  {result['median'] * 1e3:10.3f} ms  (min {result['min'] * 1e3:.3f}, n={result['runs']})")
+    if output:
+        write_results(output, benchmarks)
+    if baseline:
+        regressions = compare(benchmarks, baseline, tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
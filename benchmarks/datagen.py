@@ -0,0 +1,176 @@
+"""Synthetic data for the benchmarks.
+
+Every generator is seeded, so the same arguments always produce the same
+data and results from different runs can be compared.
+"""
+import datetime as _dt
+import json
+import os
+import random
+from typing import Any, Dict, List
+
+STAGES = ["Seedling", "Early Vegetative", "Late Vegetative", "Transition", "Early Bloom", "Late Bloom", "Ripen"]
+PLANTS = ["Tomato", "Cucumber", "Lettuce", "Basil", "Pepper", "Strawberry", "Spinach", "Kale", "Generic"]
+MEDIA = ["Rockwool", "Hydroton", "Coco Coir", "Perlite", "Generic"]
+SYSTEMS = ["NFT", "DWC", "Ebb and Flow", "Drip", "Aeroponics", "Generic"]
+WORDS = (
+    "leaf tip burn yellowing curl wilting spots brown edges root rot slime algae pale growth "
+    "stunted droop nitrogen potassium calcium magnesium iron deficiency toxicity excess light heat "
+    "humidity mold powdery mildew aphids mites pH drift salt buildup lockout flowering fruit blossom"
+).split()
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_nutrients(manufacturers: int = 50, series: int = 8, components: int = 5,
+                   supplements: int = 40, seed: int = 1) -> Dict[str, Any]:
+    """Return nutrient data shaped like ``nutrients.json``."""
+    rng = random.Random(seed)
+    nutrients = []
+    for m in range(manufacturers):
+        for s in range(series):
+            stages = {
+                stage: [
+                    {
+                        "name": f"Part {c}",
+                        "concentration": {"metric": rng.randint(1, 300), "imperial": rng.randint(1, 8) / 4},
+                        "unit": {"metric": "ml", "imperial": "tsp"},
+                    }
+                    for c in range(components)
+                ]
+                for stage in STAGES
+            }
+            nutrients.append({
+                "manufacturer": f"Maker {m}",
+                "series": f"Series {s}",
+                "base_unit": {
+                    "metric": {"volume": 100, "unit": "liter"},
+                    "imperial": {"volume": 1, "unit": "gallon"},
+                },
+                "stages": stages,
+            })
+    supps = [
+        {
+            "product": f"CalMag {i}",
+            "concentration": {"metric": rng.randint(10, 200), "imperial": rng.randint(1, 8) / 4},
+            "unit": "ml",
+            "base_unit": {"metric": {"volume": 100}, "imperial": {"volume": 1}},
+        }
+        for i in range(supplements)
+    ]
+    return {"nutrients": nutrients, "cal_mag_supplements": supps}
+
+
+def make_problems(count: int = 100_000, seed: int = 2) -> Dict[str, Any]:
+    """Return problem data shaped like ``hydroponicProblems.json``."""
+    rng = random.Random(seed)
+    problems = []
+    for i in range(count):
+        plant = rng.choice(PLANTS)
+        problems.append({
+            "id": str(i + 1),
+            "title": f"{_words(rng, 3).title()} in {plant}",
+            "description": _words(rng, 25),
+            "symptoms": [_words(rng, 4) for _ in range(3)],
+            "possibleCauses": [_words(rng, 4) for _ in range(3)],
+            "solutions": [_words(rng, 6) for _ in range(3)],
+            "adjustmentRecommendation": _words(rng, 12),
+            "applicablePlants": [plant, "Generic"],
+            "growthStages": rng.sample(STAGES, 2),
+            "growMedia": rng.sample(MEDIA, 2),
+            "hydroponicSystems": rng.sample(SYSTEMS, 2),
+        })
+    return {"problems": problems}
+
+
+def make_layout(shelves: int = 20, trays: int = 12) -> List[dict]:
+    """Return a layout in the shape :func:`save_system_layout` accepts."""
+    return [
+        {"name": f"Shelf {s}", "trays": [{"label": f"Tray {s}-{t}"} for t in range(trays)]}
+        for s in range(shelves)
+    ]
+
+
+def make_configs(keys: int = 2000, seed: int = 3) -> Dict[str, Any]:
+    """Return a configuration dict with ``keys`` profiles."""
+    rng = random.Random(seed)
+    return {
+        f"profile-{i}": {
+            "manufacturer": f"Maker {rng.randrange(50)}",
+            "series": f"Series {rng.randrange(8)}",
+            "stage": rng.choice(STAGES),
+            "unit": rng.choice(["metric", "imperial"]),
+            "volume": rng.randint(1, 200),
+            "notes": _words(rng, 10),
+        }
+        for i in range(keys)
+    }
+
+
+def schedule_entry(rng: random.Random, tray_id: int = 1) -> Dict[str, Any]:
+    return {
+        "date": _dt.date(2024, 1, 1).isoformat(),
+        "manufacturer": f"Maker {rng.randrange(50)}",
+        "series": f"Series {rng.randrange(8)}",
+        "stage": rng.choice(STAGES),
+        "plant_category": "",
+        "unit": "metric",
+        "volume": rng.randint(1, 200),
+        "cal_mag": None,
+        "lines": [f"Part {c}: {rng.random() * 100:.1f} ml" for c in range(5)],
+        "tray_id": tray_id,
+    }
+
+
+def write_legacy_schedule_log(base_dir: str, size_bytes: int = 8 * 1024 * 1024, seed: int = 4) -> int:
+    """Write an old-style ``schedule_log.json`` of about ``size_bytes``.
+
+    Returns the number of entries written.
+    """
+    rng = random.Random(seed)
+    os.makedirs(base_dir, exist_ok=True)
+    entries = []
+    size = 2
+    while size < size_bytes:
+        entry = schedule_entry(rng)
+        size += len(json.dumps(entry)) + 2
+        entries.append(entry)
+    with open(os.path.join(base_dir, "schedule_log.json"), "w", encoding="utf-8") as fh:
+        json.dump(entries, fh)
+    return len(entries)
+
+
+def populate_logs(db_path: str, rows: int = 1_000_000, trays: int = 40, seed: int = 5,
+                  batch: int = 20_000) -> List[int]:
+    """Create a system with ``trays`` trays and ``rows`` nutrient logs.
+
+    Returns the tray ids.
+    """
+    from gardenpip.db import Shelf, ShelfSystem, Tray, add_nutrient_logs, session_scope
+
+    rng = random.Random(seed)
+    with session_scope(db_path) as session:
+        system = ShelfSystem(name="bench")
+        shelf = Shelf(label="Bench", system=system)
+        tray_objs = [Tray(label=f"T{i}", shelf=shelf) for i in range(trays)]
+        session.add(system)
+        session.flush()
+        tray_ids = [t.id for t in tray_objs]
+    start = _dt.datetime(2023, 1, 1)
+    step = _dt.timedelta(minutes=5)
+    for offset in range(0, rows, batch):
+        chunk = [
+            {
+                "tray_id": tray_ids[i % trays],
+                "date": start + step * (i // trays),
+                "ph": round(5.5 + rng.random(), 2),
+                "ppm": float(rng.randint(600, 1400)),
+                "notes": _words(rng, 4),
+            }
+            for i in range(offset, min(offset + batch, rows))
+        ]
+        with session_scope(db_path) as session:
+            add_nutrient_logs(session, chunk)
+    return tray_ids
@@ -0,0 +1,254 @@
+"""Benchmark the gardenpip hot paths on synthetic data.
+
+Covers nutrient calculation, problem search, schedule logging, nutrient
+log search, shelf layout load/save and config load/save.  Data is
+generated by :mod:`benchmarks.datagen` at one of the :data:`SCALES`; the
+``full`` scale has 100k problems, a million logged readings and an 8 MB
+legacy schedule log.  Generating it takes a while, so pass ``--data-dir``
+to keep the data between runs.
+
+Calls that take microseconds are timed in batches of :data:`BATCH`.
+
+Usage::
+
+    python benchmarks/hotpaths.py --data-dir /tmp/gp-bench --output hot.json
+    python benchmarks/hotpaths.py --data-dir /tmp/gp-bench --baseline hot.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import datagen  # noqa: E402
+from benchmarks.common import measure, report  # noqa: E402
+
+BATCH = 100
+
+SCALES = {
+    "full": {"manufacturers": 50, "problems": 100_000, "logs": 1_000_000,
+             "schedule_bytes": 8 * 1024 * 1024, "shelves": 20, "trays": 12, "configs": 2000},
+    "small": {"manufacturers": 10, "problems": 5000, "logs": 50_000,
+              "schedule_bytes": 1024 * 1024, "shelves": 10, "trays": 8, "configs": 200},
+    "tiny": {"manufacturers": 2, "problems": 50, "logs": 200,
+             "schedule_bytes": 16 * 1024, "shelves": 2, "trays": 2, "configs": 10},
+}
+
+
+def prepare(data_dir: str, scale: str) -> Dict[str, object]:
+    """Generate the data for ``scale`` in ``data_dir`` unless it is already there."""
+    params = SCALES[scale]
+    manifest_path = os.path.join(data_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        if manifest.get("params") == params:
+            return manifest
+        shutil.rmtree(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+
+    with open(os.path.join(data_dir, "nutrients.json"), "w", encoding="utf-8") as fh:
+        json.dump(datagen.make_nutrients(params["manufacturers"]), fh)
+    with open(os.path.join(data_dir, "problems.json"), "w", encoding="utf-8") as fh:
+        json.dump(datagen.make_problems(params["problems"]), fh)
+    with open(os.path.join(data_dir, "configs.json"), "w", encoding="utf-8") as fh:
+        json.dump(datagen.make_configs(params["configs"]), fh)
+    datagen.write_legacy_schedule_log(os.path.join(data_dir, "schedule-src"), params["schedule_bytes"])
+    tray_ids = datagen.populate_logs(os.path.join(data_dir, "logs.db"), params["logs"])
+
+    manifest = {"params": params, "tray_ids": tray_ids}
+    with open(manifest_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh)
+    return manifest
+
+
+def _batched(fn: Callable[[int], object]) -> Callable[[], None]:
+    def run() -> None:
+        for i in range(BATCH):
+            fn(i)
+    return run
+
+
+def nutrient_benchmarks(data_dir: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    from gardenpip.nutrient_logic import (
+        NutrientCatalog, calculate_batch, calculate_nutrients, get_catalog, load_nutrient_data,
+        requests_from_layout,
+    )
+    from gardenpip.snapshot import Snapshot, build_snapshot
+
+    path = os.path.join(data_dir, "nutrients.json")
+    data = load_nutrient_data(path)
+    catalog = get_catalog(path)
+    mans = catalog.manufacturers()
+    stages = datagen.STAGES
+
+    def calc(source, i):
+        man = mans[i % len(mans)]
+        return calculate_nutrients(source, man, "Series 1", stages[i % len(stages)], "",
+                                   "metric", 1 + i % 50, "CalMag 3")
+
+    requests = requests_from_layout(datagen.make_layout(50, 20), mans[0], "Series 1",
+                                    stages[0], "metric", 20, "CalMag 3")
+    # written under another name so the loaders above keep reading JSON
+    snap_path = build_snapshot(path, os.path.join(data_dir, "nutrients-bench.snap"))
+    return {
+        "nutrients:load": measure(lambda: load_nutrient_data(path), repeat),
+        "nutrients:catalog_json": measure(lambda: NutrientCatalog(load_nutrient_data(path)), repeat),
+        "nutrients:catalog_snapshot": measure(lambda: NutrientCatalog.from_snapshot(Snapshot(snap_path)), repeat),
+        "nutrients:calculate_dict": measure(lambda: calc(data, 0), repeat),
+        "nutrients:calculate_catalog": measure(_batched(lambda i: calc(catalog, i)), repeat),
+        "nutrients:calculate_batch": measure(lambda: calculate_batch(catalog, requests), repeat),
+    }
+
+
+def problem_benchmarks(data_dir: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    from gardenpip.problem_logic import (
+        DiagnosisIndex, ProblemIndex, get_problem_index, load_problem_data, search_problems,
+    )
+    from gardenpip.snapshot import Snapshot, build_snapshot
+
+    path = os.path.join(data_dir, "problems.json")
+    problems = load_problem_data(path)
+    index = get_problem_index(path)
+    queries = ["leaf curl", "root rot slime", "calcium deficiency", "yellowing", "mites"]
+    snap_path = build_snapshot(path, os.path.join(data_dir, "problems-bench.snap"))
+    diagnosis = DiagnosisIndex(problems)
+    observed = [s for p in problems[:3] for s in p["symptoms"]]
+    return {
+        "problems:diagnosis_build": measure(lambda: DiagnosisIndex(problems), repeat),
+        "problems:diagnose": measure(
+            _batched(lambda i: diagnosis.diagnose_ids(observed[i % 3:], plant="Tomato", limit=20)), repeat),
+        "problems:index_snapshot": measure(lambda: ProblemIndex.from_snapshot(Snapshot(snap_path)), repeat),
+        "problems:load": measure(lambda: load_problem_data(path), repeat),
+        "problems:index_build": measure(lambda: ProblemIndex(problems), repeat),
+        "problems:search_list": measure(lambda: search_problems(problems, "tomato"), repeat),
+        "problems:search_index": measure(
+            _batched(lambda i: index.search(queries[i % len(queries)], plant="Tomato")), repeat),
+    }
+
+
+def schedule_benchmarks(data_dir: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    from gardenpip.schedule_log import get_schedule_log, iter_schedule, log_schedule
+
+    # work on a copy so every run starts from the same legacy log
+    base_dir = os.path.join(data_dir, "schedule")
+    shutil.rmtree(base_dir, ignore_errors=True)
+    shutil.copytree(os.path.join(data_dir, "schedule-src"), base_dir)
+    rng = random.Random(7)
+    # the first append migrates the legacy file, so it is part of the warm-up
+    results = {
+        "schedule:append": measure(_batched(lambda i: log_schedule(datagen.schedule_entry(rng), base_dir)), repeat),
+    }
+    get_schedule_log(base_dir).sync()
+    results["schedule:iter"] = measure(lambda: sum(1 for _ in iter_schedule(base_dir)), repeat)
+    return results
+
+
+def log_benchmarks(data_dir: str, repeat: int, tray_ids: List[int]) -> Dict[str, Dict[str, float]]:
+    from gardenpip.db import search_nutrient_logs, search_nutrient_logs_page, session_scope
+
+    db_path = os.path.join(data_dir, "logs.db")
+
+    def query(fn):
+        def run():
+            with session_scope(db_path) as session:
+                return fn(session)
+        return run
+
+    tray = tray_ids[len(tray_ids) // 2]
+    return {
+        "logs:search_tray": measure(query(
+            lambda s: list(search_nutrient_logs(s, "nitrogen toxicity", tray_id=tray))), repeat),
+        "logs:page_latest": measure(query(lambda s: search_nutrient_logs_page(s)), repeat),
+        "logs:page_search": measure(query(lambda s: search_nutrient_logs_page(s, "calcium mold")), repeat),
+    }
+
+
+def layout_benchmarks(data_dir: str, repeat: int, shelves: int, trays: int) -> Dict[str, Dict[str, float]]:
+    from gardenpip.shelf_logic import get_system_layout, invalidate_layout_cache, save_system_layout
+
+    db_path = os.path.join(data_dir, "layout.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    layout = save_system_layout("bench", datagen.make_layout(shelves, trays), db_path)
+    edits = iter(range(10 ** 9))
+
+    def edit_one():
+        layout[0]["trays"][0]["label"] = f"edited {next(edits)}"
+        save_system_layout("bench", layout, db_path)
+
+    def cold():
+        invalidate_layout_cache()
+        get_system_layout("bench", db_path)
+
+    return {
+        "layout:get_cold": measure(cold, repeat),
+        "layout:get_warm": measure(_batched(lambda i: get_system_layout("bench", db_path)), repeat),
+        "layout:save_unchanged": measure(lambda: save_system_layout("bench", layout, db_path), repeat),
+        "layout:save_one_edit": measure(edit_one, repeat),
+    }
+
+
+def config_benchmarks(data_dir: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    from gardenpip.config_logic import flush_configs, load_configs, save_configs, set_config
+
+    path = os.path.join(data_dir, "configs.json")
+    data = load_configs(path)
+    out = os.path.join(data_dir, "configs-out.json")
+
+    def save():
+        save_configs(out, data)
+        flush_configs(out)
+
+    def set_one():
+        set_config(out, "profile-0", {"volume": next(edits)})
+        flush_configs(out)
+
+    edits = iter(range(10 ** 9))
+    return {
+        "configs:load": measure(lambda: load_configs(path), repeat),
+        "configs:save": measure(save, repeat),
+        "configs:set_one": measure(set_one, repeat),
+        "configs:save_coalesced": measure(_batched(lambda i: save_configs(out, data)), repeat),
+    }
+
+
+def run(data_dir: str, scale: str = "full", repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    manifest = prepare(data_dir, scale)
+    params = SCALES[scale]
+    results: Dict[str, Dict[str, float]] = {}
+    results.update(nutrient_benchmarks(data_dir, repeat))
+    results.update(problem_benchmarks(data_dir, repeat))
+    results.update(schedule_benchmarks(data_dir, repeat))
+    results.update(log_benchmarks(data_dir, repeat, manifest["tray_ids"]))
+    results.update(layout_benchmarks(data_dir, repeat, params["shelves"], params["trays"]))
+    results.update(config_benchmarks(data_dir, repeat))
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="full")
+    parser.add_argument("--data-dir", help="keep generated data here (default: a temporary directory)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    if args.data_dir:
+        results = run(args.data_dir, args.scale, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(tmp, args.scale, args.repeat)
+    return report(results, args.output, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
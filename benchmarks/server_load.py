@@ -0,0 +1,196 @@
+"""Load-test the JSON API server on loopback.
+
+Starts ``python -m gardenpip.server`` in a separate process on generated
+data (or targets a running server with ``--target``).  Then it keeps
+``--concurrency`` keep-alive connections busy for ``--duration`` seconds
+per scenario and reports requests per second and latency percentiles.
+
+Scenarios:
+
+* ``mixed`` – calculator, problem search, diagnosis, layout and log pages
+  over a small set of parameters, so most requests hit the response cache;
+* ``conditional`` – the same requests revalidated with ``If-None-Match``
+  (``304`` answers without a body);
+* ``uncached`` – problem searches whose parameters never repeat.
+
+Usage::
+
+    python benchmarks/server_load.py --concurrency 16 --duration 5
+    python benchmarks/server_load.py --target 192.168.1.20:8080 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import datagen  # noqa: E402
+from benchmarks.common import report  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare(data_dir: str, problems: int, logs: int) -> Dict[str, object]:
+    """Write reference data and a populated database into ``data_dir``."""
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {name: os.path.join(data_dir, name) for name in ("nutrients.json", "problems.json", "api.db")}
+    with open(paths["nutrients.json"], "w", encoding="utf-8") as fh:
+        json.dump(datagen.make_nutrients(10), fh)
+    with open(paths["problems.json"], "w", encoding="utf-8") as fh:
+        json.dump(datagen.make_problems(problems), fh)
+    tray_ids = datagen.populate_logs(paths["api.db"], logs)
+    return {"paths": paths, "tray_ids": tray_ids}
+
+
+def urls(tray_ids: List[int]) -> List[str]:
+    rng = random.Random(11)
+    out = []
+    for i in range(40):
+        stage = datagen.STAGES[i % len(datagen.STAGES)]
+        out.append(f"/api/nutrients/calculate?manufacturer=Maker+{i % 10}&series=Series+{i % 8}"
+                   f"&stage={stage.replace(' ', '+')}&volume={10 + i}&cal_mag=CalMag+{i % 5}")
+        words = "+".join(rng.sample(datagen.WORDS, 2))
+        out.append(f"/api/problems/search?q={words}&plant={datagen.PLANTS[i % len(datagen.PLANTS)]}&limit=20")
+        out.append(f"/api/logs?tray_id={tray_ids[i % len(tray_ids)]}&limit=50")
+    out.append("/api/layout?system=bench")
+    return out
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(paths: Dict[str, str], port: int, workers: Optional[int]) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "gardenpip.server", "--host", "127.0.0.1", "--port", str(port),
+           "--db", paths["api.db"], "--nutrients", paths["nutrients.json"],
+           "--problems", paths["problems.json"]]
+    if workers:
+        cmd += ["--workers", str(workers)]
+    proc = subprocess.Popen(cmd, cwd=ROOT)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1).read()
+            return proc
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError("server did not start")
+            time.sleep(0.1)
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str,
+                   path: str, etag: Optional[str]) -> Tuple[int, Optional[str]]:
+    extra = f"If-None-Match: {etag}\r\n" if etag else ""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n{extra}\r\n".encode("latin-1"))
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    status = int(head[0].split()[1])
+    headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in head[1:] if line)}
+    length = int(headers.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+    return status, headers.get("etag")
+
+
+async def _client(host: str, port: int, paths: List[str], duration: float, conditional: bool,
+                  fresh: bool, seed: int, latencies: List[float], errors: List[int]) -> None:
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    etags: Dict[str, str] = {}
+    end = time.perf_counter() + duration
+    n = 0
+    try:
+        while time.perf_counter() < end:
+            if fresh:
+                n += 1
+                path = f"/api/problems/search?q={rng.choice(datagen.WORDS)}&limit=20&offset={seed * 10 ** 6 + n}"
+            else:
+                path = rng.choice(paths)
+            start = time.perf_counter()
+            status, etag = await _request(reader, writer, host, path, etags.get(path) if conditional else None)
+            latencies.append(time.perf_counter() - start)
+            if status not in (200, 304):
+                errors.append(status)
+            if etag:
+                etags[path] = etag
+    finally:
+        writer.close()
+
+
+async def load(host: str, port: int, paths: List[str], concurrency: int, duration: float,
+               conditional: bool = False, fresh: bool = False) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors: List[int] = []
+    await asyncio.gather(*(
+        _client(host, port, paths, duration, conditional, fresh, seed, latencies, errors)
+        for seed in range(concurrency)
+    ))
+    ordered = sorted(latencies)
+    return {
+        "median": statistics.median(ordered),
+        "min": ordered[0],
+        "p99": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))],
+        "runs": len(ordered),
+        "rps": len(ordered) / duration,
+        "errors": len(errors),
+    }
+
+
+def run(host: str, port: int, paths: List[str], concurrency: int, duration: float) -> Dict[str, Dict[str, float]]:
+    # one pass to fill the response cache
+    asyncio.run(load(host, port, paths, 1, 0.2))
+    return {
+        "server:mixed": asyncio.run(load(host, port, paths, concurrency, duration)),
+        "server:conditional": asyncio.run(load(host, port, paths, concurrency, duration, conditional=True)),
+        "server:uncached": asyncio.run(load(host, port, paths, concurrency, duration, fresh=True)),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", help="HOST:PORT of a running server (default: start one)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--problems", type=int, default=5000)
+    parser.add_argument("--logs", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, help="server handler threads")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        # reference data on a remote server is unknown; only the layout and
+        # health endpoints are certain to answer
+        results = run(host, int(port), ["/api/health", "/api/layout"], args.concurrency, args.duration)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            data = prepare(tmp, args.problems, args.logs)
+            port = free_port()
+            proc = start_server(data["paths"], port, args.workers)
+            try:
+                results = run("127.0.0.1", port, urls(data["tray_ids"]), args.concurrency, args.duration)
+            finally:
+                proc.terminate()
+                proc.wait()
+    for name, result in sorted(results.items()):
+        print(f"{name}: {result['rps']:.0f} req/s, p99 {result['p99'] * 1e3:.2f} ms, "
+              f"{result['errors']} errors")
+    return report(results, args.output, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
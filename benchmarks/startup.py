@@ -0,0 +1,96 @@
+"""Measure Garden Pip start-up latency.
+
+Every sample runs in a fresh interpreter so module caches don't hide the
+cost of imports.  Two things are measured:
+
+* ``import:<module>`` – time to import each ``gardenpip`` module;
+* ``first_frame`` – time from launching ``main.py`` until Kivy has drawn
+  its first frame (skipped when Kivy isn't installed).
+
+Usage::
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --baseline startup.json --tolerance 0.25
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import report, summarize  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "gardenpip.config_logic",
+    "gardenpip.nutrient_logic",
+    "gardenpip.problem_logic",
+    "gardenpip.shelf_logic",
+    "gardenpip.schedule_log",
+    "gardenpip.db",
+]
+
+_IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def import_time(module: str, repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SNIPPET.format(module=module)],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return summarize(samples)
+
+
+def first_frame(repeat: int, timeout: float = 60.0) -> Optional[Dict[str, float]]:
+    if importlib.util.find_spec("kivy") is None:
+        return None
+    env = dict(os.environ, GARDENPIP_STARTUP_PROBE="1", KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1")
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.time()
+        out = subprocess.run(
+            [sys.executable, os.path.join(ROOT, "main.py")],
+            cwd=ROOT, env=env, capture_output=True, text=True, timeout=timeout,
+        ).stdout
+        for line in out.splitlines():
+            if line.startswith("{") and "first_frame" in line:
+                samples.append(json.loads(line)["first_frame"] - start)
+                break
+    return summarize(samples) if samples else None
+
+
+def run(repeat: int, frames: bool = True) -> Dict[str, Dict[str, float]]:
+    results = {f"import:{module}": import_time(module, repeat) for module in MODULES}
+    if frames:
+        frame = first_frame(repeat)
+        if frame is not None:
+            results["first_frame"] = frame
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-frame", action="store_true", help="skip the Kivy first-frame measurement")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    return report(run(args.repeat, not args.no_frame), args.output, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,46 @@
-import json
-import os
 from typing import Any, Dict
 
+from .docstore import get_store
+from .instrument import timed
 
+
+@timed()
 def load_configs(path: str) -> Dict[str, Any]:
-    """Load configuration entries from a JSON file."""
-    if not os.path.exists(path):
-        return {}
-    with open(path, 'r', encoding='utf-8') as fh:
-        return json.load(fh)
+    """Load configuration entries from a JSON file.
+
+    Reads are served from a cache that is revalidated against the file, and
+    include saves that haven't been written yet.
+    """
+    return get_store(path).load()
 
 
+@timed()
 def save_configs(path: str, data: Dict[str, Any]) -> None:
-    """Save configuration data to a JSON file."""
-    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as fh:
-        json.dump(data, fh, indent=2)
+    """Save configuration data to a JSON file.
+
+    The write is atomic and may be delayed briefly so that quick successive
+    saves are written once; call :func:`flush_configs` to write it now.
+    """
+    get_store(path).save(data)
+
+
+@timed()
+def get_config(path: str, name: str, default: Any = None) -> Any:
+    """Return one named configuration entry."""
+    return get_store(path).get(name, default)
+
+
+@timed()
+def set_config(path: str, name: str, value: Any) -> None:
+    """Save one named configuration entry without re-encoding the others."""
+    get_store(path).set(name, value)
+
+
+def delete_config(path: str, name: str) -> None:
+    """Remove one named configuration entry if it exists."""
+    get_store(path).delete(name)
+
+
+def flush_configs(path: str) -> None:
+    """Write pending configuration changes to disk now."""
+    get_store(path).flush()
@@ -0,0 +1,78 @@
+"""Garden Pip database layer.
+
+One SQLite file (:data:`DEFAULT_DB_PATH`) holds the shelf layout and the
+nutrient logs.  Its schema is versioned and migrated forward on first use.
+"""
+from .anomaly import add_alert_listener, check_readings, recent_alerts, remove_alert_listener
+from .engine import (
+    DEFAULT_DB_PATH,
+    dispose_engines,
+    get_engine,
+    get_session,
+    session_scope,
+)
+from .history import HistoryPoint, nutrient_history, pick_resolution
+from .logs import (
+    NutrientLogWriter,
+    add_nutrient_log,
+    add_nutrient_logs,
+    delete_nutrient_log,
+    notes_match,
+    search_nutrient_logs,
+    search_nutrient_logs_page,
+    update_nutrient_log,
+    upsert_nutrient_logs,
+)
+from .migrations import LATEST_VERSION, migrate
+from .models import (
+    Base,
+    NutrientAlert,
+    NutrientLog,
+    NutrientLogChange,
+    NutrientLogRollup,
+    ReplicatedLog,
+    ReplicatedScheduleEntry,
+    Shelf,
+    ShelfSystem,
+    SyncState,
+    Tray,
+    TrayStats,
+)
+
+__all__ = [
+    "Base",
+    "DEFAULT_DB_PATH",
+    "HistoryPoint",
+    "LATEST_VERSION",
+    "NutrientAlert",
+    "NutrientLog",
+    "NutrientLogChange",
+    "NutrientLogRollup",
+    "NutrientLogWriter",
+    "ReplicatedLog",
+    "ReplicatedScheduleEntry",
+    "Shelf",
+    "ShelfSystem",
+    "SyncState",
+    "Tray",
+    "TrayStats",
+    "add_alert_listener",
+    "add_nutrient_log",
+    "add_nutrient_logs",
+    "check_readings",
+    "delete_nutrient_log",
+    "dispose_engines",
+    "get_engine",
+    "get_session",
+    "migrate",
+    "notes_match",
+    "nutrient_history",
+    "pick_resolution",
+    "recent_alerts",
+    "remove_alert_listener",
+    "search_nutrient_logs",
+    "search_nutrient_logs_page",
+    "session_scope",
+    "update_nutrient_log",
+    "upsert_nutrient_logs",
+]
@@ -0,0 +1,168 @@
+"""Online anomaly detection over logged pH/ppm readings.
+
+Every new reading written through :func:`add_nutrient_log`,
+:func:`add_nutrient_logs` (and so the buffered writer and the probe
+ingest service) or :func:`upsert_nutrient_logs` updates its tray's
+:class:`TrayStats` row in the same transaction.  That row holds exponentially weighted moving averages and
+variances of pH and ppm and of their rate of change per hour.  A reading
+more than :data:`THRESHOLD` standard deviations from its tray's average
+is recorded as a :class:`NutrientAlert`.  So is a reading that changed
+unusually fast.  The work per reading is constant however long the history
+is, and a restart continues from the stored state.
+
+Statistics only move forward: editing or deleting a logged reading does
+not rewind them.  Deleting a tray through
+:func:`gardenpip.shelf_logic.save_system_layout` deletes its statistics
+and alerts, so a new tray that reuses the id starts from scratch.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import NutrientAlert, TrayStats
+
+# weight of the newest reading in the moving averages
+ALPHA = 0.1
+# readings a tray needs before it can raise alerts
+WARMUP = 10
+# alert when a reading is this many standard deviations off
+THRESHOLD = 4.0
+METRICS = ("ph", "ppm")
+# smallest standard deviations assumed, so a very steady tray doesn't
+# alert on ordinary noise
+MIN_STD = {"ph": 0.05, "ppm": 15.0}
+MIN_RATE_STD = {"ph": 0.05, "ppm": 20.0}  # per hour
+# readings closer together than this count as this far apart for rates
+MIN_RATE_HOURS = 0.25
+
+# (log id, tray id, date, ph, ppm)
+Reading = Tuple[Optional[int], int, _dt.datetime, float, float]
+# (metric, kind, value, expected, score)
+Anomaly = Tuple[str, str, float, float, float]
+
+_listeners: List[Callable[[List[NutrientAlert]], None]] = []
+
+
+def add_alert_listener(fn: Callable[[List[NutrientAlert]], None]) -> None:
+    """Call ``fn`` with the new alerts after each write that raised any."""
+    _listeners.append(fn)
+
+
+def remove_alert_listener(fn: Callable[[List[NutrientAlert]], None]) -> None:
+    _listeners.remove(fn)
+
+
+def notify(alerts: List[NutrientAlert]) -> None:
+    """Pass committed ``alerts`` to the listeners."""
+    if alerts:
+        for fn in list(_listeners):
+            fn(alerts)
+
+
+def _score(value: float, mean: float, var: float, min_std: float) -> float:
+    return abs(value - mean) / math.sqrt(max(var, min_std * min_std))
+
+
+def _ewma(mean: float, var: float, value: float) -> Tuple[float, float]:
+    diff = value - mean
+    incr = ALPHA * diff
+    return mean + incr, (1 - ALPHA) * (var + diff * incr)
+
+
+_FIELDS = ("count", "last_date") + tuple(
+    f"{m}{suffix}" for m in METRICS for suffix in ("_last", "_mean", "_var", "_rate_mean", "_rate_var")
+)
+
+
+def new_stats() -> Dict[str, object]:
+    """State of a tray without readings."""
+    state: Dict[str, object] = dict.fromkeys(_FIELDS, 0.0)
+    state.update(count=0, last_date=None)
+    return state
+
+
+def observe(state: Dict[str, object], date: _dt.datetime, ph: float, ppm: float) -> List[Anomaly]:
+    """Fold one reading into a tray's ``state``; return the anomalies it shows.
+
+    ``state`` maps the :class:`TrayStats` columns to their values.
+    """
+    found: List[Anomaly] = []
+    count = state["count"]
+    last_date = state["last_date"]
+    warm = count >= WARMUP
+    latest = last_date is None or date >= last_date
+    hours = None
+    if last_date is not None and latest:
+        hours = max((date - last_date).total_seconds() / 3600, MIN_RATE_HOURS)
+    for metric, value in (("ph", ph), ("ppm", ppm)):
+        if count == 0:
+            state[f"{metric}_mean"] = value
+        else:
+            mean, var = state[f"{metric}_mean"], state[f"{metric}_var"]
+            if warm:
+                score = _score(value, mean, var, MIN_STD[metric])
+                if score > THRESHOLD:
+                    found.append((metric, "level", value, mean, score))
+            state[f"{metric}_mean"], state[f"{metric}_var"] = _ewma(mean, var, value)
+        if hours is not None:
+            rate = (value - state[f"{metric}_last"]) / hours
+            mean, var = state[f"{metric}_rate_mean"], state[f"{metric}_rate_var"]
+            if warm:
+                score = _score(rate, mean, var, MIN_RATE_STD[metric])
+                if score > THRESHOLD:
+                    found.append((metric, "rate", rate, mean, score))
+            state[f"{metric}_rate_mean"], state[f"{metric}_rate_var"] = _ewma(mean, var, rate)
+        if latest:
+            state[f"{metric}_last"] = value
+    if latest:
+        state["last_date"] = date
+    state["count"] = count + 1
+    return found
+
+
+def check_readings(session: Session, readings: Iterable[Reading]) -> List[NutrientAlert]:
+    """Update tray statistics for newly logged ``readings`` and add alerts.
+
+    Runs inside the caller's transaction; nothing is committed.  Returns
+    the alerts added to ``session``.
+    """
+    readings = sorted(readings, key=lambda r: r[2])
+    if not readings:
+        return []
+    tray_ids = {r[1] for r in readings}
+    # populate_existing: a long-lived session must not reuse stale state
+    stmt = select(TrayStats).where(TrayStats.tray_id.in_(tray_ids)).execution_options(populate_existing=True)
+    rows: Dict[int, TrayStats] = {s.tray_id: s for s in session.scalars(stmt)}
+    # plain dicts while folding in the batch; ORM attributes are written once
+    states = {tray_id: {f: getattr(row, f) for f in _FIELDS} for tray_id, row in rows.items()}
+    for tray_id in tray_ids - rows.keys():
+        states[tray_id] = new_stats()
+        rows[tray_id] = TrayStats(tray_id=tray_id)
+        session.add(rows[tray_id])
+    alerts = []
+    for log_id, tray_id, date, ph, ppm in readings:
+        for metric, kind, value, expected, score in observe(states[tray_id], date, ph, ppm):
+            alerts.append(NutrientAlert(tray_id=tray_id, log_id=log_id, date=date, metric=metric,
+                                        kind=kind, value=value, expected=expected, score=score))
+    for tray_id, state in states.items():
+        row = rows[tray_id]
+        for field, value in state.items():
+            setattr(row, field, value)
+    session.add_all(alerts)
+    return alerts
+
+
+def recent_alerts(session: Session, tray_id: Optional[int] = None, since: Optional[_dt.datetime] = None,
+                  limit: int = 100) -> Sequence[NutrientAlert]:
+    """Return alerts newest first, optionally for one tray or after ``since``."""
+    stmt = select(NutrientAlert)
+    if tray_id is not None:
+        stmt = stmt.where(NutrientAlert.tray_id == tray_id)
+    if since is not None:
+        stmt = stmt.where(NutrientAlert.date >= since)
+    return session.scalars(stmt.order_by(NutrientAlert.date.desc(), NutrientAlert.id.desc()).limit(limit)).all()
@@ -0,0 +1,100 @@
+"""Engine registry and session helpers."""
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..instrument import instrument_engine
+from .migrations import import_legacy_layout, migrate
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The single database used by the application.
+DEFAULT_DB_PATH = os.path.join(_ROOT, "gardenpip.db")
+# Shelf layouts used to live in a separate file; it is imported once.
+LEGACY_LAYOUT_DB_PATH = os.path.join(_ROOT, "gardenpip", "garden.db")
+
+POOL_SIZE = 5
+MAX_OVERFLOW = 5
+
+# absolute database path -> (engine, session factory)
+_engines: Dict[str, Tuple[Engine, sessionmaker]] = {}
+_engines_lock = threading.Lock()
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record) -> None:
+    # WAL lets readers run alongside the writer and, with synchronous=NORMAL,
+    # a commit no longer waits for an fsync of the main database file.
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
+
+
+def _registry_entry(db_path: Optional[str]) -> Tuple[Engine, sessionmaker]:
+    key = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    entry = _engines.get(key)
+    if entry is not None:
+        return entry
+    with _engines_lock:
+        entry = _engines.get(key)
+        if entry is None:
+            engine = create_engine(
+                f"sqlite:///{key}",
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+            )
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+            instrument_engine(engine)
+            migrate(engine)
+            if key == DEFAULT_DB_PATH:
+                import_legacy_layout(engine, LEGACY_LAYOUT_DB_PATH)
+            # Objects stay loaded after commit, so callers don't pay a
+            # SELECT to read back what they just wrote.
+            factory = sessionmaker(bind=engine, expire_on_commit=False)
+            entry = _engines[key] = (engine, factory)
+        return entry
+
+
+def get_engine(db_path: Optional[str] = None) -> Engine:
+    """Return the shared engine for ``db_path``, migrating its schema once.
+
+    ``db_path`` defaults to :data:`DEFAULT_DB_PATH`.
+    """
+    return _registry_entry(db_path)[0]
+
+
+def get_session(db_path: Optional[str] = None) -> Session:
+    """Return a SQLAlchemy :class:`Session` for the given SQLite path.
+
+    Sessions share one pooled engine per database file.
+    """
+    return _registry_entry(db_path)[1]()
+
+
+@contextmanager
+def session_scope(db_path: Optional[str] = None) -> Iterator[Session]:
+    """Yield a session that commits on success and is always closed."""
+    session = get_session(db_path)
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def dispose_engines() -> None:
+    """Close every pooled connection and forget the registered engines."""
+    with _engines_lock:
+        for engine, _ in _engines.values():
+            engine.dispose()
+        _engines.clear()
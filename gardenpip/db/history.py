@@ -0,0 +1,97 @@
+"""Downsampled pH/ppm history for charts.
+
+Raw readings live in ``nutrient_logs``; hourly, daily and weekly
+aggregates are kept current in ``nutrient_log_rollups`` by triggers.
+:func:`nutrient_history` reads from the finest source that fits the
+caller's point budget.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+from typing import List, NamedTuple, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..instrument import timed
+from .models import NutrientLog, NutrientLogRollup
+
+# finest first
+RESOLUTIONS = ("raw", "hour", "day", "week")
+
+
+class HistoryPoint(NamedTuple):
+    time: _dt.datetime
+    count: int
+    ph_mean: float
+    ph_min: float
+    ph_max: float
+    ppm_mean: float
+    ppm_min: float
+    ppm_max: float
+
+
+def _count_at_most(session: Session, stmt, limit: int) -> int:
+    """Count rows of ``stmt`` but stop looking after ``limit + 1``."""
+    return session.execute(select(func.count()).select_from(stmt.limit(limit + 1).subquery())).scalar()
+
+
+def _raw_query(tray_id: int, start: _dt.datetime, end: _dt.datetime):
+    return select(NutrientLog.date, NutrientLog.ph, NutrientLog.ppm).where(
+        NutrientLog.tray_id == tray_id, NutrientLog.date >= start, NutrientLog.date < end
+    )
+
+
+def _rollup_query(tray_id: int, resolution: str, start: _dt.datetime, end: _dt.datetime):
+    # A bucket is included if it starts inside the window.
+    return select(NutrientLogRollup).where(
+        NutrientLogRollup.tray_id == tray_id,
+        NutrientLogRollup.resolution == resolution,
+        NutrientLogRollup.bucket >= start,
+        NutrientLogRollup.bucket < end,
+    )
+
+
+def pick_resolution(session: Session, tray_id: int, start: _dt.datetime, end: _dt.datetime,
+                    max_points: int = 500) -> str:
+    """Return the finest resolution with at most ``max_points`` points in the window.
+
+    Falls back to ``"week"`` when even that has more points.
+    """
+    if _count_at_most(session, _raw_query(tray_id, start, end), max_points) <= max_points:
+        return "raw"
+    for resolution in RESOLUTIONS[1:-1]:
+        stmt = _rollup_query(tray_id, resolution, start, end)
+        if _count_at_most(session, stmt, max_points) <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+@timed()
+def nutrient_history(
+    session: Session,
+    tray_id: int,
+    start: _dt.datetime,
+    end: _dt.datetime,
+    max_points: int = 500,
+) -> Tuple[str, List[HistoryPoint]]:
+    """Return ``(resolution, points)`` for a tray between ``start`` and ``end``.
+
+    Points are oldest first.  Raw readings are returned as points with a
+    count of one.
+    """
+    resolution = pick_resolution(session, tray_id, start, end, max_points)
+    if resolution == "raw":
+        rows = session.execute(_raw_query(tray_id, start, end).order_by(NutrientLog.date)).all()
+        return resolution, [HistoryPoint(d, 1, ph, ph, ph, ppm, ppm, ppm) for d, ph, ppm in rows]
+    rollups = session.scalars(
+        _rollup_query(tray_id, resolution, start, end).order_by(NutrientLogRollup.bucket)
+    ).all()
+    return resolution, [
+        HistoryPoint(
+            r.bucket, r.count,
+            r.ph_sum / r.count, r.ph_min, r.ph_max,
+            r.ppm_sum / r.count, r.ppm_min, r.ppm_max,
+        )
+        for r in rollups
+    ]
@@ -0,0 +1,366 @@
+"""Nutrient log reads and writes."""
+from __future__ import annotations
+
+import datetime as _dt
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    bindparam,
+    insert,
+    or_,
+    select,
+    text as sql_text,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from ..instrument import timed
+from .anomaly import check_readings, notify
+from .engine import get_session
+from .models import NutrientLog
+
+logger = logging.getLogger(__name__)
+
+# Core view of the FTS table created by the notes-search migration.
+_fts_table = Table(
+    "nutrient_logs_fts",
+    MetaData(),
+    Column("rowid", Integer),
+    Column("notes", String),
+)
+
+# engine URL -> whether the database has the FTS table
+_fts_available: Dict[str, bool] = {}
+
+_TERM_RE = re.compile(r"[^\W_]+")
+
+
+def _uses_fts(session: Session) -> bool:
+    bind = session.get_bind()
+    key = str(bind.url)
+    available = _fts_available.get(key)
+    if available is None:
+        row = session.execute(
+            sql_text("SELECT 1 FROM sqlite_master WHERE name = 'nutrient_logs_fts'")
+        ).first()
+        available = _fts_available[key] = row is not None
+    return available
+
+
+def _match_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every term, as a prefix."""
+    terms = _TERM_RE.findall(text.lower())
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _notes_like(text: str):
+    """Substring filter on the notes, with ``%`` and ``_`` taken literally."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return NutrientLog.notes.ilike(f"%{escaped}%", escape="\\")
+
+
+# ── CRUD helper functions ─────────────────────────────────────────────────────
+
+@timed()
+def add_nutrient_log(session: Session, tray_id: int, date: Optional[_dt.datetime] = None,
+                     ph: float = 0.0, ppm: float = 0.0, notes: str = "") -> NutrientLog:
+    log = NutrientLog(tray_id=tray_id, date=date or _dt.datetime.utcnow(), ph=ph, ppm=ppm, notes=notes)
+    session.add(log)
+    session.flush()
+    alerts = check_readings(session, [(log.id, tray_id, log.date, ph, ppm)])
+    session.commit()
+    notify(alerts)
+    return log
+
+
+@timed()
+def update_nutrient_log(session: Session, log_id: int, **kwargs) -> Optional[NutrientLog]:
+    log = session.get(NutrientLog, log_id)
+    if not log:
+        return None
+    for key, val in kwargs.items():
+        if hasattr(log, key):
+            setattr(log, key, val)
+    session.commit()
+    return log
+
+
+@timed()
+def delete_nutrient_log(session: Session, log_id: int) -> bool:
+    log = session.get(NutrientLog, log_id)
+    if not log:
+        return False
+    session.delete(log)
+    session.commit()
+    return True
+
+
+_LOG_COLUMNS = ("id", "tray_id", "date", "ph", "ppm", "notes")
+
+
+def _log_rows(rows: Iterable[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+    out = []
+    now = _dt.datetime.utcnow()
+    for row in rows:
+        values = {key: row[key] for key in _LOG_COLUMNS if key in row}
+        values.setdefault("date", now)
+        values.setdefault("ph", 0.0)
+        values.setdefault("ppm", 0.0)
+        values.setdefault("notes", "")
+        out.append(values)
+    return out
+
+
+@timed()
+def add_nutrient_logs(session: Session, rows: Iterable[Mapping[str, Any]]) -> int:
+    """Insert many logs in one executemany and a single commit.
+
+    ``rows`` are mappings with the :class:`NutrientLog` columns; ``date``
+    defaults to now.  Returns the number of rows inserted.
+    """
+    values = _log_rows(rows)
+    alerts = check_readings(session, _insert_logs(session, values))
+    session.commit()
+    notify(alerts)
+    return len(values)
+
+
+_READING_COLUMNS = (NutrientLog.id, NutrientLog.tray_id, NutrientLog.date, NutrientLog.ph, NutrientLog.ppm)
+
+
+def _insert_logs(session: Session, values: List[Dict[str, Any]]) -> List[tuple]:
+    """Insert new log rows; return their readings for the anomaly detector."""
+    if not values:
+        return []
+    # RETURNING makes SQLAlchemy batch the rows into multi-row INSERTs,
+    # which is faster than executemany.  Rows come back in no particular
+    # order, so the reading is taken from them rather than from ``values``.
+    stmt = insert(NutrientLog).returning(*_READING_COLUMNS)
+    return [tuple(row) for row in session.execute(stmt, values)]
+
+
+@timed()
+def upsert_nutrient_logs(session: Session, rows: Iterable[Mapping[str, Any]]) -> int:
+    """Insert logs, replacing the columns of rows whose ``id`` already exists.
+
+    Only the columns a row supplies are replaced; defaults fill in the rest
+    when a keyed row is inserted.  Keyed rows without ``tray_id`` only
+    update existing logs.
+    """
+    rows = list(rows)
+    keyed = [row for row in rows if "id" in row]
+    fresh = _log_rows(row for row in rows if "id" not in row)
+    # Row sets with different keys can't share one executemany, and each
+    # replaces its own columns.
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in keyed:
+        cols = tuple(sorted(key for key in _LOG_COLUMNS if key in row))
+        groups.setdefault(cols, []).append(row)
+    # keyed rows that insert a log are new readings too
+    inserted = {row["id"] for row in keyed if "tray_id" in row}
+    if inserted:
+        inserted -= set(session.scalars(select(NutrientLog.id).where(NutrientLog.id.in_(inserted))))
+    for cols, group in groups.items():
+        updated = [col for col in cols if col != "id"]
+        if "tray_id" not in cols:
+            # can't be inserted without a tray, so only existing rows change
+            if updated:
+                table = NutrientLog.__table__
+                stmt = (
+                    update(table)
+                    .where(table.c.id == bindparam("_id"))
+                    .values({col: bindparam(f"_{col}") for col in updated})
+                )
+                session.connection().execute(stmt, [{f"_{col}": row[col] for col in cols} for row in group])
+            continue
+        stmt = sqlite_insert(NutrientLog)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[NutrientLog.id],
+            set_={col: stmt.excluded[col] for col in updated},
+        )
+        session.execute(stmt, _log_rows(group))
+    # replaced rows may be corrections of old readings, so only new rows
+    # reach the anomaly detector
+    readings = _insert_logs(session, fresh)
+    if inserted:
+        readings += [tuple(row) for row in session.execute(
+            select(*_READING_COLUMNS).where(NutrientLog.id.in_(inserted))
+        )]
+    alerts = check_readings(session, readings)
+    session.commit()
+    notify(alerts)
+    return len(rows)
+
+
+class NutrientLogWriter:
+    """Buffer log rows and write them in batches.
+
+    Rows are flushed with :func:`add_nutrient_logs` once ``max_rows`` are
+    buffered or the oldest buffered row is ``max_delay`` seconds old.  The
+    writer uses its own session and background thread, so :meth:`write`
+    may be called from any thread.  Rows of a failed write stay buffered
+    and the background thread retries them after ``max_delay``.
+    """
+
+    def __init__(self, db_path: str, max_rows: int = 500, max_delay: float = 1.0) -> None:
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._session = get_session(db_path)
+        self._buffer: List[Dict[str, Any]] = []
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="NutrientLogWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, tray_id: int, ph: float, ppm: float, date: Optional[_dt.datetime] = None,
+              notes: str = "") -> None:
+        row = {"tray_id": tray_id, "ph": ph, "ppm": ppm, "notes": notes,
+               "date": date or _dt.datetime.utcnow()}
+        self.write_many([row])
+
+    def write_many(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.extend(dict(row) for row in rows)
+            full = len(self._buffer) >= self.max_rows
+            if not full:
+                self._cond.notify()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write buffered rows now; returns how many were written.
+
+        If the write fails the rows go back to the front of the buffer and
+        the error is raised.
+        """
+        with self._write_lock:
+            with self._cond:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                return add_nutrient_logs(self._session, rows)
+            except Exception:
+                self._session.rollback()
+                with self._cond:
+                    if not self._buffer:
+                        self._oldest = time.monotonic()
+                    self._buffer[:0] = rows
+                raise
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._buffer:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                remaining = self.max_delay - (time.monotonic() - self._oldest)
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            try:
+                self.flush()
+            except Exception:
+                # e.g. "database is locked"; the rows are buffered again
+                logger.exception("writing buffered nutrient logs failed; retrying in %.1fs", self.max_delay)
+                with self._cond:
+                    self._oldest = time.monotonic()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+        self._session.close()
+
+    def __enter__(self) -> "NutrientLogWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def search_nutrient_logs(session: Session, text: str | None = None, tray_id: int | None = None) -> Iterable[NutrientLog]:
+    """Return logs whose notes match ``text``.
+
+    Each word of ``text`` matches as a token prefix through the FTS index,
+    and results are ranked by relevance, newest first among equals.
+    Without a text filter the logs are returned newest first.
+    """
+    query = session.query(NutrientLog)
+    match = _match_query(text) if text else None
+    if tray_id is not None:
+        query = query.filter(NutrientLog.tray_id == tray_id)
+    if match and _uses_fts(session):
+        query = (
+            query.join(_fts_table, _fts_table.c.rowid == NutrientLog.id)
+            .filter(_fts_table.c.notes.op("MATCH")(match))
+            .order_by(sql_text("bm25(nutrient_logs_fts)"))
+        )
+    elif text:
+        query = query.filter(_notes_like(text))
+    return query.order_by(NutrientLog.date.desc()).all()
+
+
+def notes_match(text: str, notes: Optional[str]) -> bool:
+    """Return ``True`` if ``notes`` matches the search ``text``.
+
+    Mirrors the filter used by :func:`search_nutrient_logs` so callers can
+    narrow an already loaded result set in memory.
+    """
+    terms = _TERM_RE.findall(text.lower())
+    if not terms:
+        return text.lower() in (notes or "").lower()
+    words = _TERM_RE.findall((notes or "").lower())
+    return all(any(word.startswith(term) for word in words) for term in terms)
+
+
+@timed()
+def search_nutrient_logs_page(
+    session: Session,
+    text: str | None = None,
+    tray_id: int | None = None,
+    after: Optional[Tuple[_dt.datetime, int]] = None,
+    limit: int = 100,
+) -> List[NutrientLog]:
+    """Return one page of logs, newest first.
+
+    ``after`` is the ``(date, id)`` of the last row of the previous page.
+    """
+    query = session.query(NutrientLog)
+    match = _match_query(text) if text else None
+    if match and _uses_fts(session):
+        matching = select(_fts_table.c.rowid).where(_fts_table.c.notes.op("MATCH")(match))
+        query = query.filter(NutrientLog.id.in_(matching))
+    elif text:
+        query = query.filter(_notes_like(text))
+    if tray_id is not None:
+        query = query.filter(NutrientLog.tray_id == tray_id)
+    if after is not None:
+        date, log_id = after
+        query = query.filter(
+            or_(NutrientLog.date < date, and_(NutrientLog.date == date, NutrientLog.id < log_id))
+        )
+    return query.order_by(NutrientLog.date.desc(), NutrientLog.id.desc()).limit(limit).all()
@@ -0,0 +1,316 @@
+"""Versioned schema migrations.
+
+Each entry of :data:`MIGRATIONS` moves the schema forward by one version.
+The current version is stored in the ``schema_version`` table and
+:func:`migrate` applies whatever steps a database has not seen yet.  Steps
+are written so that re-running one against a partly migrated file is
+harmless.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, func, insert, inspect, select, text as sql_text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from .models import (
+    NutrientAlert,
+    NutrientLog,
+    NutrientLogChange,
+    NutrientLogRollup,
+    ReplicatedLog,
+    ReplicatedScheduleEntry,
+    Shelf,
+    ShelfSystem,
+    SyncState,
+    Tray,
+    TrayStats,
+)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, nullable=False),
+)
+
+
+def _create_core_tables(conn: Connection) -> None:
+    # Layout databases created by the old db_models module named the shelf
+    # column ``name``.
+    if inspect(conn).has_table("shelves"):
+        columns = {col["name"] for col in inspect(conn).get_columns("shelves")}
+        if "name" in columns and "label" not in columns:
+            conn.execute(sql_text("ALTER TABLE shelves RENAME COLUMN name TO label"))
+    for model in (ShelfSystem, Shelf, Tray, NutrientLog):
+        model.__table__.create(conn, checkfirst=True)
+
+
+# External-content FTS5 table kept in sync with nutrient_logs by triggers.
+_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS nutrient_logs_fts
+       USING fts5(notes, content='nutrient_logs', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS nutrient_logs_fts_ai AFTER INSERT ON nutrient_logs BEGIN
+           INSERT INTO nutrient_logs_fts(rowid, notes) VALUES (new.id, new.notes);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS nutrient_logs_fts_ad AFTER DELETE ON nutrient_logs BEGIN
+           INSERT INTO nutrient_logs_fts(nutrient_logs_fts, rowid, notes) VALUES ('delete', old.id, old.notes);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS nutrient_logs_fts_au AFTER UPDATE OF notes ON nutrient_logs BEGIN
+           INSERT INTO nutrient_logs_fts(nutrient_logs_fts, rowid, notes) VALUES ('delete', old.id, old.notes);
+           INSERT INTO nutrient_logs_fts(rowid, notes) VALUES (new.id, new.notes);
+       END""",
+]
+
+
+def _add_notes_search(conn: Connection) -> None:
+    for index in NutrientLog.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    try:
+        for ddl in _FTS_DDL:
+            conn.execute(sql_text(ddl))
+    except OperationalError:
+        # SQLite built without FTS5; searches fall back to LIKE.
+        return
+    # index rows written before the FTS table existed
+    conn.execute(sql_text("INSERT INTO nutrient_logs_fts(nutrient_logs_fts) VALUES ('rebuild')"))
+
+
+# resolution -> (SQLite modifiers giving the bucket start, modifier for its end)
+# Bucket starts use the same text format SQLAlchemy stores datetimes in, so
+# they compare correctly against bound datetime parameters.
+ROLLUP_BUCKETS = {
+    "hour": ("'%Y-%m-%d %H:00:00.000000', {d}", "'+1 hour'"),
+    "day": ("'%Y-%m-%d 00:00:00.000000', {d}", "'+1 day'"),
+    "week": ("'%Y-%m-%d 00:00:00.000000', {d}, 'weekday 0', '-6 days'", "'+7 days'"),
+}
+
+_ROLLUP_COLUMNS = "tray_id, resolution, bucket, count, ph_sum, ph_min, ph_max, ppm_sum, ppm_min, ppm_max"
+
+
+def _bucket_start(resolution: str, date: str) -> str:
+    return f"strftime({ROLLUP_BUCKETS[resolution][0].format(d=date)})"
+
+
+def _bucket_end(resolution: str, date: str) -> str:
+    return f"datetime({_bucket_start(resolution, date)}, {ROLLUP_BUCKETS[resolution][1]})"
+
+
+def _rollup_add(resolution: str) -> str:
+    return f"""
+        INSERT INTO nutrient_log_rollups ({_ROLLUP_COLUMNS})
+        VALUES (new.tray_id, '{resolution}', {_bucket_start(resolution, 'new.date')}, 1,
+                new.ph, new.ph, new.ph, new.ppm, new.ppm, new.ppm)
+        ON CONFLICT (tray_id, resolution, bucket) DO UPDATE SET
+            count = count + 1,
+            ph_sum = ph_sum + excluded.ph_sum,
+            ph_min = min(ph_min, excluded.ph_min),
+            ph_max = max(ph_max, excluded.ph_max),
+            ppm_sum = ppm_sum + excluded.ppm_sum,
+            ppm_min = min(ppm_min, excluded.ppm_min),
+            ppm_max = max(ppm_max, excluded.ppm_max);"""
+
+
+def _rollup_recompute(resolution: str, row: str) -> str:
+    # Min and max can't be decremented, so a bucket that lost or changed a
+    # reading is recomputed from the raw rows it covers.
+    start = _bucket_start(resolution, f"{row}.date")
+    return f"""
+        DELETE FROM nutrient_log_rollups
+         WHERE tray_id = {row}.tray_id AND resolution = '{resolution}' AND bucket = {start};
+        INSERT INTO nutrient_log_rollups ({_ROLLUP_COLUMNS})
+        SELECT {row}.tray_id, '{resolution}', {start}, count(*),
+               sum(ph), min(ph), max(ph), sum(ppm), min(ppm), max(ppm)
+          FROM nutrient_logs
+         WHERE tray_id = {row}.tray_id
+           AND date >= {start} AND date < {_bucket_end(resolution, f"{row}.date")}
+        HAVING count(*) > 0;"""
+
+
+def _add_rollups(conn: Connection) -> None:
+    NutrientLogRollup.__table__.create(conn, checkfirst=True)
+    adds = "".join(_rollup_add(res) for res in ROLLUP_BUCKETS)
+    old = "".join(_rollup_recompute(res, "old") for res in ROLLUP_BUCKETS)
+    new = "".join(_rollup_recompute(res, "new") for res in ROLLUP_BUCKETS)
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS nutrient_log_rollups_ai AFTER INSERT ON nutrient_logs BEGIN {adds} END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS nutrient_log_rollups_ad AFTER DELETE ON nutrient_logs BEGIN {old} END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS nutrient_log_rollups_au "
+        f"AFTER UPDATE OF tray_id, date, ph, ppm ON nutrient_logs BEGIN {old}{new} END"
+    )
+    # backfill from existing logs
+    conn.execute(sql_text("DELETE FROM nutrient_log_rollups"))
+    for res in ROLLUP_BUCKETS:
+        start = _bucket_start(res, "date")
+        conn.exec_driver_sql(f"""
+            INSERT INTO nutrient_log_rollups ({_ROLLUP_COLUMNS})
+            SELECT tray_id, '{res}', {start}, count(*),
+                   sum(ph), min(ph), max(ph), sum(ppm), min(ppm), max(ppm)
+              FROM nutrient_logs GROUP BY tray_id, {start}""")
+
+
+# Every write to nutrient_logs replaces the log's change row, which gives it
+# the next sequence number.  (Not INSERT OR REPLACE: an upsert on
+# nutrient_logs would override that conflict clause.)
+_CHANGE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS nutrient_log_changes_ai AFTER INSERT ON nutrient_logs BEGIN
+           DELETE FROM nutrient_log_changes WHERE log_id = new.id;
+           INSERT INTO nutrient_log_changes (log_id, deleted) VALUES (new.id, 0);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS nutrient_log_changes_au AFTER UPDATE ON nutrient_logs BEGIN
+           DELETE FROM nutrient_log_changes WHERE log_id = new.id;
+           INSERT INTO nutrient_log_changes (log_id, deleted) VALUES (new.id, 0);
+       END""",
+    # changing a log's id removes the old one
+    """CREATE TRIGGER IF NOT EXISTS nutrient_log_changes_aui AFTER UPDATE OF id ON nutrient_logs
+       WHEN old.id != new.id BEGIN
+           DELETE FROM nutrient_log_changes WHERE log_id = old.id;
+           INSERT INTO nutrient_log_changes (log_id, deleted) VALUES (old.id, 1);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS nutrient_log_changes_ad AFTER DELETE ON nutrient_logs BEGIN
+           DELETE FROM nutrient_log_changes WHERE log_id = old.id;
+           INSERT INTO nutrient_log_changes (log_id, deleted) VALUES (old.id, 1);
+       END""",
+]
+
+
+def _add_change_log(conn: Connection) -> None:
+    for model in (NutrientLogChange, SyncState, ReplicatedLog, ReplicatedScheduleEntry):
+        model.__table__.create(conn, checkfirst=True)
+    for index in ReplicatedLog.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    for ddl in _CHANGE_DDL:
+        conn.execute(sql_text(ddl))
+    # existing logs are all changes a peer hasn't seen yet
+    conn.execute(sql_text(
+        "INSERT OR IGNORE INTO nutrient_log_changes (log_id, deleted) "
+        "SELECT id, 0 FROM nutrient_logs ORDER BY id"
+    ))
+
+
+def _add_anomaly_state(conn: Connection) -> None:
+    TrayStats.__table__.create(conn, checkfirst=True)
+    NutrientAlert.__table__.create(conn, checkfirst=True)
+    for index in NutrientAlert.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    # Seed each tray with the mean and variance of its whole history and
+    # its latest reading, instead of replaying every row through the
+    # moving averages.
+    conn.exec_driver_sql("""
+        INSERT OR IGNORE INTO tray_stats
+            (tray_id, count, last_date, ph_last, ppm_last, ph_mean, ph_var, ppm_mean, ppm_var,
+             ph_rate_mean, ph_rate_var, ppm_rate_mean, ppm_rate_var)
+        SELECT agg.tray_id, agg.n, last.date, last.ph, last.ppm,
+               agg.ph_mean, max(agg.ph_sq - agg.ph_mean * agg.ph_mean, 0),
+               agg.ppm_mean, max(agg.ppm_sq - agg.ppm_mean * agg.ppm_mean, 0),
+               0, 0, 0, 0
+          FROM (SELECT tray_id, count(*) AS n, avg(ph) AS ph_mean, avg(ph * ph) AS ph_sq,
+                       avg(ppm) AS ppm_mean, avg(ppm * ppm) AS ppm_sq
+                  FROM nutrient_logs GROUP BY tray_id) AS agg
+          JOIN nutrient_logs AS last ON last.id = (
+               SELECT id FROM nutrient_logs WHERE tray_id = agg.tray_id
+                ORDER BY date DESC, id DESC LIMIT 1)""")
+
+
+def _add_positions(conn: Connection) -> None:
+    for table in ("shelves", "trays"):
+        columns = {col["name"] for col in inspect(conn).get_columns(table)}
+        if "position" not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN position INTEGER NOT NULL DEFAULT 0")
+            # layouts used to be ordered by id
+            conn.exec_driver_sql(f"UPDATE {table} SET position = id")
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _create_core_tables,   # 1
+    _add_notes_search,     # 2
+    _add_rollups,          # 3
+    _add_change_log,       # 4
+    _add_anomaly_state,    # 5
+    _add_positions,        # 6
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate(engine: Engine) -> int:
+    """Bring the database up to :data:`LATEST_VERSION`; return the old version."""
+    with engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+        start = current_version(conn)
+        for version in range(start + 1, LATEST_VERSION + 1):
+            MIGRATIONS[version - 1](conn)
+            conn.execute(schema_version.delete())
+            conn.execute(insert(schema_version).values(version=version))
+    return start
+
+
+def _merge_rows(conn: Connection, table: Table, label_col: str, parent_col: Optional[str],
+                rows: List[tuple], parent_ids: Dict[int, int]) -> Tuple[Dict[int, int], int]:
+    """Match legacy ``(id, label, parent id)`` rows to ``table`` by label.
+
+    Returns the legacy id -> target id mapping and the number of rows that
+    had no match and were inserted.
+    """
+    ids: Dict[int, int] = {}
+    inserted = 0
+    for old_id, label, old_parent in rows:
+        values = {label_col: label}
+        if parent_col is not None:
+            if old_parent not in parent_ids:
+                continue  # orphaned in the legacy file
+            values[parent_col] = parent_ids[old_parent]
+        new_id = conn.execute(
+            select(table.c.id)
+            .where(*(table.c[col] == value for col, value in values.items()))
+            .where(table.c.id.notin_(list(ids.values())))
+            .order_by(table.c.id)
+            .limit(1)
+        ).scalar()
+        if new_id is None:
+            new_id = conn.execute(insert(table).values(values)).inserted_primary_key[0]
+            inserted += 1
+        ids[old_id] = new_id
+    return ids, inserted
+
+
+def import_legacy_layout(engine: Engine, legacy_path: str) -> int:
+    """Merge shelf systems, shelves and trays from the old layout database.
+
+    Systems are matched by name, shelves by label within their system and
+    trays by label within their shelf; rows without a match are inserted
+    with new ids.  The legacy file is renamed to ``<name>.migrated`` once
+    the rows are committed.  Returns the number of inserted rows.
+    """
+    if not os.path.exists(legacy_path):
+        return 0
+    src = sqlite3.connect(legacy_path)
+    try:
+        try:
+            systems = src.execute("SELECT id, name, NULL FROM shelf_systems ORDER BY id").fetchall()
+            shelves = src.execute("SELECT id, name, system_id FROM shelves ORDER BY id").fetchall()
+            trays = src.execute("SELECT id, label, shelf_id FROM trays ORDER BY id").fetchall()
+        except sqlite3.OperationalError:
+            systems, shelves, trays = [], [], []
+    finally:
+        src.close()
+
+    with engine.begin() as conn:
+        system_ids, copied = _merge_rows(conn, ShelfSystem.__table__, "name", None, systems, {})
+        shelf_ids, count = _merge_rows(conn, Shelf.__table__, "label", "system_id", shelves, system_ids)
+        copied += count
+        copied += _merge_rows(conn, Tray.__table__, "label", "shelf_id", trays, shelf_ids)[1]
+    os.replace(legacy_path, legacy_path + ".migrated")
+    return copied
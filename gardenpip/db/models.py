@@ -0,0 +1,189 @@
+"""ORM models for the Garden Pip database."""
+from __future__ import annotations
+
+import datetime as _dt
+from typing import Optional
+
+from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class ShelfSystem(Base):
+    __tablename__ = "shelf_systems"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String, unique=True)
+
+    shelves: Mapped[list["Shelf"]] = relationship(
+        back_populates="system", cascade="all, delete-orphan", order_by="[Shelf.position, Shelf.id]"
+    )
+
+
+class Shelf(Base):
+    __tablename__ = "shelves"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    label: Mapped[str] = mapped_column(String)
+    system_id: Mapped[int] = mapped_column(ForeignKey("shelf_systems.id"))
+    # order within the system, as arranged in the layout editor
+    position: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    system: Mapped["ShelfSystem"] = relationship(back_populates="shelves")
+    trays: Mapped[list["Tray"]] = relationship(
+        back_populates="shelf", cascade="all, delete-orphan", order_by="[Tray.position, Tray.id]"
+    )
+
+
+class Tray(Base):
+    __tablename__ = "trays"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    label: Mapped[str] = mapped_column(String)
+    shelf_id: Mapped[int] = mapped_column(ForeignKey("shelves.id"))
+    # order within the shelf
+    position: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    shelf: Mapped["Shelf"] = relationship(back_populates="trays")
+    logs: Mapped[list["NutrientLog"]] = relationship(back_populates="tray", cascade="all, delete-orphan")
+
+
+class NutrientLog(Base):
+    __tablename__ = "nutrient_logs"
+    __table_args__ = (
+        Index("ix_nutrient_logs_tray_date", "tray_id", "date"),
+        Index("ix_nutrient_logs_date", "date"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tray_id: Mapped[int] = mapped_column(ForeignKey("trays.id"))
+    date: Mapped[_dt.datetime] = mapped_column(DateTime, default=_dt.datetime.utcnow)
+    ph: Mapped[float] = mapped_column(Float)
+    ppm: Mapped[float] = mapped_column(Float)
+    notes: Mapped[Optional[str]] = mapped_column(String, default="")
+
+    tray: Mapped["Tray"] = relationship(back_populates="logs")
+
+
+class NutrientLogRollup(Base):
+    """Per-tray pH/ppm aggregates over one time bucket.
+
+    Rows are maintained by triggers on ``nutrient_logs`` (see the
+    migrations); ``bucket`` is the start of the hour, day or week
+    (weeks start on Monday).
+    """
+
+    __tablename__ = "nutrient_log_rollups"
+
+    tray_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    resolution: Mapped[str] = mapped_column(String, primary_key=True)
+    bucket: Mapped[_dt.datetime] = mapped_column(DateTime, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer)
+    ph_sum: Mapped[float] = mapped_column(Float)
+    ph_min: Mapped[float] = mapped_column(Float)
+    ph_max: Mapped[float] = mapped_column(Float)
+    ppm_sum: Mapped[float] = mapped_column(Float)
+    ppm_min: Mapped[float] = mapped_column(Float)
+    ppm_max: Mapped[float] = mapped_column(Float)
+
+
+class NutrientLogChange(Base):
+    """Latest change of one nutrient log, for replication.
+
+    Triggers replace a log's row on every insert, update and delete, so
+    ``seq`` only grows and each log appears once, with its newest change.
+    """
+
+    __tablename__ = "nutrient_log_changes"
+    # AUTOINCREMENT: sequence numbers of replaced rows are never reused
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    log_id: Mapped[int] = mapped_column(Integer, unique=True)
+    deleted: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class SyncState(Base):
+    """Replication watermark of one stream, as JSON text."""
+
+    __tablename__ = "sync_state"
+
+    peer: Mapped[str] = mapped_column(String, primary_key=True)
+    stream: Mapped[str] = mapped_column(String, primary_key=True)
+    position: Mapped[str] = mapped_column(String)
+
+
+class ReplicatedLog(Base):
+    """A nutrient log received from another node."""
+
+    __tablename__ = "replicated_logs"
+    __table_args__ = (Index("ix_replicated_logs_date", "date"),)
+
+    origin: Mapped[str] = mapped_column(String, primary_key=True)
+    origin_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    tray_id: Mapped[int] = mapped_column(Integer)
+    tray_label: Mapped[Optional[str]] = mapped_column(String)
+    date: Mapped[_dt.datetime] = mapped_column(DateTime)
+    ph: Mapped[float] = mapped_column(Float)
+    ppm: Mapped[float] = mapped_column(Float)
+    notes: Mapped[Optional[str]] = mapped_column(String)
+
+
+class ReplicatedScheduleEntry(Base):
+    """A schedule log entry received from another node, keyed by its file position."""
+
+    __tablename__ = "replicated_schedule"
+
+    origin: Mapped[str] = mapped_column(String, primary_key=True)
+    segment: Mapped[int] = mapped_column(Integer, primary_key=True)
+    offset: Mapped[int] = mapped_column(Integer, primary_key=True)
+    entry: Mapped[str] = mapped_column(String)
+
+
+class TrayStats(Base):
+    """Running pH/ppm statistics of one tray for anomaly detection.
+
+    Exponentially weighted mean and variance of each reading and of its
+    rate of change per hour, plus the last reading.  Updated with every
+    logged reading (see :mod:`gardenpip.db.anomaly`).
+    """
+
+    __tablename__ = "tray_stats"
+
+    tray_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    last_date: Mapped[Optional[_dt.datetime]] = mapped_column(DateTime)
+    ph_last: Mapped[float] = mapped_column(Float, default=0.0)
+    ph_mean: Mapped[float] = mapped_column(Float, default=0.0)
+    ph_var: Mapped[float] = mapped_column(Float, default=0.0)
+    ph_rate_mean: Mapped[float] = mapped_column(Float, default=0.0)
+    ph_rate_var: Mapped[float] = mapped_column(Float, default=0.0)
+    ppm_last: Mapped[float] = mapped_column(Float, default=0.0)
+    ppm_mean: Mapped[float] = mapped_column(Float, default=0.0)
+    ppm_var: Mapped[float] = mapped_column(Float, default=0.0)
+    ppm_rate_mean: Mapped[float] = mapped_column(Float, default=0.0)
+    ppm_rate_var: Mapped[float] = mapped_column(Float, default=0.0)
+
+
+class NutrientAlert(Base):
+    """A reading that deviated from its tray's recent behaviour.
+
+    ``kind`` is ``"level"`` (the value itself) or ``"rate"`` (how fast it
+    changed since the previous reading); ``metric`` is ``"ph"`` or ``"ppm"``.
+    """
+
+    __tablename__ = "nutrient_alerts"
+    __table_args__ = (Index("ix_nutrient_alerts_tray_date", "tray_id", "date"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tray_id: Mapped[int] = mapped_column(Integer)
+    log_id: Mapped[Optional[int]] = mapped_column(Integer)
+    date: Mapped[_dt.datetime] = mapped_column(DateTime)
+    metric: Mapped[str] = mapped_column(String)
+    kind: Mapped[str] = mapped_column(String)
+    value: Mapped[float] = mapped_column(Float)
+    expected: Mapped[float] = mapped_column(Float)
+    score: Mapped[float] = mapped_column(Float)
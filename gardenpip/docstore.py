@@ -0,0 +1,254 @@
+"""Cached, crash-safe JSON documents.
+
+A :class:`DocumentStore` owns one JSON file.  Reads are served from an
+in-memory copy that is revalidated against the file's mtime and size, so
+edits made by hand are still picked up.  Writes go to a temporary file
+that is fsynced and renamed over the original, so a power cut leaves
+either the old or the new document, never a truncated one.
+
+Saves can be coalesced: with a ``save_delay`` the store waits that long
+after the first change and writes once for every change made meanwhile.
+Changes are encoded when they are made, so a value that isn't JSON
+serializable raises in the caller, not later on the writer's timer.
+Dict documents also support per-key updates; the JSON of unchanged keys
+is kept from the previous write rather than encoded again.
+"""
+import atexit
+import json
+import logging
+import os
+import pickle
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# how long save_configs/save_shelves wait to batch changes into one write
+SAVE_DELAY = 0.5
+
+_MISSING = object()
+
+
+def fsync_dir(path: str) -> None:
+    """Flush a directory entry change (create, rename) to disk."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Replace ``path`` with ``data`` so readers see the old or the new file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    fsync_dir(directory)
+
+
+class DocumentStore:
+    """One JSON document on disk with a validated in-memory copy.
+
+    ``default`` builds the document used when the file doesn't exist.
+    ``indent`` matches ``json.dump``; per-key fragments reproduce its
+    output exactly.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        default: Callable[[], Any] = dict,
+        indent: Optional[int] = 2,
+        save_delay: float = 0.0,
+    ) -> None:
+        self.path = path
+        self.default = default
+        self.indent = indent
+        self.save_delay = save_delay
+        self._lock = threading.RLock()
+        self._doc: Any = _MISSING
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._frozen: Optional[bytes] = None
+        # key -> encoded value, for dict documents
+        self._fragments: Dict[str, str] = {}
+        # encoded document, for other documents
+        self._text: Optional[str] = None
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _current(self) -> Any:
+        """Return the cached document, re-reading the file if it changed."""
+        if self._dirty:
+            return self._doc  # our unsaved changes are newer than the file
+        stamp = self._file_stamp()
+        if self._doc is _MISSING or stamp != self._stamp:
+            if stamp is None:
+                doc = self.default()
+            else:
+                with open(self.path, 'r', encoding='utf-8') as fh:
+                    doc = json.load(fh)
+            self._doc, self._stamp = doc, stamp
+            self._frozen = None
+            self._fragments = {}
+            self._text = None
+        return self._doc
+
+    def load(self) -> Any:
+        """Return a private copy of the document."""
+        with self._lock:
+            self._current()
+            if self._frozen is None:
+                self._frozen = pickle.dumps(self._doc, pickle.HIGHEST_PROTOCOL)
+            frozen = self._frozen
+        return pickle.loads(frozen)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return a copy of one key of a dict document."""
+        with self._lock:
+            value = self._current().get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        return pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def save(self, doc: Any) -> None:
+        """Replace the whole document."""
+        doc = pickle.loads(pickle.dumps(doc, pickle.HIGHEST_PROTOCOL))
+        fragments: Dict[str, str] = {}
+        text = None
+        if isinstance(doc, dict):
+            for key, value in doc.items():
+                fragments[key] = self._fragment(value)
+        else:
+            text = json.dumps(doc, indent=self.indent)
+        with self._lock:
+            self._doc = doc
+            self._fragments = fragments
+            self._text = text
+            self._changed()
+
+    def set(self, key: str, value: Any) -> None:
+        """Set one key of a dict document, re-encoding only that key."""
+        value = pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        fragment = self._fragment(value)
+        with self._lock:
+            doc = self._current()
+            doc[key] = value
+            self._fragments[key] = fragment
+            self._changed()
+
+    def delete(self, key: str) -> None:
+        """Remove one key of a dict document, if present."""
+        with self._lock:
+            doc = self._current()
+            if key in doc:
+                del doc[key]
+                self._fragments.pop(key, None)
+                self._changed()
+
+    def _changed(self) -> None:
+        self._frozen = None
+        self._dirty = True
+        if self.save_delay <= 0:
+            self._write()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.save_delay, self._flush_later)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fragment(self, value: Any) -> str:
+        text = json.dumps(value, indent=self.indent)
+        if self.indent is not None:
+            text = text.replace("\n", "\n" + " " * self.indent)
+        return text
+
+    def _encode(self) -> str:
+        doc = self._doc
+        if not isinstance(doc, dict) or not doc:
+            return self._text if self._text is not None else json.dumps(doc, indent=self.indent)
+        fragments = self._fragments
+        parts = []
+        for key, value in doc.items():
+            frag = fragments.get(key)
+            if frag is None:
+                frag = fragments[key] = self._fragment(value)
+            parts.append(f"{json.dumps(key)}: {frag}")
+        if self.indent is None:
+            return "{" + ", ".join(parts) + "}"
+        pad = " " * self.indent
+        return "{\n" + pad + (",\n" + pad).join(parts) + "\n}"
+
+    def _write(self) -> None:
+        atomic_write(self.path, self._encode().encode('utf-8'))
+        self._stamp = self._file_stamp()
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Write pending changes now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._dirty:
+                self._write()
+
+    def _flush_later(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            # e.g. a full disk; the changes stay pending for the next flush
+            logger.exception("saving %s failed", self.path)
+
+
+_stores: Dict[str, DocumentStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str, default: Callable[[], Any] = dict, save_delay: float = SAVE_DELAY) -> DocumentStore:
+    """Return the shared store for ``path``.
+
+    ``default`` and ``save_delay`` only apply when the store is created.
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = DocumentStore(key, default=default, save_delay=save_delay)
+        return store
+
+
+def flush_all() -> None:
+    """Write pending changes of every shared store."""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        try:
+            store.flush()
+        except Exception:
+            logger.exception("saving %s failed", store.path)
+
+
+atexit.register(flush_all)
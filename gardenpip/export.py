@@ -0,0 +1,250 @@
+"""Export nutrient logs and schedule history to CSV or Parquet.
+
+Rows are streamed: nutrient logs are read through a cursor in chunks of
+``chunk_size`` (``yield_per``), schedule entries one line at a time, and
+the writers emit each chunk before reading the next.  Memory use stays
+flat however many years of data are exported.
+
+Both sources can be narrowed to a date range (``start`` inclusive,
+``end`` exclusive) and a set of trays.  Parquet output needs ``pyarrow``,
+which is imported only when it is used.
+
+Usage::
+
+    python -m gardenpip.export logs logs.csv --since 2024-01-01 --tray 3
+    python -m gardenpip.export schedule schedule.parquet --schedule-dir data
+"""
+import argparse
+import csv
+import datetime as _dt
+import io
+import os
+import sys
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .instrument import timed
+from .schedule_log import iter_schedule
+
+CHUNK_SIZE = 2000
+
+LOG_COLUMNS = ("id", "date", "tray_id", "tray", "shelf", "ph", "ppm", "notes")
+SCHEDULE_COLUMNS = ("date", "tray_id", "shelf_id", "manufacturer", "series", "stage",
+                    "plant_category", "unit", "volume", "cal_mag", "lines")
+
+DateLike = Union[_dt.date, _dt.datetime]
+
+
+def _as_datetime(value: Optional[DateLike]) -> Optional[_dt.datetime]:
+    if value is None or isinstance(value, _dt.datetime):
+        return value
+    return _dt.datetime.combine(value, _dt.time())
+
+
+def _iso_day(value: DateLike) -> str:
+    if isinstance(value, _dt.datetime):
+        value = value.date()
+    return value.isoformat()
+
+
+# ── sources ──────────────────────────────────────────────────────────────────
+
+def iter_nutrient_logs(
+    db_path: Optional[str] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    tray_ids: Optional[Sequence[int]] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[Any, ...]]:
+    """Yield nutrient logs as :data:`LOG_COLUMNS` tuples, oldest first."""
+    from sqlalchemy import select
+
+    from .db import session_scope
+    from .db.models import NutrientLog, Shelf, Tray
+
+    stmt = (
+        select(NutrientLog.id, NutrientLog.date, NutrientLog.tray_id, Tray.label, Shelf.label,
+               NutrientLog.ph, NutrientLog.ppm, NutrientLog.notes)
+        .outerjoin(Tray, Tray.id == NutrientLog.tray_id)
+        .outerjoin(Shelf, Shelf.id == Tray.shelf_id)
+        .order_by(NutrientLog.date, NutrientLog.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    start, end = _as_datetime(start), _as_datetime(end)
+    if start is not None:
+        stmt = stmt.where(NutrientLog.date >= start)
+    if end is not None:
+        stmt = stmt.where(NutrientLog.date < end)
+    if tray_ids:
+        stmt = stmt.where(NutrientLog.tray_id.in_(list(tray_ids)))
+    with session_scope(db_path) as session:
+        for row in session.execute(stmt):
+            yield tuple(row)
+
+
+def iter_schedule_rows(
+    base_dir: str,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    tray_ids: Optional[Sequence[int]] = None,
+) -> Iterator[Tuple[Any, ...]]:
+    """Yield schedule entries as :data:`SCHEDULE_COLUMNS` tuples, oldest first.
+
+    ``lines`` are joined with newlines.
+    """
+    # entry dates are ISO day strings, which compare correctly as text
+    low = _iso_day(start) if start is not None else None
+    high = _iso_day(end) if end is not None else None
+    trays = set(tray_ids) if tray_ids else None
+    for entry in iter_schedule(base_dir):
+        date = str(entry.get("date", ""))
+        if (low is not None and date < low) or (high is not None and date >= high):
+            continue
+        if trays is not None and entry.get("tray_id") not in trays:
+            continue
+        lines = entry.get("lines")
+        yield tuple(
+            "\n".join(str(line) for line in lines) if col == "lines" and isinstance(lines, list)
+            else entry.get(col)
+            for col in SCHEDULE_COLUMNS
+        )
+
+
+# ── writers ──────────────────────────────────────────────────────────────────
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (_dt.date, _dt.datetime)):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def write_csv(rows: Iterable[Sequence[Any]], columns: Sequence[str], out: Union[str, io.TextIOBase],
+              chunk_size: int = CHUNK_SIZE) -> int:
+    """Write ``rows`` as CSV to a path or text file; returns the row count."""
+    if isinstance(out, str):
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8", newline="") as fh:
+            return write_csv(rows, columns, fh, chunk_size)
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    count = 0
+    chunk: List[List[Any]] = []
+    for row in rows:
+        chunk.append([_csv_value(v) for v in row])
+        if len(chunk) >= chunk_size:
+            writer.writerows(chunk)
+            count += len(chunk)
+            chunk = []
+    writer.writerows(chunk)
+    return count + len(chunk)
+
+
+def _parquet_schema(columns: Sequence[str]):
+    import pyarrow as pa
+
+    types = {
+        "id": pa.int64(), "tray_id": pa.int64(), "shelf_id": pa.int64(),
+        "ph": pa.float64(), "ppm": pa.float64(), "volume": pa.float64(),
+    }
+    return pa.schema([(col, types.get(col, pa.string())) for col in columns])
+
+
+def write_parquet(rows: Iterable[Sequence[Any]], columns: Sequence[str], path: str,
+                  chunk_size: int = CHUNK_SIZE) -> int:
+    """Write ``rows`` to a Parquet file, one row group per chunk.
+
+    Requires ``pyarrow``.  Dates are stored as ISO strings, like the CSV.
+    Returns the row count.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(columns)
+    numeric = [pa.types.is_integer(f.type) or pa.types.is_floating(f.type) for f in schema]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+
+    def flush(chunk: List[Sequence[Any]]) -> None:
+        arrays = []
+        for i, field in enumerate(schema):
+            if numeric[i]:
+                values = [row[i] for row in chunk]
+            else:
+                values = [None if row[i] is None else str(_csv_value(row[i])) for row in chunk]
+            arrays.append(pa.array(values, type=field.type))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    with pq.ParquetWriter(path, schema) as writer:
+        chunk: List[Sequence[Any]] = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+            count += len(chunk)
+    return count
+
+
+WRITERS: Dict[str, Callable[..., int]] = {"csv": write_csv, "parquet": write_parquet}
+
+
+def _writer_for(path: str, fmt: Optional[str]) -> Callable[..., int]:
+    if fmt is None:
+        fmt = "parquet" if path.endswith((".parquet", ".pq")) else "csv"
+    return WRITERS[fmt]
+
+
+# ── API ──────────────────────────────────────────────────────────────────────
+
+@timed()
+def export_nutrient_logs(out: str, db_path: Optional[str] = None, start: Optional[DateLike] = None,
+                         end: Optional[DateLike] = None, tray_ids: Optional[Sequence[int]] = None,
+                         fmt: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Export nutrient logs to ``out``; the format follows the extension unless ``fmt`` is given."""
+    rows = iter_nutrient_logs(db_path, start, end, tray_ids, chunk_size)
+    return _writer_for(out, fmt)(rows, LOG_COLUMNS, out, chunk_size)
+
+
+@timed()
+def export_schedule(out: str, base_dir: str, start: Optional[DateLike] = None,
+                    end: Optional[DateLike] = None, tray_ids: Optional[Sequence[int]] = None,
+                    fmt: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Export the schedule log in ``base_dir`` to ``out``."""
+    rows = iter_schedule_rows(base_dir, start, end, tray_ids)
+    return _writer_for(out, fmt)(rows, SCHEDULE_COLUMNS, out, chunk_size)
+
+
+# ── CLI ──────────────────────────────────────────────────────────────────────
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export Garden Pip logs to CSV or Parquet.")
+    parser.add_argument("source", choices=("logs", "schedule"))
+    parser.add_argument("output", help="output file, '-' for CSV on stdout")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="default: from the file extension")
+    parser.add_argument("--since", type=_dt.date.fromisoformat, metavar="YYYY-MM-DD")
+    parser.add_argument("--until", type=_dt.date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="last day to include")
+    parser.add_argument("--tray", type=int, action="append", dest="trays", metavar="TRAY_ID")
+    parser.add_argument("--db", help="database path (default: the application database)")
+    parser.add_argument("--schedule-dir", default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+    args = parser.parse_args(argv)
+
+    end = args.until + _dt.timedelta(days=1) if args.until else None
+    if args.source == "logs":
+        rows = iter_nutrient_logs(args.db, args.since, end, args.trays)
+        columns: Sequence[str] = LOG_COLUMNS
+    else:
+        rows = iter_schedule_rows(args.schedule_dir, args.since, end, args.trays)
+        columns = SCHEDULE_COLUMNS
+    if args.output == "-":
+        count = write_csv(rows, columns, sys.stdout)
+    else:
+        count = _writer_for(args.output, args.format)(rows, columns, args.output)
+    print(f"exported {count} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Opt-in timing of hot paths.
+
+Functions decorated with :func:`timed` and blocks wrapped in :func:`span`
+record their duration under an operation name while instrumentation is
+enabled.  Engines passed to :func:`instrument_engine` also record every
+SQL statement under ``sql:<VERB>``.  Each operation keeps a count, a
+total and a rolling window of recent samples for percentiles and a
+latency histogram.
+
+Instrumentation is off by default; a disabled :func:`timed` wrapper costs
+one flag check per call.  Set ``GARDENPIP_INSTRUMENT=1`` or call
+:func:`enable`.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# samples kept per operation for percentiles and the histogram
+WINDOW = 1024
+# histogram bucket upper bounds in milliseconds; the last bucket is open
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+_enabled = bool(os.environ.get("GARDENPIP_INSTRUMENT"))
+_lock = threading.Lock()
+
+
+class Histogram:
+    """Count, total and a rolling window of samples for one operation."""
+
+    def __init__(self, window: int = WINDOW) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def buckets(self) -> List[int]:
+        """Sample counts per :data:`BUCKETS_MS` bucket over the window."""
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        for seconds in self.samples:
+            ms = seconds * 1e3
+            for i, bound in enumerate(BUCKETS_MS):
+                if ms <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": self.buckets(),
+        }
+
+
+_stats: Dict[str, Histogram] = {}
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Forget everything recorded so far."""
+    with _lock:
+        _stats.clear()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add one sample for ``name`` if instrumentation is enabled."""
+    if not _enabled:
+        return
+    with _lock:
+        hist = _stats.get(name)
+        if hist is None:
+            hist = _stats[name] = Histogram()
+        hist.add(seconds)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        record(self.name, time.perf_counter() - self.start)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """Context manager timing its block under ``name``."""
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def timed(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorator timing each call under ``name`` (default ``module.qualname``)."""
+
+    def decorate(fn: Callable) -> Callable:
+        op = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(op, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+# ── SQL ──────────────────────────────────────────────────────────────────────
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _enabled:
+        conn.info.setdefault("gardenpip_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    starts = conn.info.get("gardenpip_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+    record(f"sql:{verb}", elapsed)
+
+
+def instrument_engine(engine: Any) -> None:
+    """Record SQL statement timings for ``engine`` while enabled."""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ── reporting ────────────────────────────────────────────────────────────────
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Return a summary per operation name."""
+    with _lock:
+        return {name: hist.summary() for name, hist in _stats.items()}
+
+
+def report_lines(limit: Optional[int] = None) -> List[str]:
+    """Human-readable lines, most total time first."""
+    rows = sorted(snapshot().items(), key=lambda item: -item[1]["total"])
+    return [
+        f"{name}: n={s['count']} total={s['total'] * 1e3:.1f}ms "
+        f"p50={s['p50'] * 1e3:.2f}ms p99={s['p99'] * 1e3:.2f}ms max={s['max'] * 1e3:.2f}ms"
+        for name, s in rows[:limit]
+    ]
+
+
+def export(path: str) -> None:
+    """Write the current snapshot to ``path`` as JSON."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    data = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "buckets_ms": list(BUCKETS_MS),
+        "operations": snapshot(),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True)
+    os.replace(tmp, path)
@@ -0,0 +1,154 @@
+"""Run blocking database and file work off the UI thread.
+
+:class:`IOExecutor` runs submitted calls one at a time on a background
+thread, in submission order, so a save is always visible to the refresh
+queued after it.  Results come back through ``dispatch``, which defaults
+to Kivy's ``Clock.schedule_once`` so callbacks run on the main loop.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+Dispatch = Callable[[Callable[[], None]], None]
+
+
+def kivy_dispatch(fn: Callable[[], None]) -> None:
+    """Run ``fn`` on the next frame of the Kivy main loop."""
+    from kivy.clock import Clock
+
+    Clock.schedule_once(lambda dt: fn())
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "callback", "errback", "key")
+
+    def __init__(self, fn, args, kwargs, callback, errback, key) -> None:
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.errback = errback
+        self.key = key
+
+
+class IOExecutor:
+    """Single background thread for I/O with results delivered via ``dispatch``.
+
+    Jobs submitted with a ``key`` are coalesced: if a job with the same key
+    is still waiting, it is replaced by the new one, keeping its place in
+    the queue.  Use this for refreshes where only the latest matters.
+    """
+
+    def __init__(self, dispatch: Optional[Dispatch] = None, name: str = "gardenpip-io") -> None:
+        self.dispatch = dispatch or kivy_dispatch
+        self.name = name
+        self._cond = threading.Condition()
+        self._queue: Deque[_Job] = deque()
+        self._keyed: Dict[Hashable, _Job] = {}
+        self._busy = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        callback: Optional[Callable[[Any], None]] = None,
+        errback: Optional[Callable[[BaseException], None]] = None,
+        key: Optional[Hashable] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run ``fn(*args, **kwargs)`` in the background.
+
+        ``callback(result)`` or ``errback(exc)`` is then dispatched to the
+        main loop.  Without an ``errback`` failures are logged.
+        """
+        job = _Job(fn, args, kwargs, callback, errback, key)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("IOExecutor is shut down")
+            if key is not None and key in self._keyed:
+                # replace the waiting job in place
+                waiting = self._keyed[key]
+                waiting.fn, waiting.args, waiting.kwargs = fn, args, kwargs
+                waiting.callback, waiting.errback = callback, errback
+                return
+            if key is not None:
+                self._keyed[key] = job
+            self._queue.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self) -> int:
+        """Number of jobs waiting or running."""
+        with self._cond:
+            return len(self._queue) + self._busy
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted job has run; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs; with ``wait`` finish the queued ones first."""
+        with self._cond:
+            self._closed = True
+            if not wait:
+                self._queue.clear()
+                self._keyed.clear()
+            self._cond.notify_all()
+            thread = self._thread
+        if wait and thread is not None:
+            thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                job = self._queue.popleft()
+                if job.key is not None:
+                    del self._keyed[job.key]
+                self._busy = True
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except Exception as exc:
+                if job.errback is not None:
+                    self.dispatch(lambda errback=job.errback, exc=exc: errback(exc))
+                else:
+                    logger.exception("background job %r failed", job.fn)
+            else:
+                if job.callback is not None:
+                    self.dispatch(lambda callback=job.callback, result=result: callback(result))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+_executor: Optional[IOExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_io_executor() -> IOExecutor:
+    """Return the shared executor used by the app."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = IOExecutor()
+        return _executor
+
+
+@atexit.register
+def _drain() -> None:
+    # let pending writes reach the disk before the interpreter exits
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
@@ -1,15 +1,191 @@
 import json
-from typing import Any, Dict, List, Optional
+import os
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple, Union
 
+from .instrument import timed
+from .snapshot import KIND_NUTRIENTS, Snapshot, open_snapshot
 
+# (component name, amount per unit of volume, unit label)
+Dose = Tuple[str, float, str]
+
+
+@timed()
 def load_nutrient_data(path: str) -> Dict[str, Any]:
-    """Load nutrient data from a JSON file."""
+    """Load nutrient data from a JSON file, or from its snapshot if current."""
+    snap = open_snapshot(path, KIND_NUTRIENTS)
+    if snap is not None:
+        return snap.nutrient_data()
     with open(path, 'r', encoding='utf-8') as fh:
         return json.load(fh)
 
 
+class NutrientCatalog:
+    """Nutrient data indexed for the calculator.
+
+    Series, stages and supplements are kept in dictionaries and every
+    concentration is pre-divided by its base volume, so a dose is a single
+    multiplication per component.
+    """
+
+    def __init__(self, data: Dict[str, Any], mtime: Optional[int] = None) -> None:
+        self.data = data
+        self.mtime = mtime
+        self._series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._series_by_manufacturer: Dict[str, List[str]] = {}
+        self._components: Dict[Tuple[str, str, str, str], List[Dose]] = {}
+        self._supplements: Dict[str, Dict[str, Any]] = {}
+        self._supplement_doses: Dict[Tuple[str, str], Dose] = {}
+
+        for entry in data.get("nutrients", []):
+            key = (entry.get("manufacturer"), entry.get("series"))
+            if key in self._series:
+                continue  # first entry wins, like a linear scan would
+            self._series[key] = entry
+            self._series_by_manufacturer.setdefault(key[0], []).append(key[1])
+            base_unit = entry.get("base_unit", {})
+            for stage, comps in entry.get("stages", {}).items():
+                for unit in _units(base_unit, comps):
+                    base_volume = base_unit.get(unit, {}).get("volume", 1)
+                    self._components[key + (stage, unit)] = [
+                        (
+                            comp.get("name", ""),
+                            comp.get("concentration", {}).get(unit, 0) / base_volume,
+                            comp.get("unit", {}).get(unit, ""),
+                        )
+                        for comp in comps
+                    ]
+
+        for supp in data.get("cal_mag_supplements", []):
+            product = supp.get("product")
+            if product in self._supplements:
+                continue
+            self._supplements[product] = supp
+            base_unit = supp.get("base_unit", {})
+            for unit in set(base_unit) | set(supp.get("concentration", {})):
+                base_volume = base_unit.get(unit, {}).get("volume", 1)
+                self._supplement_doses[(product, unit)] = (
+                    product,
+                    supp.get("concentration", {}).get(unit, 0) / base_volume,
+                    supp.get("unit", ""),
+                )
+
+    @classmethod
+    def from_snapshot(cls, snap: Snapshot, mtime: Optional[int] = None) -> "NutrientCatalog":
+        """Return a catalog over a nutrient snapshot.
+
+        The dose tables come precomputed and series entries are decoded
+        when first used; ``data`` is ``None``.
+        """
+        catalog = cls.__new__(cls)
+        catalog.data = None
+        catalog.mtime = mtime
+        catalog._series, catalog._series_by_manufacturer, catalog._supplements = snap.nutrient_index()
+        catalog._components, catalog._supplement_doses = snap.dose_tables()
+        return catalog
+
+    def dose_tables(self) -> Tuple[Mapping[Tuple[str, str, str, str], List[Dose]],
+                                   Mapping[Tuple[str, str], Dose]]:
+        """Return ``(components, supplement doses)``, the per-volume tables.
+
+        Components are keyed by ``(manufacturer, series, stage, unit)`` and
+        supplement doses by ``(product, unit)``.
+        """
+        return self._components, self._supplement_doses
+
+    def manufacturers(self) -> List[str]:
+        return list(self._series_by_manufacturer)
+
+    def series(self, manufacturer: str) -> List[str]:
+        return list(self._series_by_manufacturer.get(manufacturer, []))
+
+    def stages(self, manufacturer: str, series: str) -> List[str]:
+        entry = self._series.get((manufacturer, series))
+        return list(entry.get("stages", {})) if entry else []
+
+    def supplements(self) -> List[str]:
+        return list(self._supplements)
+
+    def units(self) -> List[str]:
+        """Return the units any series or supplement has amounts in."""
+        units = {key[3] for key in self._components}
+        units.update(unit for _, unit in self._supplement_doses)
+        return sorted(units)
+
+    def entry(self, manufacturer: str, series: str) -> Optional[Dict[str, Any]]:
+        return self._series.get((manufacturer, series))
+
+    def supplement(self, product: str) -> Optional[Dict[str, Any]]:
+        return self._supplements.get(product)
+
+    def doses(self, manufacturer: str, series: str, stage: str, unit: str, volume: float) -> List[Dose]:
+        """Return ``(name, amount, unit)`` for each component of a stage."""
+        volume = float(volume)
+        comps = self._components.get((manufacturer, series, stage, unit))
+        if comps is None:
+            entry = self._series.get((manufacturer, series))
+            if entry is None:
+                return []
+            # unit missing from the data: zero amounts, as the JSON lookups give
+            return [(comp.get("name", ""), 0.0, "") for comp in entry.get("stages", {}).get(stage, [])]
+        return [(name, per_volume * volume, label) for name, per_volume, label in comps]
+
+    def supplement_dose(self, product: str, unit: str, volume: float) -> Optional[Dose]:
+        """Return ``(product, amount, unit)`` for a Cal-Mag supplement."""
+        dose = self._supplement_doses.get((product, unit))
+        if dose is None:
+            if product not in self._supplements:
+                return None
+            return (product, 0.0, self._supplements[product].get("unit", ""))
+        return (dose[0], dose[1] * float(volume), dose[2])
+
+
+def _units(base_unit: Dict[str, Any], comps: List[Dict[str, Any]]) -> set:
+    units = set(base_unit)
+    for comp in comps:
+        units.update(comp.get("concentration", {}))
+        units.update(comp.get("unit", {}))
+    return units
+
+
+_catalogs: Dict[str, NutrientCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+@timed()
+def get_catalog(path: str) -> NutrientCatalog:
+    """Return the shared catalog for ``path``, reloading it if the file changed."""
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    catalog = _catalogs.get(key)
+    if catalog is not None and catalog.mtime == mtime:
+        return catalog
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None or catalog.mtime != mtime:
+            snap = open_snapshot(key, KIND_NUTRIENTS)
+            if snap is not None:
+                catalog = NutrientCatalog.from_snapshot(snap, mtime)
+            else:
+                catalog = NutrientCatalog(load_nutrient_data(key), mtime)
+            _catalogs[key] = catalog
+        return catalog
+
+
+def _select_entries(data: Dict[str, Any], manufacturer: str, series: str,
+                    cal_mag: Optional[str]) -> Dict[str, Any]:
+    """Return ``data`` cut down to the first matching series and supplement."""
+    entry = next((n for n in data.get("nutrients", [])
+                  if n.get("manufacturer") == manufacturer and n.get("series") == series), None)
+    supp = next((s for s in data.get("cal_mag_supplements", []) if s.get("product") == cal_mag),
+                None) if cal_mag else None
+    return {"nutrients": [entry] if entry else [], "cal_mag_supplements": [supp] if supp else []}
+
+
+@timed()
 def calculate_nutrients(
-    data: Dict[str, Any],
+    data: Union[Dict[str, Any], NutrientCatalog],
     manufacturer: str,
     series: str,
     stage: str,
@@ -18,34 +194,125 @@ def calculate_nutrients(
     volume: float,
     cal_mag: Optional[str],
 ) -> List[str]:
-    """Return formatted nutrient lines for the given parameters."""
-    nutrients = data.get("nutrients", [])
-    entry = next(
-        (n for n in nutrients if n.get("manufacturer") == manufacturer and n.get("series") == series),
-        None,
-    )
-    if not entry:
+    """Return formatted nutrient lines for the given parameters.
+
+    ``data`` may be the raw JSON data or a :class:`NutrientCatalog`.  Raw
+    data is scanned for the one series and supplement asked for; pass a
+    catalog from :func:`get_catalog` for repeated calls.
+    """
+    if isinstance(data, NutrientCatalog):
+        catalog = data
+    else:
+        catalog = NutrientCatalog(_select_entries(data, manufacturer, series, cal_mag))
+    if catalog.entry(manufacturer, series) is None:
         return []
 
-    base_volume = entry.get("base_unit", {}).get(unit, {}).get("volume", 1)
-    lines: List[str] = []
-    stage_data = entry.get("stages", {}).get(stage, [])
-    for comp in stage_data:
-        conc = comp.get("concentration", {}).get(unit, 0)
-        amt = conc * (float(volume) / base_volume)
-        name = comp.get("name", "")
-        u = comp.get("unit", {}).get(unit, "")
-        lines.append(f"{name}: {amt:.1f} {u}")
+    lines = [f"{name}: {amt:.1f} {u}" for name, amt, u in catalog.doses(manufacturer, series, stage, unit, volume)]
 
     if cal_mag:
-        supp = next(
-            (s for s in data.get("cal_mag_supplements", []) if s.get("product") == cal_mag),
-            None,
-        )
+        supp = catalog.supplement_dose(cal_mag, unit, volume)
         if supp:
-            base_vol_s = supp.get("base_unit", {}).get(unit, {}).get("volume", 1)
-            conc_s = supp.get("concentration", {}).get(unit, 0)
-            amt_s = conc_s * (float(volume) / base_vol_s)
-            lines.append(f"{cal_mag}: {amt_s:.1f} {supp.get('unit', '')}")
+            lines.append(f"{cal_mag}: {supp[1]:.1f} {supp[2]}")
 
     return lines
+
+
+# ── batch dosing ──────────────────────────────────────────────────────────────
+
+class DoseRequest(NamedTuple):
+    manufacturer: str
+    series: str
+    stage: str
+    unit: str
+    volume: float
+    cal_mag: Optional[str] = None
+    tray_id: Optional[int] = None
+
+
+class DoseTable(NamedTuple):
+    """Columnar result of :func:`calculate_batch`, one row per component.
+
+    ``request`` holds the index of the originating :class:`DoseRequest`.
+    """
+
+    request: array
+    component: List[str]
+    amount: array
+    unit: List[str]
+
+    def rows(self) -> Iterable[Tuple[int, str, float, str]]:
+        return zip(self.request, self.component, self.amount, self.unit)
+
+
+def requests_from_layout(
+    layout: List[dict],
+    manufacturer: str,
+    series: str,
+    stage: str,
+    unit: str,
+    volume: float,
+    cal_mag: Optional[str] = None,
+) -> List[DoseRequest]:
+    """Return one request per tray of a shelf layout, all with the same mix."""
+    return [
+        DoseRequest(manufacturer, series, stage, unit, float(volume), cal_mag, tray.get('id'))
+        for shelf in layout
+        for tray in shelf.get('trays', [])
+    ]
+
+
+@timed()
+def calculate_batch(catalog: NutrientCatalog, requests: Iterable[DoseRequest]) -> DoseTable:
+    """Compute every component amount for many requests in one pass.
+
+    Requests sharing a (manufacturer, series, stage, unit) mix reuse the
+    same per-volume vector, so the work per request is one multiplication
+    per component.
+    """
+    req_col = array('I')
+    comp_col: List[str] = []
+    amt_col = array('d')
+    unit_col: List[str] = []
+    vectors: Dict[Tuple[str, str, str, str], List[Dose]] = {}
+    supp_vectors: Dict[Tuple[str, str], Optional[Dose]] = {}
+
+    for i, req in enumerate(requests):
+        key = (req.manufacturer, req.series, req.stage, req.unit)
+        vector = vectors.get(key)
+        if vector is None:
+            vector = vectors[key] = catalog.doses(*key, 1.0)
+        if req.cal_mag:
+            skey = (req.cal_mag, req.unit)
+            if skey not in supp_vectors:
+                supp_vectors[skey] = catalog.supplement_dose(req.cal_mag, req.unit, 1.0)
+            supp = supp_vectors[skey]
+            if supp and catalog.entry(req.manufacturer, req.series) is not None:
+                vector = vector + [supp]
+        volume = float(req.volume)
+        for name, per_volume, label in vector:
+            req_col.append(i)
+            comp_col.append(name)
+            amt_col.append(per_volume * volume)
+            unit_col.append(label)
+
+    return DoseTable(req_col, comp_col, amt_col, unit_col)
+
+
+def format_dose_table(table: DoseTable, count: int) -> List[List[str]]:
+    """Format ``table`` into the same lines :func:`calculate_nutrients` returns.
+
+    ``count`` is the number of requests; requests without rows get an empty
+    list.
+    """
+    out: List[List[str]] = [[] for _ in range(count)]
+    for i, name, amt, u in table.rows():
+        out[i].append(f"{name}: {amt:.1f} {u}")
+    return out
+
+
+def dose_totals(table: DoseTable) -> Dict[Tuple[str, str], float]:
+    """Sum amounts per (component, unit) across all requests."""
+    totals: Dict[Tuple[str, str], float] = {}
+    for _, name, amt, u in table.rows():
+        totals[(name, u)] = totals.get((name, u), 0.0) + amt
+    return totals
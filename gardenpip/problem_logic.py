@@ -1,17 +1,362 @@
 import json
-from typing import Any, Dict, List, Optional
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union
 
+from .instrument import timed
+from .snapshot import KIND_PROBLEMS, Snapshot, open_snapshot
 
-def load_problem_data(path: str) -> List[Dict[str, Any]]:
-    """Load problem entries from a JSON file."""
+
+@timed()
+def load_problem_data(path: str) -> Sequence[Dict[str, Any]]:
+    """Load problem entries from a JSON file.
+
+    If the file has a current snapshot, entries are read from it lazily
+    instead.
+    """
+    snap = open_snapshot(path, KIND_PROBLEMS)
+    if snap is not None:
+        return snap.records()
     with open(path, 'r', encoding='utf-8') as fh:
         data = json.load(fh)
     return data.get("problems", [])
 
 
-def search_problems(problems: List[Dict[str, Any]], plant: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Return problems matching the given plant name."""
+# Searchable fields and their weight in the ranking.
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "symptoms": 2.0,
+    "applicablePlants": 2.0,
+    "description": 1.0,
+    "possibleCauses": 1.0,
+    "growthStages": 1.0,
+    "growMedia": 1.0,
+    "hydroponicSystems": 1.0,
+}
+
+# Facet name -> problem field.
+FACETS = {
+    "plant": "applicablePlants",
+    "stage": "growthStages",
+    "medium": "growMedia",
+    "system": "hydroponicSystems",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split ``text`` into lower-case terms with plural ``s`` folded away."""
+    terms = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        terms.append(tok)
+    return terms
+
+
+def _field_text(value: Any) -> str:
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value or "")
+
+
+class ProblemIndex:
+    """Inverted index over problem entries with BM25 ranking.
+
+    Term frequencies are summed over all :data:`FIELD_WEIGHTS` fields,
+    scaled by field weight.  Facet values are indexed separately so
+    filters are set intersections.
+    """
+
+    def __init__(self, problems: List[Dict[str, Any]], k1: float = 1.2, b: float = 0.75) -> None:
+        self.problems = problems
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_len: List[float] = []
+        self._facets: Dict[str, Dict[str, Set[int]]] = {name: {} for name in FACETS}
+
+        for doc, problem in enumerate(problems):
+            length = 0.0
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(_field_text(problem.get(field))):
+                    postings = self._postings.setdefault(term, {})
+                    postings[doc] = postings.get(doc, 0.0) + weight
+                    length += weight
+            self._doc_len.append(length)
+            for name, field in FACETS.items():
+                for value in problem.get(field, []) or []:
+                    self._facets[name].setdefault(str(value).lower(), set()).add(doc)
+
+        count = len(problems)
+        self._avg_len = (sum(self._doc_len) / count) if count else 0.0
+        self._idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    @classmethod
+    def from_snapshot(cls, snap: Snapshot, k1: float = 1.2, b: float = 0.75) -> "ProblemIndex":
+        """Return an index over a problem snapshot without re-indexing."""
+        index = cls.__new__(cls)
+        index.problems = snap.records()
+        index.k1 = k1
+        index.b = b
+        index._postings, index._idf, index._doc_len, facets = snap.index_tables()
+        index._facets = {name: facets.get(name, {}) for name in FACETS}
+        count = len(index.problems)
+        index._avg_len = (sum(index._doc_len) / count) if count else 0.0
+        return index
+
+    def index_tables(self) -> Tuple[Mapping[str, Mapping[int, float]], Mapping[str, float],
+                                    Sequence[float], Dict[str, Mapping[str, Set[int]]]]:
+        """Return ``(postings, idf, doc_len, facets)``, as stored in a snapshot."""
+        return self._postings, self._idf, self._doc_len, self._facets
+
+    def facet_values(self, name: str) -> List[str]:
+        """Return the known (lower-case) values of a facet."""
+        return sorted(self._facets[name])
+
+    def _filter(self, filters: Dict[str, Optional[str]]) -> Optional[Set[int]]:
+        allowed: Optional[Set[int]] = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            docs = self._facets[name].get(value.lower(), set())
+            allowed = docs if allowed is None else allowed & docs
+        return allowed
+
+    @timed()
+    def search_ids(
+        self,
+        query: Optional[str] = None,
+        plant: Optional[str] = None,
+        stage: Optional[str] = None,
+        medium: Optional[str] = None,
+        system: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        """Return ``(position, score)`` pairs, best match first."""
+        allowed = self._filter({"plant": plant, "stage": stage, "medium": medium, "system": system})
+        terms = tokenize(query) if query else []
+        if not terms:
+            docs = range(len(self.problems)) if allowed is None else sorted(allowed)
+            hits = [(doc, 0.0) for doc in docs]
+            return hits[:limit] if limit is not None else hits
+
+        k1, b = self.k1, self.b
+        norm = k1 * (1 - b)
+        slope = k1 * b / self._avg_len if self._avg_len else 0.0
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc, tf in postings.items():
+                if allowed is not None and doc not in allowed:
+                    continue
+                score = idf * tf * (k1 + 1) / (tf + norm + slope * self._doc_len[doc])
+                scores[doc] = scores.get(doc, 0.0) + score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit is not None else ranked
+
+    def search(self, query: Optional[str] = None, **filters: Any) -> List[Dict[str, Any]]:
+        """Return problems matching ``query`` and facet filters, best first.
+
+        Filters are ``plant``, ``stage``, ``medium`` and ``system`` and must
+        match a listed value exactly (case-insensitive).
+        """
+        return [self.problems[doc] for doc, _ in self.search_ids(query, **filters)]
+
+
+_indexes: Dict[str, Tuple[int, ProblemIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+@timed()
+def get_problem_index(path: str) -> ProblemIndex:
+    """Return the shared index for ``path``, rebuilding it if the file changed."""
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is None or cached[0] != mtime:
+            snap = open_snapshot(key, KIND_PROBLEMS)
+            index = ProblemIndex.from_snapshot(snap) if snap is not None else ProblemIndex(load_problem_data(key))
+            cached = _indexes[key] = (mtime, index)
+        return cached[1]
+
+
+@timed()
+def search_problems(
+    problems: Union[List[Dict[str, Any]], ProblemIndex], plant: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Return problems matching the given plant name.
+
+    With a plain list this is a substring match on title and description.
+    With a :class:`ProblemIndex` the plant name is a ranked query over all
+    indexed fields.
+    """
+    if isinstance(problems, ProblemIndex):
+        return problems.search(plant)
     if plant is None:
         return problems
     plant_l = plant.lower()
     return [p for p in problems if plant_l in p.get("title", "").lower() or plant_l in p.get("description", "").lower()]
+
+
+# ── symptom diagnosis ─────────────────────────────────────────────────────────
+
+# Listed facet value that applies to everything (e.g. a "Generic" plant).
+WILDCARD = "generic"
+
+
+def normalize_symptom(text: str) -> str:
+    """Return the vocabulary form of a symptom: its :func:`tokenize` terms."""
+    return " ".join(tokenize(text))
+
+
+def _bitset(docs: List[int], count: int) -> int:
+    bitmap = bytearray((count + 7) // 8)
+    for doc in docs:
+        bitmap[doc >> 3] |= 1 << (doc & 7)
+    return int.from_bytes(bitmap, "little")
+
+
+def _bit_positions(mask: int) -> List[int]:
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    out = []
+    for i, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            out.append(i * 8 + low.bit_length() - 1)
+            byte ^= low
+    return out
+
+
+class DiagnosisIndex:
+    """Rank problems by how many observed symptoms they list.
+
+    Symptoms are normalized with :func:`normalize_symptom`.  Each symptom
+    and facet value maps to a bitset of problem positions, stored as a
+    Python int.  A diagnosis adds the selected symptoms' bitsets with
+    bit-sliced counters, so the work is a few big-int operations per
+    symptom rather than a loop over problems.
+    """
+
+    def __init__(self, problems: Sequence[Dict[str, Any]]) -> None:
+        self.problems = problems
+        self._labels: Dict[str, str] = {}
+        symptom_docs: Dict[str, List[int]] = {}
+        facet_docs: Dict[str, Dict[str, List[int]]] = {name: {} for name in FACETS}
+        self._symptom_count: List[int] = []
+        for doc, problem in enumerate(problems):
+            seen = set()
+            for text in problem.get("symptoms", []) or []:
+                key = normalize_symptom(str(text))
+                if key and key not in seen:
+                    seen.add(key)
+                    self._labels.setdefault(key, str(text))
+                    symptom_docs.setdefault(key, []).append(doc)
+            self._symptom_count.append(len(seen))
+            for name, field in FACETS.items():
+                for value in problem.get(field, []) or []:
+                    facet_docs[name].setdefault(str(value).lower(), []).append(doc)
+
+        count = len(problems)
+        self._symptoms = {key: _bitset(docs, count) for key, docs in symptom_docs.items()}
+        self._facets = {
+            name: {value: _bitset(docs, count) for value, docs in values.items()}
+            for name, values in facet_docs.items()
+        }
+
+    def symptoms(self) -> List[str]:
+        """Return one display label per distinct symptom, sorted."""
+        return sorted(self._labels.values(), key=str.lower)
+
+    def _allowed(self, filters: Dict[str, Optional[str]]) -> Optional[int]:
+        allowed: Optional[int] = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            values = self._facets[name]
+            bits = values.get(value.lower(), 0) | values.get(WILDCARD, 0)
+            allowed = bits if allowed is None else allowed & bits
+        return allowed
+
+    def diagnose_ids(
+        self,
+        symptoms: Iterable[str],
+        plant: Optional[str] = None,
+        stage: Optional[str] = None,
+        medium: Optional[str] = None,
+        system: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[int, int]]:
+        """Return ``(position, matched symptoms)`` pairs, best first.
+
+        Problems listing more of ``symptoms`` rank higher; among equals,
+        problems with fewer symptoms overall (more specific) come first.
+        Facet filters also accept problems listed as ``Generic``.
+        Unknown symptoms are ignored.
+        """
+        selected = [self._symptoms[key] for key in {normalize_symptom(s) for s in symptoms}
+                    if key in self._symptoms]
+        if not selected:
+            return []
+        # planes[i] holds bit i of each problem's match count
+        planes: List[int] = []
+        hits = 0
+        for bits in selected:
+            hits |= bits
+            carry = bits
+            for i, plane in enumerate(planes):
+                planes[i], carry = plane ^ carry, plane & carry
+                if not carry:
+                    break
+            if carry:
+                planes.append(carry)
+        allowed = self._allowed({"plant": plant, "stage": stage, "medium": medium, "system": system})
+        if allowed is not None:
+            hits &= allowed
+
+        ranked: List[Tuple[int, int]] = []
+        for matched in range(len(selected), 0, -1):
+            mask = hits
+            for i, plane in enumerate(planes):
+                mask &= plane if matched >> i & 1 else ~plane
+            if matched >> len(planes):
+                mask = 0
+            docs = sorted(_bit_positions(mask), key=lambda doc: (self._symptom_count[doc], doc))
+            ranked.extend((doc, matched) for doc in docs)
+            if limit is not None and len(ranked) >= limit:
+                return ranked[:limit]
+        return ranked
+
+    def diagnose(self, symptoms: Iterable[str], **filters: Any) -> List[Dict[str, Any]]:
+        """Return problems for the observed ``symptoms``, best match first."""
+        return [self.problems[doc] for doc, _ in self.diagnose_ids(symptoms, **filters)]
+
+
+_diagnosis: Dict[str, Tuple[int, DiagnosisIndex]] = {}
+
+
+def get_diagnosis_index(path: str) -> DiagnosisIndex:
+    """Return the shared diagnosis index for ``path``, rebuilding it if the file changed."""
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _diagnosis.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _indexes_lock:
+        cached = _diagnosis.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = _diagnosis[key] = (mtime, DiagnosisIndex(load_problem_data(key)))
+        return cached[1]
@@ -1,31 +1,247 @@
+import atexit
 import json
 import os
-from typing import Any, Dict, List
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
 
-from .shelf_logic import get_session
-from .db_models import Tray
+from .docstore import fsync_dir
+from .instrument import timed
 
+LEGACY_LOG_NAME = "schedule_log.json"
+SEGMENT_PREFIX = "schedule_log-"
+SEGMENT_SUFFIX = ".jsonl"
 
+# Segments are rotated once they grow past this size.
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+# Appends are fsynced in batches: after this many entries ...
+SYNC_EVERY = 8
+# ... or once this many seconds have passed since the last fsync.
+SYNC_INTERVAL = 2.0
+
+
+def _segment_name(index: int) -> str:
+    return f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}"
+
+
+def _segment_index(name: str) -> Optional[int]:
+    if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+        return None
+    num = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+    return int(num) if num.isdigit() else None
+
+
+def list_segments(base_dir: str) -> List[str]:
+    """Return the paths of all log segments in ``base_dir``, oldest first."""
+    if not os.path.isdir(base_dir):
+        return []
+    found = []
+    for name in os.listdir(base_dir):
+        index = _segment_index(name)
+        if index is not None:
+            found.append((index, os.path.join(base_dir, name)))
+    return [path for _, path in sorted(found)]
+
+
+def _encode(entry: Dict[str, Any]) -> bytes:
+    return (json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@timed()
+def migrate_legacy_log(base_dir: str) -> int:
+    """Move entries from the old ``schedule_log.json`` array into a segment.
+
+    Returns the number of migrated entries.  The legacy file is renamed to
+    ``schedule_log.json.migrated`` once its contents are safely on disk, so
+    the migration runs only once.
+    """
+    legacy = os.path.join(base_dir, LEGACY_LOG_NAME)
+    if not os.path.exists(legacy):
+        return 0
+    migrated = 0
+    if not list_segments(base_dir):
+        with open(legacy, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+        target = os.path.join(base_dir, _segment_name(1))
+        tmp = target + ".tmp"
+        with open(tmp, 'wb') as fh:
+            for entry in data:
+                fh.write(_encode(entry))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, target)
+        migrated = len(data)
+    # Either we just copied the entries or a previous run did and was
+    # interrupted before renaming the legacy file.
+    os.replace(legacy, legacy + ".migrated")
+    fsync_dir(base_dir)
+    return migrated
+
+
+def _repair_tail(path: str) -> None:
+    """Truncate a partially written last line left behind by a crash."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, 'rb+') as fh:
+        fh.seek(-1, os.SEEK_END)
+        if fh.read(1) == b"\n":
+            return
+        # Walk back to the last complete line.
+        pos = size
+        chunk = 4096
+        while pos > 0:
+            start = max(0, pos - chunk)
+            fh.seek(start)
+            buf = fh.read(pos - start)
+            nl = buf.rfind(b"\n")
+            if nl != -1:
+                pos = start + nl + 1
+                break
+            pos = start
+        fh.truncate(pos)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+class ScheduleLog:
+    """Append-only schedule log made of JSON Lines segment files.
+
+    Each entry is written as a single line to the newest segment, so an
+    append costs the same no matter how much history exists.  Writes are
+    handed to the OS immediately and fsynced in batches; a line torn by a
+    power cut is dropped when the log is reopened.
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        segment_max_bytes: int = SEGMENT_MAX_BYTES,
+        sync_every: int = SYNC_EVERY,
+        sync_interval: float = SYNC_INTERVAL,
+    ) -> None:
+        self.base_dir = base_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._fh = None
+        self._segment = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _open(self) -> None:
+        os.makedirs(self.base_dir, exist_ok=True)
+        migrate_legacy_log(self.base_dir)
+        segments = list_segments(self.base_dir)
+        if segments:
+            last = segments[-1]
+            self._segment = _segment_index(os.path.basename(last))
+            _repair_tail(last)
+        else:
+            self._segment = 1
+        path = os.path.join(self.base_dir, _segment_name(self._segment))
+        self._fh = open(path, 'ab')
+
+    def _rotate(self) -> None:
+        self._sync()
+        self._fh.close()
+        self._segment += 1
+        path = os.path.join(self.base_dir, _segment_name(self._segment))
+        self._fh = open(path, 'ab')
+        fsync_dir(self.base_dir)
+
+    def _sync(self) -> None:
+        if self._pending:
+            os.fsync(self._fh.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Append ``entry`` to the log."""
+        line = _encode(entry)
+        with self._lock:
+            if self._fh is None:
+                self._open()
+            size = self._fh.tell()
+            if size and size + len(line) > self.segment_max_bytes:
+                self._rotate()
+            self._fh.write(line)
+            self._fh.flush()
+            self._pending += 1
+            if (self._pending >= self.sync_every
+                    or time.monotonic() - self._last_sync >= self.sync_interval):
+                self._sync()
+
+    def sync(self) -> None:
+        """Force pending entries to disk."""
+        with self._lock:
+            if self._fh is not None:
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._sync()
+                self._fh.close()
+                self._fh = None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter_schedule(self.base_dir)
+
+
+def iter_schedule(base_dir: str) -> Iterator[Dict[str, Any]]:
+    """Yield logged entries oldest first without loading the whole log."""
+    legacy = os.path.join(base_dir, LEGACY_LOG_NAME)
+    segments = list_segments(base_dir)
+    if not segments and os.path.exists(legacy):
+        with open(legacy, 'r', encoding='utf-8') as fh:
+            yield from json.load(fh)
+        return
+    for path in segments:
+        with open(path, 'rb') as fh:
+            for raw in fh:
+                if not raw.endswith(b"\n"):
+                    # torn write at the end of the log
+                    break
+                yield json.loads(raw)
+
+
+_logs: Dict[str, ScheduleLog] = {}
+_logs_lock = threading.Lock()
+
+
+def get_schedule_log(base_dir: str) -> ScheduleLog:
+    """Return the shared :class:`ScheduleLog` for ``base_dir``."""
+    key = os.path.abspath(base_dir)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = ScheduleLog(key)
+        return log
+
+
+@atexit.register
+def _close_logs() -> None:
+    with _logs_lock:
+        for log in _logs.values():
+            log.close()
+
+
+@timed()
 def log_schedule(entry: Dict[str, Any], base_dir: str) -> None:
-    """Append a schedule entry to the log file inside ``base_dir``."""
+    """Append a schedule entry to the log inside ``base_dir``."""
     # fill tray info from database if missing
     if 'tray_id' not in entry:
-        session = get_session()
-        tray = session.query(Tray).first()
+        # imported here so logging to disk doesn't require loading SQLAlchemy
+        from sqlalchemy import select
+
+        from .db import Tray, session_scope
+
+        with session_scope() as session:
+            tray = session.execute(select(Tray.id, Tray.shelf_id).limit(1)).first()
         if tray:
             entry['tray_id'] = tray.id
             entry.setdefault('shelf_id', tray.shelf_id)
-        session.close()
-
-    os.makedirs(base_dir, exist_ok=True)
-    log_path = os.path.join(base_dir, "schedule_log.json")
-
-    if os.path.exists(log_path):
-        with open(log_path, 'r', encoding='utf-8') as fh:
-            data = json.load(fh)
-    else:
-        data = []
 
-    data.append(entry)
-    with open(log_path, 'w', encoding='utf-8') as fh:
-        json.dump(data, fh, indent=2)
+    get_schedule_log(base_dir).append(entry)
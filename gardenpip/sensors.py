@@ -0,0 +1,311 @@
+"""Read pH/TDS probes over serial and store their readings.
+
+Each probe is a serial device sending one newline-terminated frame per
+sample, e.g. ``ph=6.02 ppm=950`` or ``PH:6.02,TDS:950``.  A frame may end
+in an NMEA-style ``*HH`` checksum (XOR of the bytes before ``*``), which
+is verified when present.
+
+:class:`IngestService` reads any number of probes concurrently on an
+asyncio loop.  Valid readings go through a bounded queue to a writer
+that stores them in batches with :func:`gardenpip.db.add_nutrient_logs`.
+When the database falls behind, the queue fills up and the readers stop
+reading until there is room again; the kernel buffers the serial data
+meanwhile.  A batch that fails with a transient database error (such as
+"database is locked") is kept and retried.  :meth:`IngestService.stop`
+lets the writer store everything already read before the service ends.
+:meth:`IngestService.start_in_thread` runs the whole service on its own
+thread so the Kivy loop is never blocked.
+"""
+import argparse
+import asyncio
+import datetime as _dt
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+PH_RANGE = (0.0, 14.0)
+PPM_RANGE = (0.0, 10000.0)
+
+_PAIR_RE = re.compile(r"([A-Za-z]+)\s*[=:]\s*([-+0-9.eE]+)")
+_KEYS = {"ph": "ph", "ppm": "ppm", "tds": "ppm"}
+
+# attempts at storing a failing batch once the service is stopping
+STOP_RETRIES = 3
+
+# queued after the last reading when the service stops
+_STOP = object()
+
+
+class FrameError(ValueError):
+    """Raised for frames that can't be parsed or fail validation."""
+
+
+class Reading(NamedTuple):
+    tray_id: int
+    ph: float
+    ppm: float
+    date: _dt.datetime
+
+
+class ProbeConfig(NamedTuple):
+    port: str
+    tray_id: int
+    baudrate: int = 9600
+
+
+def parse_frame(frame: bytes) -> Tuple[float, float]:
+    """Return ``(ph, ppm)`` from a probe frame or raise :class:`FrameError`."""
+    try:
+        text = frame.decode("ascii").strip()
+    except UnicodeDecodeError:
+        raise FrameError("frame is not ASCII")
+    if "*" in text:
+        body, _, checksum = text.rpartition("*")
+        expected = 0
+        for ch in body.encode("ascii"):
+            expected ^= ch
+        try:
+            ok = int(checksum, 16) == expected
+        except ValueError:
+            ok = False
+        if not ok:
+            raise FrameError(f"bad checksum in {text!r}")
+        text = body
+    values: Dict[str, float] = {}
+    for key, raw in _PAIR_RE.findall(text):
+        name = _KEYS.get(key.lower())
+        if name is None:
+            continue
+        try:
+            values[name] = float(raw)
+        except ValueError:
+            raise FrameError(f"bad {key} value {raw!r}")
+    if "ph" not in values or "ppm" not in values:
+        raise FrameError(f"missing pH or ppm in {text!r}")
+    ph, ppm = values["ph"], values["ppm"]
+    if not PH_RANGE[0] <= ph <= PH_RANGE[1]:
+        raise FrameError(f"pH {ph} out of range")
+    if not PPM_RANGE[0] <= ppm <= PPM_RANGE[1]:
+        raise FrameError(f"ppm {ppm} out of range")
+    return ph, ppm
+
+
+async def open_probe(probe: ProbeConfig) -> Tuple[asyncio.StreamReader, Any, asyncio.BaseTransport]:
+    """Open ``probe.port`` and return ``(reader, serial, transport)``.
+
+    pyserial configures the line; reading happens through an asyncio pipe
+    transport, which stops reading the device while the reader's buffer
+    is full.
+    """
+    import serial  # pyserial
+
+    ser = serial.Serial(probe.port, baudrate=probe.baudrate, timeout=0)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=4096)
+    pipe = os.fdopen(os.dup(ser.fileno()), "rb", buffering=0)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, ser, transport
+
+
+class IngestService:
+    """Concurrently read probes and batch their readings into the database."""
+
+    def __init__(
+        self,
+        probes: List[ProbeConfig],
+        db_path: Optional[str] = None,
+        queue_size: int = 1000,
+        batch_size: int = 200,
+        batch_delay: float = 0.5,
+        reconnect_delay: float = 2.0,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.probes = list(probes)
+        self.db_path = db_path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.reconnect_delay = reconnect_delay
+        self.retry_delay = retry_delay
+        self.stats = {"connected": 0, "received": 0, "rejected": 0, "stored": 0, "dropped": 0, "errors": 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+
+    # ── probe readers ────────────────────────────────────────────────────────
+
+    async def _read_probe(self, probe: ProbeConfig, queue: asyncio.Queue) -> None:
+        while True:
+            ser = transport = None
+            try:
+                reader, ser, transport = await open_probe(probe)
+                self.stats["connected"] += 1
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        raise EOFError(probe.port)
+                    self.stats["received"] += 1
+                    try:
+                        ph, ppm = parse_frame(line)
+                    except FrameError:
+                        self.stats["rejected"] += 1
+                        continue
+                    # blocks while the queue is full: backpressure
+                    await queue.put(Reading(probe.tray_id, ph, ppm, _dt.datetime.utcnow()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.stats["errors"] += 1
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                if transport is not None:
+                    self.stats["connected"] -= 1
+                    transport.close()
+                if ser is not None:
+                    ser.close()
+
+    # ── batch writer ─────────────────────────────────────────────────────────
+
+    def _store(self, batch: List[Reading]) -> int:
+        from .db import add_nutrient_logs, session_scope
+
+        with session_scope(self.db_path) as session:
+            return add_nutrient_logs(session, [r._asdict() for r in batch])
+
+    async def _write(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    await self._flush(batch)
+                    return
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Reading]) -> None:
+        from sqlalchemy.exc import OperationalError
+
+        loop = asyncio.get_running_loop()
+        attempts = 0
+        while True:
+            try:
+                # the database runs in a worker thread so the loop keeps reading
+                self.stats["stored"] += await loop.run_in_executor(None, self._store, batch)
+                return
+            except OperationalError:
+                # e.g. "database is locked": keep the batch; the queue
+                # filling up meanwhile holds the readers back
+                self.stats["errors"] += 1
+                attempts += 1
+                if self._stopping.is_set() and attempts >= STOP_RETRIES:
+                    break
+                await asyncio.sleep(self.retry_delay)
+            except Exception:
+                self.stats["errors"] += 1
+                break
+        self.stats["dropped"] += len(batch)
+
+    # ── lifecycle ────────────────────────────────────────────────────────────
+
+    async def run(self) -> None:
+        """Run until :meth:`stop` is called, then store what has been read."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        readers = [asyncio.create_task(self._read_probe(p, queue)) for p in self.probes]
+        writer = asyncio.create_task(self._write(queue))
+        self._ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in readers:
+                task.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+            # the writer drains the queue, including a half-collected batch,
+            # and returns at the sentinel
+            await queue.put(_STOP)
+            await writer
+
+    def stop(self) -> None:
+        """Ask the service to stop; safe to call from any thread."""
+        self._ready.wait()
+        self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def start_in_thread(self) -> threading.Thread:
+        """Run the service on a daemon thread with its own event loop."""
+        thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="IngestService", daemon=True)
+        thread.start()
+        self._ready.wait()
+        return thread
+
+
+class FakeSerialDevice:
+    """Pseudo-terminal that behaves like a probe, for tests and demos.
+
+    Open :attr:`port` as the serial device and call :meth:`send` to emit
+    frames.
+    """
+
+    def __init__(self) -> None:
+        self._master, self._slave = os.openpty()
+        self.port = os.ttyname(self._slave)
+
+    def send(self, frame: str) -> None:
+        os.write(self._master, frame.encode("ascii") + b"\n")
+
+    def send_reading(self, ph: float, ppm: float, checksum: bool = False) -> None:
+        body = f"ph={ph:.2f} ppm={ppm:.0f}"
+        if checksum:
+            value = 0
+            for ch in body.encode("ascii"):
+                value ^= ch
+            body = f"{body}*{value:02X}"
+        self.send(body)
+
+    def close(self) -> None:
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def _probe_arg(value: str) -> ProbeConfig:
+    port, _, tray = value.rpartition(":")
+    if not port or not tray.isdigit():
+        raise argparse.ArgumentTypeError("expected PORT:TRAY_ID")
+    return ProbeConfig(port, int(tray))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Store pH/TDS probe readings in the Garden Pip database.")
+    parser.add_argument("probes", nargs="+", type=_probe_arg, metavar="PORT:TRAY_ID")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--db", help="database path (default: the application database)")
+    args = parser.parse_args(argv)
+    probes = [p._replace(baudrate=args.baud) for p in args.probes]
+    service = IngestService(probes, db_path=args.db)
+    thread = service.start_in_thread()
+    try:
+        while True:
+            time.sleep(10)
+            print(service.stats, flush=True)
+    except KeyboardInterrupt:
+        service.stop()
+        # the thread is a daemon: wait for it to store what was read
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+"""Headless JSON API over HTTP.
+
+Serves the nutrient calculator, problem search, shelf layouts and
+nutrient logs to other devices without Kivy::
+
+    python -m gardenpip.server --port 8080
+
+All endpoints are ``GET`` and take their parameters from the query string:
+
+* ``/api/nutrients`` – manufacturers, their series and stages, supplements
+* ``/api/nutrients/calculate`` – ``manufacturer``, ``series``, ``stage``,
+  ``unit``, ``volume`` and optional ``cal_mag``
+* ``/api/problems/search`` – ``q``, facet filters (``plant``, ``stage``,
+  ``medium``, ``system``), ``limit`` and ``offset``
+* ``/api/problems/diagnose`` – repeated ``symptom`` plus facet filters
+* ``/api/layout`` – ``system``
+* ``/api/logs`` – ``q``, ``tray_id``, ``limit``, and ``after_date`` and
+  ``after_id`` from the previous page's ``next``
+* ``/api/logs/history`` – ``tray_id``, ``start``, ``end``, ``max_points``
+* ``/api/alerts`` – pH/ppm anomalies, newest first; ``tray_id``, ``since``,
+  ``limit``
+
+Responses are cached per path and parameters.  A cached response is reused
+while its data source has not changed.  For the reference data that means
+the file's mtime.  For logs it is the last change sequence number, and
+layouts are cached for :data:`LAYOUT_TTL` seconds.  A history request
+without ``end`` reaches up to the current time and is never cached.  Every response
+carries an ``ETag``, and a matching ``If-None-Match`` gets ``304 Not
+Modified``.  Concurrent identical requests share one computation.
+
+Handlers run on a thread pool sized to the database connection pool.
+Each database call gets its own session, so requests never share one.
+"""
+import argparse
+import asyncio
+import datetime as _dt
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .instrument import span
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUTRIENTS_PATH = os.path.join(_ROOT, "nutrients.json")
+PROBLEMS_PATH = os.path.join(_ROOT, "hydroponicProblems.json")
+
+# cached responses kept, least recently used dropped first
+CACHE_SIZE = 1024
+# seconds a layout response is reused without checking the database
+LAYOUT_TTL = 2.0
+MAX_LIMIT = 500
+MAX_POINTS = 5000
+MAX_HEADER_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = 30.0
+
+_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 431: "Request Header Fields Too Large",
+            500: "Internal Server Error"}
+
+Params = Dict[str, List[str]]
+
+
+class BadRequest(ValueError):
+    """Raised by handlers for missing or invalid parameters."""
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes
+    etag: Optional[str] = None
+
+
+# ── parameters ───────────────────────────────────────────────────────────────
+
+def _param(params: Params, name: str, default: Optional[str] = None, required: bool = False) -> Optional[str]:
+    values = params.get(name)
+    if not values or values[0] == "":
+        if required:
+            raise BadRequest(f"missing parameter {name!r}")
+        return default
+    return values[0]
+
+
+def _number(params: Params, name: str, kind: Callable[[str], Any], default: Any = None,
+            required: bool = False) -> Any:
+    value = _param(params, name, required=required)
+    if value is None:
+        return default
+    try:
+        return kind(value)
+    except ValueError:
+        raise BadRequest(f"invalid {name!r}: {value!r}") from None
+
+
+def _bounded(params: Params, name: str, default: int, maximum: int) -> int:
+    value = _number(params, name, int, default)
+    if not 0 < value <= maximum:
+        raise BadRequest(f"{name} must be between 1 and {maximum}")
+    return value
+
+
+def _limit(params: Params, default: int = 50) -> int:
+    return _bounded(params, "limit", default, MAX_LIMIT)
+
+
+def _facets(params: Params) -> Dict[str, Optional[str]]:
+    return {name: _param(params, name) for name in ("plant", "stage", "medium", "system")}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (_dt.date, _dt.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# ── handlers ─────────────────────────────────────────────────────────────────
+# Handlers run on the worker pool and return JSON-serializable data.
+
+def _nutrients(server: "APIServer", params: Params) -> Any:
+    from .nutrient_logic import get_catalog
+
+    catalog = get_catalog(server.nutrients_path)
+    return {
+        "manufacturers": {
+            man: {ser: catalog.stages(man, ser) for ser in catalog.series(man)}
+            for man in catalog.manufacturers()
+        },
+        "supplements": catalog.supplements(),
+    }
+
+
+def _calculate(server: "APIServer", params: Params) -> Any:
+    from .nutrient_logic import calculate_nutrients, get_catalog
+
+    catalog = get_catalog(server.nutrients_path)
+    man = _param(params, "manufacturer", required=True)
+    ser = _param(params, "series", required=True)
+    stage = _param(params, "stage", required=True)
+    unit = _param(params, "unit", "metric")
+    volume = _number(params, "volume", float, required=True)
+    if not (math.isfinite(volume) and volume > 0):
+        raise BadRequest("volume must be a positive number")
+    cal_mag = _param(params, "cal_mag")
+    if catalog.entry(man, ser) is None:
+        raise BadRequest(f"unknown nutrient series {man!r} / {ser!r}")
+    if stage not in catalog.stages(man, ser):
+        raise BadRequest(f"unknown stage {stage!r}")
+    if unit not in catalog.units():
+        raise BadRequest(f"unknown unit {unit!r}")
+    doses = [{"name": n, "amount": a, "unit": u} for n, a, u in catalog.doses(man, ser, stage, unit, volume)]
+    supplement = catalog.supplement_dose(cal_mag, unit, volume) if cal_mag else None
+    return {
+        "doses": doses,
+        "supplement": {"name": supplement[0], "amount": supplement[1], "unit": supplement[2]}
+        if supplement else None,
+        "lines": calculate_nutrients(catalog, man, ser, stage, _param(params, "plant_category", ""),
+                                     unit, volume, cal_mag),
+    }
+
+
+def _search(server: "APIServer", params: Params) -> Any:
+    from .problem_logic import get_problem_index
+
+    index = get_problem_index(server.problems_path)
+    limit = _limit(params, 20)
+    offset = _number(params, "offset", int, 0)
+    if offset < 0:
+        raise BadRequest("offset must not be negative")
+    try:
+        hits = index.search_ids(_param(params, "q"), **_facets(params))
+    except KeyError as exc:
+        raise BadRequest(f"unknown facet {exc}") from None
+    return {
+        "total": len(hits),
+        "results": [dict(index.problems[doc], score=score) for doc, score in hits[offset:offset + limit]],
+    }
+
+
+def _diagnose(server: "APIServer", params: Params) -> Any:
+    from .problem_logic import get_diagnosis_index
+
+    index = get_diagnosis_index(server.problems_path)
+    symptoms = params.get("symptom", [])
+    if not symptoms:
+        raise BadRequest("missing parameter 'symptom'")
+    hits = index.diagnose_ids(symptoms, limit=_limit(params, 20), **_facets(params))
+    return {"results": [dict(index.problems[doc], matched=matched) for doc, matched in hits]}
+
+
+def _layout(server: "APIServer", params: Params) -> Any:
+    from .shelf_logic import get_system_layout
+
+    # another process (the app) may have edited it, so this skips the
+    # in-process cache; the route's TTL limits how often it runs
+    return {"layout": get_system_layout(_param(params, "system", "default"), server.db_path, cached=False)}
+
+
+def _log_dict(log: Any) -> Dict[str, Any]:
+    return {"id": log.id, "tray_id": log.tray_id, "date": log.date, "ph": log.ph, "ppm": log.ppm,
+            "notes": log.notes}
+
+
+def _logs(server: "APIServer", params: Params) -> Any:
+    from .db import search_nutrient_logs_page, session_scope
+
+    limit = _limit(params)
+    after = None
+    if _param(params, "after_date") is not None:
+        after = (_number(params, "after_date", _dt.datetime.fromisoformat),
+                 _number(params, "after_id", int, required=True))
+    with session_scope(server.db_path) as session:
+        page = search_nutrient_logs_page(session, _param(params, "q"), _number(params, "tray_id", int),
+                                         after, limit)
+        logs = [_log_dict(log) for log in page]
+    nxt = {"after_date": logs[-1]["date"], "after_id": logs[-1]["id"]} if len(logs) == limit else None
+    return {"logs": logs, "next": nxt}
+
+
+def _history(server: "APIServer", params: Params) -> Any:
+    from .db import nutrient_history, session_scope
+
+    tray_id = _number(params, "tray_id", int, required=True)
+    end = _number(params, "end", _dt.datetime.fromisoformat) or _dt.datetime.utcnow()
+    start = _number(params, "start", _dt.datetime.fromisoformat) or end - _dt.timedelta(days=7)
+    max_points = _bounded(params, "max_points", 500, MAX_POINTS)
+    with session_scope(server.db_path) as session:
+        resolution, points = nutrient_history(session, tray_id, start, end, max_points)
+    return {"resolution": resolution, "points": [p._asdict() for p in points]}
+
+
+def _alerts(server: "APIServer", params: Params) -> Any:
+    from .db import recent_alerts, session_scope
+
+    since = _number(params, "since", _dt.datetime.fromisoformat)
+    with session_scope(server.db_path) as session:
+        alerts = recent_alerts(session, _number(params, "tray_id", int), since, _limit(params))
+        return {"alerts": [
+            {"id": a.id, "tray_id": a.tray_id, "log_id": a.log_id, "date": a.date, "metric": a.metric,
+             "kind": a.kind, "value": a.value, "expected": a.expected, "score": a.score}
+            for a in alerts
+        ]}
+
+
+def _health(server: "APIServer", params: Params) -> Any:
+    return {"ok": True}
+
+
+# ── data versions ────────────────────────────────────────────────────────────
+# A cached response is valid while its source's version is unchanged.
+
+def _file_version(path: str) -> Any:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _logs_version(server: "APIServer") -> Any:
+    from sqlalchemy import func, select
+
+    from .db import session_scope
+    from .db.models import NutrientLogChange
+
+    with session_scope(server.db_path) as session:
+        return session.execute(select(func.max(NutrientLogChange.seq))).scalar()
+
+
+class Route(NamedTuple):
+    handler: Callable[["APIServer", Params], Any]
+    # returns the data version; None disables caching
+    version: Optional[Callable[["APIServer"], Any]] = None
+    # whether version() does I/O and must run on the worker pool
+    blocking: bool = False
+    # parameters that default to the current time; a request leaving one
+    # out depends on the clock and is not cached
+    now_defaults: Tuple[str, ...] = ()
+
+
+ROUTES: Dict[str, Route] = {
+    "/api/health": Route(_health),
+    "/api/nutrients": Route(_nutrients, lambda s: _file_version(s.nutrients_path)),
+    "/api/nutrients/calculate": Route(_calculate, lambda s: _file_version(s.nutrients_path)),
+    "/api/problems/search": Route(_search, lambda s: _file_version(s.problems_path)),
+    "/api/problems/diagnose": Route(_diagnose, lambda s: _file_version(s.problems_path)),
+    "/api/layout": Route(_layout, lambda s: int(time.monotonic() / LAYOUT_TTL)),
+    "/api/logs": Route(_logs, _logs_version, blocking=True),
+    "/api/logs/history": Route(_history, _logs_version, blocking=True, now_defaults=("end",)),
+    # alerts are written in the same transaction as the logs that raise them
+    "/api/alerts": Route(_alerts, _logs_version, blocking=True),
+}
+
+
+# ── server ───────────────────────────────────────────────────────────────────
+
+class APIServer:
+    """The HTTP server.  Use :meth:`serve` on a running loop, or
+    :meth:`start_in_thread` to run it on its own thread."""
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        db_path: Optional[str] = None,
+        nutrients_path: str = NUTRIENTS_PATH,
+        problems_path: str = PROBLEMS_PATH,
+        workers: Optional[int] = None,
+        cache_size: int = CACHE_SIZE,
+    ) -> None:
+        from .db.engine import MAX_OVERFLOW, POOL_SIZE
+
+        self.host = host
+        self.port = port
+        self.db_path = db_path
+        self.nutrients_path = nutrients_path
+        self.problems_path = problems_path
+        self.cache_size = cache_size
+        self.stats = {"requests": 0, "hits": 0, "not_modified": 0, "errors": 0}
+        self._executor = ThreadPoolExecutor(workers or POOL_SIZE + MAX_OVERFLOW, "gardenpip-api")
+        # (path, params) -> (version, response)
+        self._cache: "OrderedDict[Tuple, Tuple[Any, Response]]" = OrderedDict()
+        self._inflight: Dict[Tuple, "asyncio.Future[Response]"] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._ready: Optional[threading.Event] = None
+        # connection handler -> its writer, closed on stop
+        self._clients: Dict["asyncio.Task[None]", asyncio.StreamWriter] = {}
+
+    # ── request handling ─────────────────────────────────────────────────────
+
+    def _run(self, fn: Callable[..., Any], *args: Any) -> Awaitable[Any]:
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _render(self, route: Route, params: Params) -> Response:
+        try:
+            data = route.handler(self, params)
+        except BadRequest as exc:
+            return Response(400, json.dumps({"error": str(exc)}).encode())
+        body = json.dumps(data, default=_json_default, ensure_ascii=False, allow_nan=False).encode("utf-8")
+        return Response(200, body, '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest())
+
+    async def respond(self, path: str, params: Params) -> Response:
+        """Return the response for ``path``, from the cache if still valid."""
+        self.stats["requests"] += 1
+        route = ROUTES.get(path)
+        if route is None:
+            return Response(404, b'{"error": "not found"}')
+        if route.version is None or any(_param(params, name) is None for name in route.now_defaults):
+            return await self._run(self._render, route, params)
+
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        version = await self._run(route.version, self) if route.blocking else route.version(self)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return cached[1]
+
+        flight = self._inflight.get((key, version))
+        if flight is not None:
+            self.stats["hits"] += 1
+            return await asyncio.shield(flight)
+        flight = self._inflight[(key, version)] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self._run(self._render, route, params)
+        except BaseException as exc:
+            flight.set_exception(exc)
+            flight.exception()  # don't warn if nobody else was waiting
+            raise
+        else:
+            flight.set_result(response)
+        finally:
+            del self._inflight[(key, version)]
+        if response.status == 200:
+            self._cache[key] = (version, response)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return response
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, Response(431, b'{"error": "headers too large"}'), False)
+                    return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                keep_alive = await self._handle_request(head, reader, writer)
+                if not keep_alive:
+                    return
+        finally:
+            del self._clients[task]
+            writer.close()
+
+    async def _handle_request(self, head: bytes, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            await self._send(writer, Response(400, b'{"error": "bad request line"}'), False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        keep_alive = (headers.get("connection", "").lower() != "close"
+                      if version == "HTTP/1.1" else headers.get("connection", "").lower() == "keep-alive")
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._send(writer, Response(400, b'{"error": "bad content-length"}'), False)
+            return False
+        if length:
+            await reader.readexactly(length)  # bodies are not used
+
+        if method not in ("GET", "HEAD"):
+            response = Response(405, b'{"error": "method not allowed"}')
+        else:
+            url = urlsplit(target)
+            try:
+                with span(f"api:{url.path}"):
+                    response = await self.respond(url.path, parse_qs(url.query))
+            except Exception as exc:
+                self.stats["errors"] += 1
+                response = Response(500, json.dumps({"error": repr(exc)}).encode())
+            if response.etag and response.etag in _etags(headers.get("if-none-match")):
+                self.stats["not_modified"] += 1
+                response = Response(304, b"", response.etag)
+        await self._send(writer, response, keep_alive, head_only=method == "HEAD")
+        return keep_alive
+
+    async def _send(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool,
+                    head_only: bool = False) -> None:
+        status, body, etag = response
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        if status != 304:
+            head.append("Content-Type: application/json; charset=utf-8")
+            head.append(f"Content-Length: {len(body)}")
+        if etag:
+            head.append(f"ETag: {etag}")
+            head.append("Cache-Control: no-cache")
+        head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        data = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+        writer.write(data if head_only or status == 304 else data + body)
+        await writer.drain()
+
+    # ── lifecycle ────────────────────────────────────────────────────────────
+
+    async def serve(self) -> None:
+        """Serve until :meth:`stop` is called."""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self._ready is not None:
+            self._ready.set()
+        async with self._server:
+            await self._stopped.wait()
+            # idle keep-alive connections see EOF and end their handlers,
+            # rather than being cancelled when the loop shuts down
+            for writer in list(self._clients.values()):
+                writer.close()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    def start_in_thread(self) -> None:
+        """Run the server on a daemon thread; returns once it is listening."""
+        self._ready = threading.Event()
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="APIServer", daemon=True)
+        thread.start()
+        self._ready.wait()
+
+    def stop(self) -> None:
+        """Stop serving; safe to call from any thread."""
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+
+def _etags(header: Optional[str]) -> List[str]:
+    if not header:
+        return []
+    return [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve the Garden Pip JSON API.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", help="database path (default: the application database)")
+    parser.add_argument("--nutrients", default=NUTRIENTS_PATH)
+    parser.add_argument("--problems", default=PROBLEMS_PATH)
+    parser.add_argument("--workers", type=int, help="handler threads (default: the DB pool size)")
+    args = parser.parse_args(argv)
+    server = APIServer(args.host, args.port, args.db, args.nutrients, args.problems, args.workers)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,247 @@
-import json
+import copy
 import os
-from typing import Any, List
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
+from .docstore import get_store
+from .instrument import timed
 
+
+@timed()
 def load_shelves(path: str) -> List[Any]:
-    """Load shelf data from JSON file."""
-    if not os.path.exists(path):
-        return []
-    with open(path, 'r', encoding='utf-8') as fh:
-        return json.load(fh)
+    """Load shelf data from JSON file (cached, see :mod:`gardenpip.docstore`)."""
+    return get_store(path, default=list).load()
 
 
+@timed()
 def save_shelves(path: str, data: List[Any]) -> None:
-    """Save shelf data to JSON file."""
-    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as fh:
-        json.dump(data, fh, indent=2)
+    """Save shelf data to JSON file atomically; quick successive saves are coalesced."""
+    get_store(path, default=list).save(data)
+
+
+def flatten_layout(layout: List[dict]) -> List[dict]:
+    """Return one row per shelf and per tray, in display order.
+
+    Rows are ``{'kind', 'shelf', 'tray', 'text'}`` where ``shelf`` and
+    ``tray`` index into ``layout`` (``tray`` is -1 on shelf rows).
+    """
+    rows: List[dict] = []
+    for i, shelf in enumerate(layout):
+        rows.append({'kind': 'shelf', 'shelf': i, 'tray': -1, 'text': shelf.get('name', '')})
+        for j, tray in enumerate(shelf.get('trays', [])):
+            rows.append({'kind': 'tray', 'shelf': i, 'tray': j, 'text': tray.get('label', '')})
+    return rows
+
+
+def get_session(db_path: Optional[str] = None):
+    """Return a new SQLAlchemy session on the application database."""
+    # The database layer is imported on first use so that the JSON helpers
+    # above don't pay for SQLAlchemy.
+    from . import db
+    return db.get_session(db_path)
+
+
+# (database path, system name) -> layout as returned by get_system_layout
+_layout_cache: Dict[Tuple[str, str], List[dict]] = {}
+_layout_lock = threading.Lock()
+# bumped by every save and invalidation; a read that overlapped one
+# doesn't cache its result
+_layout_generation = 0
 
-from .db_models import SessionLocal, ShelfSystem, Shelf, Tray, init_db
 
-init_db()
+def _cache_key(system_name: str, db_path: Optional[str]) -> Tuple[str, str]:
+    if db_path is None:
+        from .db import DEFAULT_DB_PATH
+        db_path = DEFAULT_DB_PATH
+    return (os.path.abspath(db_path), system_name)
 
 
-def get_session():
-    """Return a new SQLAlchemy session."""
-    return SessionLocal()
+def _invalidate(key: Optional[Tuple[str, str]] = None) -> None:
+    global _layout_generation
+    with _layout_lock:
+        _layout_generation += 1
+        if key is None:
+            _layout_cache.clear()
+        else:
+            _layout_cache.pop(key, None)
 
 
-def get_system_layout(system_name: str = 'default') -> List[dict]:
-    """Return shelf layout for the given system."""
-    session = get_session()
-    system = session.query(ShelfSystem).filter_by(name=system_name).first()
+def invalidate_layout_cache() -> None:
+    """Forget all cached layouts, e.g. after editing shelves directly."""
+    _invalidate()
+
+
+@timed()
+def get_system_layout(system_name: str = 'default', db_path: Optional[str] = None,
+                      cached: bool = True) -> List[dict]:
+    """Return shelf layout for the given system.
+
+    Each shelf is ``{'id', 'name', 'trays'}``; ``name`` is the shelf label.
+    Layouts are cached in memory until :func:`save_system_layout` changes
+    them; callers get their own copy.  ``cached=False`` reads the database,
+    for callers that must see edits made by another process.
+    """
+    key = _cache_key(system_name, db_path)
+    with _layout_lock:
+        layout = _layout_cache.get(key) if cached else None
+        generation = _layout_generation
+    if layout is not None:
+        return copy.deepcopy(layout)
+
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+
+    from .db import Shelf, ShelfSystem, session_scope
+
     layout: List[dict] = []
-    if system:
-        for shelf in system.shelves:
-            layout.append(
-                {
-                    'id': shelf.id,
-                    'name': shelf.name,
-                    'trays': [{'id': t.id, 'label': t.label} for t in shelf.trays],
-                }
+    with session_scope(db_path) as session:
+        system = session.scalars(
+            select(ShelfSystem)
+            .where(ShelfSystem.name == system_name)
+            .options(selectinload(ShelfSystem.shelves).selectinload(Shelf.trays))
+        ).first()
+        if system:
+            for shelf in system.shelves:
+                layout.append(
+                    {
+                        'id': shelf.id,
+                        'name': shelf.label,
+                        'trays': [{'id': t.id, 'label': t.label} for t in shelf.trays],
+                    }
+                )
+    with _layout_lock:
+        if generation == _layout_generation:
+            _layout_cache[key] = layout
+    return copy.deepcopy(layout)
+
+
+class TrayHasLogs(ValueError):
+    """Raised when a layout save would delete trays that still have logs."""
+
+    def __init__(self, tray_ids: List[int]) -> None:
+        super().__init__(f"trays {tray_ids} have nutrient logs")
+        self.tray_ids = tray_ids
+
+
+@timed()
+def save_system_layout(system_name: str, data: List[dict], db_path: Optional[str] = None,
+                       delete_logs: bool = False) -> List[dict]:
+    """Save layout data for the given system.
+
+    The stored layout is reconciled with ``data``: shelves and trays that
+    carry the ``id`` of an existing row are updated in place (only if
+    something changed), rows without a known ``id`` are inserted, and rows
+    missing from ``data`` are deleted together with their trays and the
+    trays' anomaly statistics and alerts.  The order of shelves and trays
+    in ``data`` is stored.  Everything happens in one transaction.
+
+    Trays that still have nutrient logs are only deleted, logs included,
+    with ``delete_logs=True``; otherwise nothing is saved and
+    :class:`TrayHasLogs` is raised, so the caller can ask first.
+
+    Returns ``data`` in the shape of :func:`get_system_layout`, with the ids
+    of newly inserted rows filled in.
+    """
+    from sqlalchemy import delete, insert, select, update
+
+    from .db import NutrientAlert, NutrientLog, Shelf, ShelfSystem, Tray, TrayStats, session_scope
+
+    key = _cache_key(system_name, db_path)
+    _invalidate(key)
+    with session_scope(db_path) as session:
+        system_id = session.execute(
+            select(ShelfSystem.id).where(ShelfSystem.name == system_name)
+        ).scalar()
+        if system_id is None:
+            system = ShelfSystem(name=system_name)
+            session.add(system)
+            session.flush()
+            system_id = system.id
+
+        shelves = {
+            row.id: (row.label, row.position)
+            for row in session.execute(
+                select(Shelf.id, Shelf.label, Shelf.position).where(Shelf.system_id == system_id)
+            )
+        }
+        trays = {
+            row.id: (row.label, row.shelf_id, row.position)
+            for row in session.execute(
+                select(Tray.id, Tray.label, Tray.shelf_id, Tray.position)
+                .join(Shelf).where(Shelf.system_id == system_id)
             )
-    session.close()
-    return layout
-
-
-def save_system_layout(system_name: str, data: List[dict]) -> None:
-    """Save layout data for the given system."""
-    session = get_session()
-    system = session.query(ShelfSystem).filter_by(name=system_name).first()
-    if not system:
-        system = ShelfSystem(name=system_name)
-        session.add(system)
-        session.commit()
-    # clear existing shelves and trays
-    for shelf in list(system.shelves):
-        session.query(Tray).filter_by(shelf_id=shelf.id).delete()
-        session.delete(shelf)
-    session.commit()
-    # add new shelves
-    for shelf_data in data:
-        shelf = Shelf(name=shelf_data.get('name', ''), system_id=system.id)
-        session.add(shelf)
-        session.flush()
-        for tray_data in shelf_data.get('trays', []):
-            tray = Tray(label=tray_data.get('label', ''), shelf_id=shelf.id)
-            session.add(tray)
-    session.commit()
-    session.close()
+        }
+
+        shelf_updates, new_shelves = [], []
+        seen = set()
+        for pos, shelf_data in enumerate(data):
+            label = shelf_data.get('name', '')
+            shelf_id = shelf_data.get('id')
+            if shelf_id in shelves and shelf_id not in seen:
+                seen.add(shelf_id)
+                if shelves[shelf_id] != (label, pos):
+                    shelf_updates.append({'id': shelf_id, 'label': label, 'position': pos})
+            else:
+                new_shelves.append(pos)
+        if new_shelves:
+            new_ids = session.scalars(
+                insert(Shelf).returning(Shelf.id, sort_by_parameter_order=True),
+                [{'label': data[pos].get('name', ''), 'system_id': system_id, 'position': pos}
+                 for pos in new_shelves],
+            ).all()
+            shelf_ids = dict(zip(new_shelves, new_ids))
+        else:
+            shelf_ids = {}
+        if shelf_updates:
+            session.execute(update(Shelf), shelf_updates)
+
+        result: List[dict] = []
+        kept_trays = set()
+        tray_updates, new_trays = [], []
+        for pos, shelf_data in enumerate(data):
+            shelf_id = shelf_ids[pos] if pos in shelf_ids else shelf_data.get('id')
+            shelf_out = {'id': shelf_id, 'name': shelf_data.get('name', ''), 'trays': []}
+            result.append(shelf_out)
+            for tray_pos, tray_data in enumerate(shelf_data.get('trays', [])):
+                tray_out = {'id': tray_data.get('id'), 'label': tray_data.get('label', '')}
+                shelf_out['trays'].append(tray_out)
+                if tray_out['id'] in trays and tray_out['id'] not in kept_trays:
+                    kept_trays.add(tray_out['id'])
+                    if trays[tray_out['id']] != (tray_out['label'], shelf_id, tray_pos):
+                        tray_updates.append({'id': tray_out['id'], 'label': tray_out['label'],
+                                             'shelf_id': shelf_id, 'position': tray_pos})
+                else:
+                    new_trays.append((tray_out, shelf_id, tray_pos))
+        if tray_updates:
+            session.execute(update(Tray), tray_updates)
+        if new_trays:
+            new_ids = session.scalars(
+                insert(Tray).returning(Tray.id, sort_by_parameter_order=True),
+                [{'label': tray['label'], 'shelf_id': shelf_id, 'position': tray_pos}
+                 for tray, shelf_id, tray_pos in new_trays],
+            ).all()
+            for (tray, _, _), tray_id in zip(new_trays, new_ids):
+                tray['id'] = tray_id
+
+        gone_trays = [tray_id for tray_id in trays if tray_id not in kept_trays]
+        kept_shelves = {shelf['id'] for shelf in result}
+        gone_shelves = [shelf_id for shelf_id in shelves if shelf_id not in kept_shelves]
+        if gone_trays:
+            logged = sorted(session.scalars(
+                select(NutrientLog.tray_id).where(NutrientLog.tray_id.in_(gone_trays)).distinct()
+            ))
+            if logged and not delete_logs:
+                # session_scope rolls back everything above
+                raise TrayHasLogs(logged)
+            if logged:
+                session.execute(delete(NutrientLog).where(NutrientLog.tray_id.in_(logged)))
+            # tray ids are reused, so a new tray must not inherit these
+            session.execute(delete(TrayStats).where(TrayStats.tray_id.in_(gone_trays)))
+            session.execute(delete(NutrientAlert).where(NutrientAlert.tray_id.in_(gone_trays)))
+            session.execute(delete(Tray).where(Tray.id.in_(gone_trays)))
+        if gone_shelves:
+            session.execute(delete(Shelf).where(Shelf.id.in_(gone_shelves)))
+    # again after the commit: a read that began during the save may have
+    # seen the old rows
+    _invalidate(key)
+    return result
@@ -0,0 +1,579 @@
+"""Compact binary snapshots of the reference data files.
+
+``python -m gardenpip.snapshot nutrients.json hydroponicProblems.json``
+compiles each JSON file into a ``.snap`` file next to it.  A snapshot is a
+set of named, typed arrays:
+
+* a string table in which every distinct string is stored once;
+* the JSON document as a tagged value stream referring to that table, cut
+  into records (one per nutrient series, supplement or problem);
+* precomputed tables: per-volume dose arrays for nutrient files, and the
+  search index (postings, document lengths, facets) for problem files.
+
+Snapshots are memory-mapped and decoded on demand, so a record is only
+turned into a dict when it is looked at.  Each snapshot records
+the size and mtime of the JSON file it was built from; :func:`open_snapshot`
+returns ``None`` when they no longer match and callers read the JSON.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+MAGIC = b"GPSNAP\0\0"
+VERSION = 1
+SUFFIX = ".snap"
+
+KIND_NUTRIENTS = 1
+KIND_PROBLEMS = 2
+
+# magic, version, kind, big-endian flag, source size, source mtime (ns), section count
+_HEADER = struct.Struct("<8sIIIQqI")
+# name, array typecode, offset, length in bytes
+_SECTION = struct.Struct("<8sc7xQQ")
+_ALIGN = 8
+_BIG_ENDIAN = int(sys.byteorder == "big")
+# string id standing for None in key tables
+_NONE = 0xFFFFFFFF
+
+# sections every snapshot of a kind has
+_COMMON_SECTIONS = ("str.off", "str.data", "records", "values")
+_KIND_SECTIONS = {
+    KIND_NUTRIENTS: _COMMON_SECTIONS + ("nut.key", "supp.prd", "dose.key", "dose.nam", "dose.amt",
+                                        "dose.lbl", "supp.key", "supp.amt"),
+    KIND_PROBLEMS: _COMMON_SECTIONS + ("term.id", "term.off", "term.idf", "post.doc", "post.tf",
+                                       "doclen", "fct.key", "fct.doc"),
+}
+
+# value stream tags
+_NULL, _TRUE, _FALSE, _INT, _FLOAT, _STR, _LIST, _DICT = range(8)
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+
+class SnapshotError(ValueError):
+    """Raised for files that aren't snapshots this version can read."""
+
+
+def snapshot_path(json_path: str) -> str:
+    """Return where the snapshot of ``json_path`` lives."""
+    return os.path.splitext(json_path)[0] + SUFFIX
+
+
+# ── writing ──────────────────────────────────────────────────────────────────
+
+class _Writer:
+    def __init__(self) -> None:
+        self.strings: Dict[str, int] = {}
+        self.sections: Dict[str, Tuple[str, bytes]] = {}
+        self.records = array("Q")
+        self.values = bytearray()
+
+    def intern(self, text: str) -> int:
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def intern_key(self, text: Optional[str]) -> int:
+        return _NONE if text is None else self.intern(text)
+
+    def record(self, value: Any) -> None:
+        self.records.append(len(self.values))
+        self.encode(value, self.values)
+
+    def add(self, name: str, data: Union[array, bytes, bytearray]) -> None:
+        assert len(name) <= 8, name
+        if isinstance(data, array):
+            self.sections[name] = (data.typecode, data.tobytes())
+        else:
+            self.sections[name] = ("B", bytes(data))
+
+    def encode(self, value: Any, out: bytearray) -> None:
+        if value is None:
+            out.append(_NULL)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            out.append(_INT)
+            out += _I64.pack(value)
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _F64.pack(value)
+        elif isinstance(value, str):
+            out.append(_STR)
+            out += _U32.pack(self.intern(value))
+        elif isinstance(value, list):
+            out.append(_LIST)
+            out += _U32.pack(len(value))
+            for item in value:
+                self.encode(item, out)
+        elif isinstance(value, dict):
+            out.append(_DICT)
+            out += _U32.pack(len(value))
+            for key, item in value.items():
+                out += _U32.pack(self.intern(key))
+                self.encode(item, out)
+        else:
+            raise TypeError(f"can't store {type(value).__name__} in a snapshot")
+
+    def write(self, path: str, kind: int, source: os.stat_result) -> None:
+        offsets = array("I", [0])
+        blob = bytearray()
+        for text in self.strings:  # insertion order == index order
+            blob += text.encode("utf-8")
+            offsets.append(len(blob))
+        self.add("str.off", offsets)
+        self.add("str.data", blob)
+        self.add("records", self.records)
+        self.add("values", self.values)
+
+        names = sorted(self.sections)
+        pos = _HEADER.size + _SECTION.size * len(names)
+        layout = []
+        for name in names:
+            pos += -pos % _ALIGN
+            layout.append((name, pos))
+            pos += len(self.sections[name][1])
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(_HEADER.pack(MAGIC, VERSION, kind, _BIG_ENDIAN,
+                                  source.st_size, source.st_mtime_ns, len(names)))
+            for name, offset in layout:
+                code, data = self.sections[name]
+                fh.write(_SECTION.pack(name.encode("ascii"), code.encode("ascii"), offset, len(data)))
+            for name, offset in layout:
+                fh.write(b"\0" * (offset - fh.tell()))
+                fh.write(self.sections[name][1])
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+
+
+def _add_dose_tables(writer: _Writer, data: Dict[str, Any]) -> None:
+    from .nutrient_logic import NutrientCatalog
+
+    nutrients = data.get("nutrients", [])
+    supplements = data.get("cal_mag_supplements", [])
+    series_keys, products = array("I"), array("I")
+    for entry in nutrients:
+        series_keys.extend([writer.intern_key(entry.get("manufacturer")), writer.intern_key(entry.get("series"))])
+        writer.record(entry)
+    for supp in supplements:
+        products.append(writer.intern_key(supp.get("product")))
+        writer.record(supp)
+    # the rest of the document, with placeholders for the lists above
+    writer.record({key: (None if key in ("nutrients", "cal_mag_supplements") else value)
+                   for key, value in data.items()})
+    writer.add("nut.key", series_keys)
+    writer.add("supp.prd", products)
+
+    components, supplement_doses = NutrientCatalog(data).dose_tables()
+    keys, names, amounts, labels = array("I"), array("I"), array("d"), array("I")
+    for key, comps in components.items():
+        keys.extend([writer.intern_key(part) for part in key])
+        keys.extend([len(names), len(comps)])
+        for name, per_volume, label in comps:
+            names.append(writer.intern(name))
+            amounts.append(per_volume)
+            labels.append(writer.intern(label))
+    supp_keys, supp_amounts = array("I"), array("d")
+    for (product, unit), (name, per_volume, label) in supplement_doses.items():
+        supp_keys.extend([writer.intern_key(product), writer.intern(unit), writer.intern(label)])
+        supp_amounts.append(per_volume)
+    writer.add("dose.key", keys)
+    writer.add("dose.nam", names)
+    writer.add("dose.amt", amounts)
+    writer.add("dose.lbl", labels)
+    writer.add("supp.key", supp_keys)
+    writer.add("supp.amt", supp_amounts)
+
+
+def _add_problem_tables(writer: _Writer, problems: List[Dict[str, Any]]) -> None:
+    from .problem_logic import ProblemIndex
+
+    for problem in problems:
+        writer.record(problem)
+
+    index_postings, index_idf, doc_len, index_facets = ProblemIndex(problems).index_tables()
+    term_ids, term_off, idf = array("I"), array("I", [0]), array("d")
+    docs, tfs = array("I"), array("d")
+    for term, postings in index_postings.items():
+        term_ids.append(writer.intern(term))
+        idf.append(index_idf[term])
+        docs.extend(postings.keys())
+        tfs.extend(postings.values())
+        term_off.append(len(docs))
+    facet_keys, facet_docs = array("I"), array("I")
+    for name, values_map in index_facets.items():
+        for value, doc_set in values_map.items():
+            facet_keys.extend([writer.intern(name), writer.intern(value), len(facet_docs), len(doc_set)])
+            facet_docs.extend(sorted(doc_set))
+    writer.add("term.id", term_ids)
+    writer.add("term.off", term_off)
+    writer.add("term.idf", idf)
+    writer.add("post.doc", docs)
+    writer.add("post.tf", tfs)
+    writer.add("doclen", array("d", doc_len))
+    writer.add("fct.key", facet_keys)
+    writer.add("fct.doc", facet_docs)
+
+
+def build_snapshot(json_path: str, out_path: Optional[str] = None) -> str:
+    """Compile ``json_path`` into a snapshot and return the snapshot's path.
+
+    Nutrient files (with a ``nutrients`` list) and problem files (with a
+    ``problems`` list) are recognised by their contents.
+    """
+    source = os.stat(json_path)
+    with open(json_path, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    writer = _Writer()
+    if isinstance(data, dict) and "problems" in data:
+        kind = KIND_PROBLEMS
+        _add_problem_tables(writer, data.get("problems", []))
+    elif isinstance(data, dict) and "nutrients" in data:
+        kind = KIND_NUTRIENTS
+        _add_dose_tables(writer, data)
+    else:
+        raise SnapshotError(f"{json_path} is neither a nutrient nor a problem file")
+    out_path = out_path or snapshot_path(json_path)
+    writer.write(out_path, kind, source)
+    return out_path
+
+
+# ── reading ──────────────────────────────────────────────────────────────────
+
+class Snapshot:
+    """A memory-mapped snapshot file."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        if len(buf) < _HEADER.size:
+            raise SnapshotError(f"{path} is truncated")
+        magic, version, kind, big_endian, size, mtime, count = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION or big_endian != _BIG_ENDIAN:
+            raise SnapshotError(f"{path} is not a version {VERSION} snapshot for this machine")
+        self.path = path
+        self.kind = kind
+        self.source_size = size
+        self.source_mtime_ns = mtime
+        self._buf = buf
+        self._sections: Dict[str, Tuple[str, int, int]] = {}
+        if _HEADER.size + count * _SECTION.size > len(buf):
+            raise SnapshotError(f"{path} is truncated")
+        for i in range(count):
+            name, code, offset, length = _SECTION.unpack_from(buf, _HEADER.size + i * _SECTION.size)
+            if offset + length > len(buf):
+                raise SnapshotError(f"{path} is truncated")
+            try:
+                self._sections[name.rstrip(b"\0").decode("ascii")] = (code.decode("ascii"), offset, length)
+            except UnicodeDecodeError:
+                raise SnapshotError(f"{path} has a corrupt section table") from None
+        # check the layout up front, so a damaged file is rejected here
+        # rather than failing on some later lookup
+        missing = [name for name in _KIND_SECTIONS.get(kind, ()) if name not in self._sections]
+        if kind not in _KIND_SECTIONS or missing:
+            raise SnapshotError(f"{path} is missing sections {missing or 'of its kind'}")
+        for name in self._sections:
+            try:
+                self.array(name)
+            except (TypeError, ValueError):
+                raise SnapshotError(f"{path} has a malformed {name!r} section") from None
+        self._str_off = self.array("str.off")
+        self._str_data = self.array("str.data")
+        if not self._str_off:
+            raise SnapshotError(f"{path} has an empty string table")
+        self._strings: List[Optional[str]] = [None] * (len(self._str_off) - 1)
+        self._values = self.array("values")
+        self._records = self.array("records")
+
+    def array(self, name: str) -> memoryview:
+        """Return section ``name`` as a typed, zero-copy view."""
+        code, offset, length = self._sections[name]
+        view = self._buf[offset:offset + length]
+        return view if code == "B" else view.cast(code)
+
+    def string(self, index: int) -> Optional[str]:
+        if index == _NONE:
+            return None
+        text = self._strings[index]
+        if text is None:
+            text = self._strings[index] = str(self._str_data[self._str_off[index]:self._str_off[index + 1]], "utf-8")
+        return text
+
+    def _decode(self, pos: int) -> Tuple[Any, int]:
+        buf = self._values
+        tag = buf[pos]
+        pos += 1
+        if tag == _STR:
+            return self.string(_U32.unpack_from(buf, pos)[0]), pos + 4
+        if tag == _DICT:
+            count = _U32.unpack_from(buf, pos)[0]
+            pos += 4
+            out = {}
+            for _ in range(count):
+                key = self.string(_U32.unpack_from(buf, pos)[0])
+                out[key], pos = self._decode(pos + 4)
+            return out, pos
+        if tag == _LIST:
+            count = _U32.unpack_from(buf, pos)[0]
+            pos += 4
+            items = []
+            for _ in range(count):
+                item, pos = self._decode(pos)
+                items.append(item)
+            return items, pos
+        if tag == _FLOAT:
+            return _F64.unpack_from(buf, pos)[0], pos + 8
+        if tag == _INT:
+            return _I64.unpack_from(buf, pos)[0], pos + 8
+        if tag == _NULL:
+            return None, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _FALSE:
+            return False, pos
+        raise SnapshotError(f"bad value tag {tag} in {self.path}")
+
+    def value(self, pos: int = 0) -> Any:
+        """Decode the value stored at ``pos`` of the value stream."""
+        return self._decode(pos)[0]
+
+    def record(self, index: int) -> Any:
+        return self._decode(self._records[index])[0]
+
+    # nutrient snapshots
+
+    def nutrient_data(self) -> Dict[str, Any]:
+        """Decode the whole nutrient document."""
+        entries, supplements = len(self.array("nut.key")) // 2, len(self.array("supp.prd"))
+        data = self.record(entries + supplements)
+        if "nutrients" in data:
+            data["nutrients"] = [self.record(i) for i in range(entries)]
+        if "cal_mag_supplements" in data:
+            data["cal_mag_supplements"] = [self.record(entries + i) for i in range(supplements)]
+        return data
+
+    def nutrient_index(self) -> Tuple["RecordMap", Dict[str, List[str]], "RecordMap"]:
+        """Return ``(series, series by manufacturer, supplements)`` as used by ``NutrientCatalog``.
+
+        Like the catalog built from JSON, the first entry for a key wins.
+        """
+        keys = self.array("nut.key")
+        entries = len(keys) // 2
+        series: Dict[Tuple[Optional[str], Optional[str]], int] = {}
+        by_manufacturer: Dict[Optional[str], List[Optional[str]]] = {}
+        for i in range(entries):
+            key = (self.string(keys[2 * i]), self.string(keys[2 * i + 1]))
+            if key not in series:
+                series[key] = i
+                by_manufacturer.setdefault(key[0], []).append(key[1])
+        supplements: Dict[Optional[str], int] = {}
+        for i, product in enumerate(self.array("supp.prd")):
+            supplements.setdefault(self.string(product), entries + i)
+        return RecordMap(self, series), by_manufacturer, RecordMap(self, supplements)
+
+    def dose_tables(self) -> Tuple["ComponentTable", Dict[Tuple[str, str], Tuple[str, float, str]]]:
+        """Return ``(components, supplement doses)`` as used by ``NutrientCatalog``."""
+        supp_keys, supp_amounts = self.array("supp.key"), self.array("supp.amt")
+        supplements = {}
+        for i in range(len(supp_amounts)):
+            product, unit, label = (self.string(j) for j in supp_keys[3 * i:3 * i + 3])
+            supplements[(product, unit)] = (product, supp_amounts[i], label)
+        return ComponentTable(self), supplements
+
+    # problem snapshots
+
+    def records(self) -> "ProblemRecords":
+        """All records, which for a problem snapshot are the problems."""
+        return ProblemRecords(self)
+
+    def index_tables(self) -> Tuple["Postings", "TermWeights", memoryview, Dict[str, "FacetDocs"]]:
+        """Return ``(postings, idf, doc_len, facets)`` as used by ``ProblemIndex``."""
+        keys, docs = self.array("fct.key"), self.array("fct.doc")
+        facets: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        for i in range(0, len(keys), 4):
+            name, value, start, count = keys[i:i + 4]
+            facets.setdefault(self.string(name), {})[self.string(value)] = (start, count)
+        postings = Postings(self)
+        return (postings, TermWeights(postings), self.array("doclen"),
+                {name: FacetDocs(docs, spans) for name, spans in facets.items()})
+
+
+class ComponentTable(Mapping):
+    """``(manufacturer, series, stage, unit) -> [(name, per_volume, unit)]``."""
+
+    def __init__(self, snap: Snapshot) -> None:
+        self._snap = snap
+        self._names = snap.array("dose.nam")
+        self._amounts = snap.array("dose.amt")
+        self._labels = snap.array("dose.lbl")
+        keys = snap.array("dose.key")
+        self._spans: Dict[Tuple[str, ...], Tuple[int, int]] = {}
+        for i in range(0, len(keys), 6):
+            row = keys[i:i + 6]
+            self._spans[tuple(snap.string(j) for j in row[:4])] = (row[4], row[5])
+        self._cache: Dict[Tuple[str, ...], List[Tuple[str, float, str]]] = {}
+
+    def __getitem__(self, key):
+        comps = self._cache.get(key)
+        if comps is None:
+            start, count = self._spans[key]
+            string = self._snap.string
+            comps = self._cache[key] = [
+                (string(self._names[i]), self._amounts[i], string(self._labels[i]))
+                for i in range(start, start + count)
+            ]
+        return comps
+
+    def __iter__(self) -> Iterator[Tuple[str, ...]]:
+        return iter(self._spans)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+
+class RecordMap(Mapping):
+    """``key -> record`` with each record decoded on first access."""
+
+    def __init__(self, snap: Snapshot, index: Dict[Any, int]) -> None:
+        self._snap = snap
+        self._index = index
+        self._cache: Dict[Any, Any] = {}
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+        item = self._cache[key] = self._snap.record(self._index[key])
+        return item
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class ProblemRecords(Sequence):
+    """Problem entries decoded from the snapshot the first time they are read."""
+
+    def __init__(self, snap: Snapshot) -> None:
+        self._snap = snap
+        self._items: List[Optional[Dict[str, Any]]] = [None] * len(snap.array("records"))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        item = self._items[index]
+        if item is None:
+            item = self._items[index] = self._snap.record(index)
+        return item
+
+
+class Postings(Mapping):
+    """``term -> {doc: weighted term frequency}`` backed by the snapshot arrays."""
+
+    def __init__(self, snap: Snapshot) -> None:
+        self._terms = {snap.string(i): n for n, i in enumerate(snap.array("term.id"))}
+        self._off = snap.array("term.off")
+        self._idf = snap.array("term.idf")
+        self._docs = snap.array("post.doc")
+        self._tfs = snap.array("post.tf")
+
+    def __getitem__(self, term: str) -> Dict[int, float]:
+        n = self._terms[term]
+        start, end = self._off[n], self._off[n + 1]
+        return dict(zip(self._docs[start:end].tolist(), self._tfs[start:end].tolist()))
+
+    def idf(self, term: str) -> float:
+        return self._idf[self._terms[term]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._terms)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+
+class TermWeights(Mapping):
+    """``term -> idf`` view of :class:`Postings`."""
+
+    def __init__(self, postings: Postings) -> None:
+        self._postings = postings
+
+    def __getitem__(self, term: str) -> float:
+        return self._postings.idf(term)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._postings)
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+
+class FacetDocs(Mapping):
+    """``facet value -> set of docs`` for one facet."""
+
+    def __init__(self, docs: memoryview, spans: Dict[str, Tuple[int, int]]) -> None:
+        self._docs = docs
+        self._spans = spans
+        self._cache: Dict[str, Set[int]] = {}
+
+    def __getitem__(self, value: str) -> Set[int]:
+        found = self._cache.get(value)
+        if found is None:
+            start, count = self._spans[value]
+            found = self._cache[value] = set(self._docs[start:start + count].tolist())
+        return found
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._spans)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+
+def open_snapshot(json_path: str, kind: Optional[int] = None) -> Optional[Snapshot]:
+    """Return the snapshot of ``json_path`` if it exists and is current.
+
+    ``None`` means there is no usable snapshot (missing, stale, of another
+    ``kind`` or unreadable) and the JSON file should be read instead.
+    """
+    path = snapshot_path(json_path)
+    try:
+        source = os.stat(json_path)
+        snap = Snapshot(path)
+    except (OSError, ValueError):
+        return None
+    if (kind is not None and snap.kind != kind) or snap.source_size != source.st_size \
+            or snap.source_mtime_ns != source.st_mtime_ns:
+        return None
+    return snap
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compile reference JSON files into snapshots.")
+    parser.add_argument("paths", nargs="+", metavar="JSON")
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        out = build_snapshot(path)
+        print(f"{path} -> {out} ({os.path.getsize(out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,535 @@
+"""Replicate nutrient logs and schedule logs between nodes.
+
+Every node ("origin") keeps its own database and schedule log and is
+named by an id generated once per database (see :func:`default_origin`).
+A node *pushes* what changed since its last push to a peer, usually a
+central node that merges the history of all rooms:
+
+* Nutrient logs are tracked by the ``nutrient_log_changes`` table, which
+  triggers keep up to date.  Each log has one row there holding the
+  sequence number of its latest change, so a push sends every log that
+  was added, edited or deleted after the watermark exactly once.
+* Schedule logs are append-only, so their watermark is a position
+  ``(segment, offset)`` in the segment files.
+
+Changes travel in zlib-compressed JSON batches of up to ``batch_size``
+rows through a transport.  :class:`DirectoryTransport` drops batch files
+into a directory, such as a network share or a USB stick, which
+:func:`import_directory` applies later.  :class:`SocketTransport` sends
+them to a :class:`SyncServer`, which applies each batch before
+acknowledging it.  The sender moves its watermark only after a batch is
+delivered.  Applying a batch is idempotent, so a batch that is delivered
+twice does no harm.
+
+Received rows are stored in ``replicated_logs`` and
+``replicated_schedule``, keyed by origin and the row's id or position
+on the origin.
+"""
+import argparse
+import datetime as _dt
+import json
+import logging
+import os
+import re
+import secrets
+import socket
+import socketserver
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .docstore import atomic_write
+from .instrument import timed
+from .schedule_log import _segment_index, list_segments, migrate_legacy_log
+
+FORMAT = 1
+BATCH_SIZE = 5000
+BATCH_SUFFIX = ".batch"
+# subdirectory of an import directory that unreadable batch files are moved to
+REJECTED_DIR = "rejected"
+# stream names used in sync_state
+LOGS = "logs"
+SCHEDULE = "schedule"
+
+_FRAME = struct.Struct(">I")
+_ORIGIN_RE = re.compile(r"[^A-Za-z0-9_.-]")
+# keys every batch of a stream has
+_BATCH_KEYS = {LOGS: ("origin", "from", "to", "upserts", "deletes"),
+               SCHEDULE: ("origin", "from", "to", "entries")}
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(Exception):
+    """Raised when a batch can't be decoded or delivered."""
+
+
+class OutOfOrderBatch(SyncError):
+    """Raised for a batch that doesn't continue the origin's applied watermark.
+
+    The batches before it haven't arrived yet; it can be applied after them.
+    """
+
+
+# sync_state key of this node's id
+_NODE_PEER, _NODE_STREAM = "", "node_id"
+
+
+def default_origin(db_path: Optional[str] = None) -> str:
+    """Return this node's id, generating it on first use.
+
+    The id is the host name plus a random suffix, stored in the database,
+    so nodes that share a host name (every stock Pi is "raspberrypi") still
+    replicate as different origins.
+    """
+    from .db import session_scope
+
+    with session_scope(db_path) as session:
+        node = _get_position(session, _NODE_PEER, _NODE_STREAM)
+        if node is None:
+            node = f"{socket.gethostname()}-{secrets.token_hex(4)}"
+            _set_position(session, _NODE_PEER, _NODE_STREAM, node)
+    return node
+
+
+# ── batches ──────────────────────────────────────────────────────────────────
+
+def encode_batch(batch: Dict[str, Any]) -> bytes:
+    data = json.dumps(dict(batch, format=FORMAT), separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(data.encode("utf-8"), 6)
+
+
+def decode_batch(data: bytes) -> Dict[str, Any]:
+    try:
+        batch = json.loads(zlib.decompress(data))
+    except (zlib.error, ValueError) as exc:
+        raise SyncError(f"corrupt batch: {exc}") from None
+    if not isinstance(batch, dict):
+        raise SyncError("corrupt batch: not an object")
+    if batch.get("format") != FORMAT:
+        raise SyncError(f"unsupported batch format {batch.get('format')!r}")
+    stream = batch.get("stream")
+    if stream not in _BATCH_KEYS:
+        raise SyncError(f"unknown stream {stream!r}")
+    missing = [key for key in _BATCH_KEYS[stream] if key not in batch]
+    if missing:
+        raise SyncError(f"corrupt batch: missing {', '.join(missing)}")
+    return batch
+
+
+def batch_name(batch: Dict[str, Any]) -> str:
+    """File name for a batch; sorts in delivery order within each stream."""
+    origin = _ORIGIN_RE.sub("_", batch["origin"])
+    if batch["stream"] == LOGS:
+        pos = f"{batch['to']:012d}"
+    else:
+        segment, offset = batch["to"]
+        pos = f"{segment:06d}-{offset:012d}"
+    return f"{origin}-{batch['stream']}-{pos}{BATCH_SUFFIX}"
+
+
+# ── watermarks ───────────────────────────────────────────────────────────────
+
+def _get_position(session, peer: str, stream: str) -> Any:
+    from .db.models import SyncState
+
+    state = session.get(SyncState, (peer, stream))
+    return json.loads(state.position) if state else None
+
+
+def _set_position(session, peer: str, stream: str, position: Any) -> None:
+    from .db.models import SyncState
+
+    session.merge(SyncState(peer=peer, stream=stream, position=json.dumps(position)))
+
+
+def get_watermarks(db_path: Optional[str], peer: str) -> Dict[str, Any]:
+    """Return the positions pushed to ``peer`` (or applied from origin ``peer``)."""
+    from .db import session_scope
+
+    with session_scope(db_path) as session:
+        return {stream: _get_position(session, peer, stream)
+                for stream in (LOGS, SCHEDULE, "applied:" + LOGS, "applied:" + SCHEDULE)}
+
+
+# ── reading changes ──────────────────────────────────────────────────────────
+
+def log_batches(db_path: Optional[str], origin: str, after: int,
+                batch_size: int = BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yield batches of nutrient log changes with a sequence number above ``after``."""
+    from sqlalchemy import select
+
+    from .db import session_scope
+    from .db.models import NutrientLog, NutrientLogChange, Tray
+
+    stmt = (
+        select(NutrientLogChange.seq, NutrientLogChange.log_id, NutrientLogChange.deleted,
+               NutrientLog.tray_id, Tray.label, NutrientLog.date, NutrientLog.ph,
+               NutrientLog.ppm, NutrientLog.notes)
+        .outerjoin(NutrientLog, NutrientLog.id == NutrientLogChange.log_id)
+        .outerjoin(Tray, Tray.id == NutrientLog.tray_id)
+        .order_by(NutrientLogChange.seq)
+        .limit(batch_size)
+    )
+    while True:
+        with session_scope(db_path) as session:
+            rows = session.execute(stmt.where(NutrientLogChange.seq > after)).all()
+        if not rows:
+            return
+        upserts, deletes = [], []
+        for seq, log_id, deleted, tray_id, label, date, ph, ppm, notes in rows:
+            if deleted or tray_id is None:
+                deletes.append(log_id)
+            else:
+                upserts.append([log_id, tray_id, label, date.isoformat(), ph, ppm, notes])
+        start, after = after, rows[-1][0]
+        yield {"origin": origin, "stream": LOGS, "from": start, "to": after,
+               "upserts": upserts, "deletes": deletes}
+
+
+def schedule_batches(base_dir: str, origin: str, after: Optional[List[int]],
+                     batch_size: int = BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yield batches of schedule entries written after position ``after``.
+
+    Positions are ``[segment, offset]``; entries carry the position where
+    their line starts.  A torn last line is left for the next push.
+    """
+    migrate_legacy_log(base_dir)
+    segment, offset = after or (0, 0)
+    entries: List[list] = []
+    start = [segment, offset]
+    for path in list_segments(base_dir):
+        index = _segment_index(os.path.basename(path))
+        if index < segment:
+            continue
+        pos = offset if index == segment else 0
+        with open(path, "rb") as fh:
+            fh.seek(pos)
+            for raw in fh:
+                if not raw.endswith(b"\n"):
+                    break
+                entries.append([index, pos, raw.decode("utf-8").rstrip("\n")])
+                pos += len(raw)
+                if len(entries) >= batch_size:
+                    yield {"origin": origin, "stream": SCHEDULE, "from": start,
+                           "to": [index, pos], "entries": entries}
+                    entries, start = [], [index, pos]
+        segment, offset = index, pos
+    if entries:
+        yield {"origin": origin, "stream": SCHEDULE, "from": start,
+               "to": [segment, offset], "entries": entries}
+
+
+# ── applying batches ─────────────────────────────────────────────────────────
+
+def _position_key(stream: str, position: Any) -> Any:
+    return tuple(position) if stream == SCHEDULE else position
+
+
+@timed()
+def _batch_rows(batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+    origin = batch["origin"]
+    try:
+        if batch["stream"] == LOGS:
+            return [
+                {"origin": origin, "origin_id": log_id, "tray_id": tray_id, "tray_label": label,
+                 "date": _dt.datetime.fromisoformat(date), "ph": ph, "ppm": ppm, "notes": notes}
+                for log_id, tray_id, label, date, ph, ppm, notes in batch["upserts"]
+            ]
+        return [{"origin": origin, "segment": seg, "offset": off, "entry": entry}
+                for seg, off, entry in batch["entries"]]
+    except (TypeError, ValueError) as exc:
+        raise SyncError(f"corrupt batch: {exc}") from None
+
+
+def apply_batch(db_path: Optional[str], data: bytes) -> int:
+    """Store one received batch; returns the number of rows applied.
+
+    Batches at or below the origin's applied watermark are skipped, so
+    replays and duplicates can't undo newer changes.  A batch that starts
+    after the watermark raises :class:`OutOfOrderBatch` instead, because
+    the changes in between are still missing.
+    """
+    from sqlalchemy import delete, tuple_
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+    from .db import session_scope
+    from .db.models import ReplicatedLog, ReplicatedScheduleEntry
+
+    batch = decode_batch(data)
+    origin, stream = batch["origin"], batch["stream"]
+    rows = _batch_rows(batch)
+    with session_scope(db_path) as session:
+        applied = _get_position(session, origin, "applied:" + stream)
+        if applied is None:
+            applied = [0, 0] if stream == SCHEDULE else 0
+        if _position_key(stream, batch["to"]) <= _position_key(stream, applied):
+            return 0
+        if _position_key(stream, batch["from"]) > _position_key(stream, applied):
+            raise OutOfOrderBatch(f"{batch_name(batch)} starts at {batch['from']}, "
+                                  f"but {origin} is only applied up to {applied}")
+        if stream == LOGS:
+            if rows:
+                stmt = sqlite_insert(ReplicatedLog)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[ReplicatedLog.origin, ReplicatedLog.origin_id],
+                    set_={col: stmt.excluded[col]
+                          for col in ("tray_id", "tray_label", "date", "ph", "ppm", "notes")},
+                )
+                session.execute(stmt, rows)
+            if batch["deletes"]:
+                session.execute(delete(ReplicatedLog).where(
+                    ReplicatedLog.origin == origin, ReplicatedLog.origin_id.in_(batch["deletes"])))
+            count = len(rows) + len(batch["deletes"])
+        else:
+            if rows:
+                session.execute(sqlite_insert(ReplicatedScheduleEntry).on_conflict_do_nothing(), rows)
+            count = len(rows)
+        _set_position(session, origin, "applied:" + stream, batch["to"])
+    return count
+
+
+# ── transports ───────────────────────────────────────────────────────────────
+
+class Transport:
+    """Delivers encoded batches to a peer.
+
+    :meth:`send` must not return before the batch is durably delivered;
+    the sender advances its watermark as soon as it does.
+    """
+
+    def send(self, name: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class DirectoryTransport(Transport):
+    """Write each batch as a file into ``path``."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def send(self, name: str, data: bytes) -> None:
+        atomic_write(os.path.join(self.path, name), data)
+
+
+class SocketTransport(Transport):
+    """Send batches to a :class:`SyncServer` over one TCP connection."""
+
+    def __init__(self, host: str, port: int, timeout: float = 60.0) -> None:
+        self.address = (host, port)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+
+    def send(self, name: str, data: bytes) -> None:
+        if self._sock is None:
+            self._sock = socket.create_connection(self.address, timeout=self.timeout)
+        try:
+            self._sock.sendall(_FRAME.pack(len(data)) + data)
+            reply = _recv_exact(self._sock, 1)
+        except OSError:
+            self.close()
+            raise
+        if reply != b"\x01":
+            raise SyncError(f"peer rejected batch {name}")
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+# ── pushing and receiving ────────────────────────────────────────────────────
+
+@timed()
+def push(transport: Transport, peer: str, db_path: Optional[str] = None,
+         schedule_dir: Optional[str] = None, origin: Optional[str] = None,
+         batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Send everything that changed since the last push to ``peer``.
+
+    Returns the number of log changes and schedule entries sent.
+    """
+    from .db import session_scope
+
+    origin = origin or default_origin(db_path)
+    sent = {LOGS: 0, SCHEDULE: 0}
+    with session_scope(db_path) as session:
+        after = _get_position(session, peer, LOGS) or 0
+    for batch in log_batches(db_path, origin, after, batch_size):
+        _deliver(transport, peer, db_path, batch)
+        sent[LOGS] += len(batch["upserts"]) + len(batch["deletes"])
+    if schedule_dir and os.path.isdir(schedule_dir):
+        with session_scope(db_path) as session:
+            after = _get_position(session, peer, SCHEDULE)
+        for batch in schedule_batches(schedule_dir, origin, after, batch_size):
+            _deliver(transport, peer, db_path, batch)
+            sent[SCHEDULE] += len(batch["entries"])
+    return sent
+
+
+def _deliver(transport: Transport, peer: str, db_path: Optional[str], batch: Dict[str, Any]) -> None:
+    from .db import session_scope
+
+    transport.send(batch_name(batch), encode_batch(batch))
+    with session_scope(db_path) as session:
+        _set_position(session, peer, batch["stream"], batch["to"])
+
+
+def import_directory(path: str, db_path: Optional[str] = None,
+                     stats: Optional[Dict[str, int]] = None) -> int:
+    """Apply and remove every batch file in ``path``; returns rows applied.
+
+    Files that arrived before the batches preceding them are left in
+    place for a later import.  Files that can't be decoded are moved to
+    the :data:`REJECTED_DIR` subdirectory so they don't hold up the rest;
+    ``stats["rejected"]``, if given, counts them.
+    """
+    if not os.path.isdir(path):
+        return 0
+    total = 0
+    # names sort in delivery order within each origin and stream
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(BATCH_SUFFIX):
+            continue
+        full = os.path.join(path, name)
+        with open(full, "rb") as fh:
+            data = fh.read()
+        try:
+            total += apply_batch(db_path, data)
+        except OutOfOrderBatch:
+            continue
+        except SyncError as exc:
+            logger.error("rejecting batch file %s: %s", full, exc)
+            os.makedirs(os.path.join(path, REJECTED_DIR), exist_ok=True)
+            os.replace(full, os.path.join(path, REJECTED_DIR, name))
+            if stats is not None:
+                stats["rejected"] = stats.get("rejected", 0) + 1
+            continue
+        os.remove(full)
+    return total
+
+
+class _BatchHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        server: "SyncServer" = self.server  # type: ignore[assignment]
+        while True:
+            try:
+                (size,) = _FRAME.unpack(_recv_exact(self.request, _FRAME.size))
+                data = _recv_exact(self.request, size)
+            except ConnectionError:
+                return
+            try:
+                # one writer at a time; SQLite serializes them anyway
+                with server.apply_lock:
+                    server.applied += apply_batch(server.db_path, data)
+                reply = b"\x01"
+            except Exception:
+                server.errors += 1
+                reply = b"\x00"
+            self.request.sendall(reply)
+
+
+class SyncServer(socketserver.ThreadingTCPServer):
+    """Receive batches from :class:`SocketTransport` and store them.
+
+    Use ``port=0`` to pick a free port; :attr:`port` has the bound one.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, db_path: Optional[str] = None, host: str = "0.0.0.0", port: int = 0) -> None:
+        super().__init__((host, port), _BatchHandler)
+        self.db_path = db_path
+        self.apply_lock = threading.Lock()
+        self.applied = 0
+        self.errors = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start_in_thread(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self.serve_forever, name="SyncServer", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+# ── CLI ──────────────────────────────────────────────────────────────────────
+
+def _address(value: str) -> Tuple[str, int]:
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError("expected HOST:PORT")
+    return host, int(port)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replicate Garden Pip logs between nodes.")
+    parser.add_argument("--db", help="database path (default: the application database)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_push = sub.add_parser("push", help="send local changes to a peer")
+    target = p_push.add_mutually_exclusive_group(required=True)
+    target.add_argument("--to-dir", help="write batch files into this directory")
+    target.add_argument("--to", type=_address, metavar="HOST:PORT", help="send to a sync server")
+    p_push.add_argument("--peer", help="name used for the watermark (default: the target)")
+    p_push.add_argument("--origin", help="name of this node (default: an id generated once per database)")
+    p_push.add_argument("--schedule-dir", help="schedule log directory to replicate as well")
+    p_push.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p_import = sub.add_parser("import", help="apply batch files from a directory")
+    p_import.add_argument("path")
+    p_serve = sub.add_parser("serve", help="receive batches over TCP")
+    p_serve.add_argument("--host", default="0.0.0.0")
+    p_serve.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    if args.command == "push":
+        if args.to_dir:
+            transport: Transport = DirectoryTransport(args.to_dir)
+            peer = args.peer or os.path.abspath(args.to_dir)
+        else:
+            transport = SocketTransport(*args.to)
+            peer = args.peer or "%s:%d" % args.to
+        try:
+            sent = push(transport, peer, args.db, args.schedule_dir, args.origin, args.batch_size)
+        finally:
+            transport.close()
+        print(f"sent {sent[LOGS]} log changes, {sent[SCHEDULE]} schedule entries")
+    elif args.command == "import":
+        stats: Dict[str, int] = {}
+        applied = import_directory(args.path, args.db, stats)
+        rejected = stats.get("rejected", 0)
+        print(f"applied {applied} rows" + (f", moved {rejected} unreadable files to {REJECTED_DIR}/"
+                                           if rejected else ""))
+    else:
+        server = SyncServer(args.db, args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,63 @@
 # main.py
 #!/usr/bin/env python3
 
+import copy
 import json
 import os
+import sys
+import time
 import datetime as dt
 
 import json, os
 from datetime import date
 
 from kivy.app import App
+from kivy.clock import Clock
+from kivy.logger import Logger
 from kivy.core.window import Window
 from kivy.uix.screenmanager import ScreenManager, Screen
+from kivy.properties import NumericProperty, ObjectProperty, StringProperty
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.textinput import TextInput
-from kivy.uix.button import Button
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from gardenpip import instrument
+from gardenpip.instrument import span, timed
+from gardenpip.io_worker import get_io_executor
+from gardenpip.nutrient_logic import get_catalog
 from gardenpip.schedule_log import log_schedule
-from gardenpip.shelf_logic import get_system_layout, save_system_layout
-
-from gardenpip.db import (
-    ShelfSystem,
-    Shelf,
-    Tray,
-    add_nutrient_log,
-    delete_nutrient_log,
-    get_session,
-    search_nutrient_logs,
-    update_nutrient_log,
-)
+from gardenpip.shelf_logic import TrayHasLogs, flatten_layout, get_system_layout, save_system_layout
+
+# seconds to wait after the last keystroke before searching the logs
+SEARCH_DELAY = 0.25
+LOG_PAGE_SIZE = 100
+
+def nutrient_catalog():
+    return get_catalog(os.path.join(os.path.dirname(__file__), 'nutrients.json'))
+
+
+def _db():
+    # SQLAlchemy is only imported once a screen needs the database.
+    import gardenpip.db
+    return gardenpip.db
+
 
 class MenuScreen(Screen):
     pass
 
 class NutrientSelectScreen(Screen):
     def on_kv_post(self, base_widget):
-        here = os.path.dirname(__file__)
-        with open(os.path.join(here, 'nutrients.json')) as f:
-            self.data = json.load(f)
+        catalog = nutrient_catalog()
         # Populate main nutrients
-        self.ids.manufacturer.values = [m['manufacturer'] for m in self.data['nutrients']]
+        self.ids.manufacturer.values = catalog.manufacturers()
         self.ids.series.values       = []
         # Populate Cal-Mag supplements (add a “None” option)
-        self.ids.calmag.values = ['None'] + [s['product'] for s in self.data['cal_mag_supplements']]
+        self.ids.calmag.values = ['None'] + catalog.supplements()
         self.ids.calmag.text   = 'None'
 
     def on_manufacturer(self, text):
-        entry = next((m for m in self.data['nutrients'] if m['manufacturer']==text), None)
-        if entry:
-            self.ids.series.values = [entry['series']]
-            self.ids.series.text   = entry['series']
+        series = nutrient_catalog().series(text)
+        if series:
+            self.ids.series.values = series
+            self.ids.series.text   = series[0]
 
     def do_next(self):
         app = App.get_running_app()
@@ -60,14 +70,8 @@ class NutrientSelectScreen(Screen):
 class NutrientStageScreen(Screen):
     def on_pre_enter(self):
         app = App.get_running_app()
-        here = os.path.dirname(__file__)
-        with open(os.path.join(here, 'nutrients.json')) as f:
-            data = json.load(f)
-        entry = next((m for m in data['nutrients']
-                      if m['manufacturer']==app.selected_manufacturer
-                      and m['series']==app.selected_series), None)
-        if entry:
-            stages = list(entry['stages'].keys())
+        stages = nutrient_catalog().stages(app.selected_manufacturer, app.selected_series)
+        if stages:
             self.ids.stage.values = stages
             self.ids.stage.text   = stages[0]
         # set up unit spinner & volume default
@@ -81,6 +85,7 @@ class NutrientStageScreen(Screen):
         self.ids.volume.text     = '1'
         self.ids.volume.hint_text = 'Volume (L)' if unit=='metric' else 'Volume (gal)'
 
+    @timed('ui.do_calc')
     def do_calc(self):
         app  = App.get_running_app()
         man  = app.selected_manufacturer
@@ -92,30 +97,21 @@ class NutrientStageScreen(Screen):
         except ValueError:
             vol = 1.0
 
-        here = os.path.dirname(__file__)
-        with open(os.path.join(here, 'nutrients.json')) as f:
-            data = json.load(f)
+        catalog = nutrient_catalog()
 
         # main nutrients
-        entry = next((m for m in data['nutrients']
-                      if m['manufacturer']==man and m['series']==ser), None)
         lines = []
-        if entry:
-            base_vol = entry['base_unit'][unit]['volume']
+        if catalog.entry(man, ser):
             lines.append(f"[b]{man} – {ser} – {stg}[/b]\n")
-            for comp in entry['stages'][stg]:
-                amt = comp['concentration'][unit] * (vol / base_vol)
-                lines.append(f"{comp['name']}: {amt:.1f} {comp['unit'][unit]}")
+            for name, amt, u in catalog.doses(man, ser, stg, unit, vol):
+                lines.append(f"{name}: {amt:.1f} {u}")
         # Cal-Mag
         supp = app.selected_calmag
         if supp and supp != 'None':
-            supp_entry = next(s for s in data['cal_mag_supplements']
-                              if s['product']==supp)
-            base_vol_s = supp_entry['base_unit'][unit]['volume']
-            conc_s     = supp_entry['concentration'][unit]
-            amt_s      = conc_s * (vol / base_vol_s)
-            lines.append("\n[b]Supplement[/b]\n")
-            lines.append(f"{supp}: {amt_s:.1f} {supp_entry['unit']}")
+            dose = catalog.supplement_dose(supp, unit, vol)
+            if dose:
+                lines.append("\n[b]Supplement[/b]\n")
+                lines.append(f"{supp}: {dose[1]:.1f} {dose[2]}")
 
         self.ids.result_lbl.text = '\n'.join(lines)
 
@@ -132,89 +128,312 @@ class NutrientStageScreen(Screen):
             'lines': lines,
         }
         data_dir = os.path.join(os.path.dirname(__file__), 'data')
-        log_schedule(log_entry, data_dir)
+        get_io_executor().submit(log_schedule, log_entry, data_dir)
+
+
+class ShelfLayoutRow(RecycleDataViewBehavior, BoxLayout):
+    """One recycled row of the layout editor: a shelf or one of its trays."""
+
+    kind = StringProperty('shelf')
+    shelf = NumericProperty(0)
+    tray = NumericProperty(-1)
+    text = StringProperty('')
+    screen = ObjectProperty(None, allownone=True)
+    index = -1
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_edit(self, text):
+        if self.screen is not None and self.index >= 0 and text != self.text:
+            self.text = text
+            self.screen.update_text(self.index, self.kind, self.shelf, self.tray, text)
 
 
 class ShelfLayoutScreen(Screen):
+    """Layout editor backed by a layout model rather than the widget tree.
+
+    ``self.layout`` is the list returned by ``get_system_layout``; the
+    RecycleView only shows a flattened copy of it, so widgets are reused
+    no matter how many shelves and trays there are.  Loading and saving
+    run on the I/O executor.
+    """
+
+    def on_kv_post(self, base_widget):
+        self.layout = [{'name': '', 'trays': [{'label': ''}]}]
+        self._saving = False
+        self._save_again = False
+        self._sync_view()
+
     def on_pre_enter(self):
         self.refresh()
 
     def refresh(self):
-        layout = get_system_layout()
-        box = self.ids.shelf_box
-        box.clear_widgets()
-        if not layout:
-            self.add_shelf()
+        get_io_executor().submit(get_system_layout, callback=self._on_loaded, key='shelf_layout.load')
+
+    @timed('ui.shelf_layout.loaded')
+    def _on_loaded(self, layout):
+        self.layout = layout or [{'name': '', 'trays': [{'label': ''}]}]
+        self._sync_view()
+
+    @timed('ui.shelf_layout.sync_view')
+    def _sync_view(self):
+        self.ids.shelf_rv.data = [dict(row, screen=self) for row in flatten_layout(self.layout)]
+
+    def update_text(self, index, kind, shelf, tray, text):
+        if kind == 'shelf':
+            self.layout[shelf]['name'] = text
         else:
-            for shelf in layout:
-                name = shelf.get('name', '')
-                label = shelf.get('trays', [{}])[0].get('label', '')
-                self._add_row(name, label)
-
-    def _add_row(self, shelf_name='', tray_label=''):
-        row = BoxLayout(size_hint_y=None, height=40)
-        name_input = TextInput(text=shelf_name)
-        tray_input = TextInput(text=tray_label)
-        btn = Button(text='Remove', size_hint_x=None, width=80)
-        btn.bind(on_press=lambda *_: self.remove_shelf(row))
-        row.add_widget(name_input)
-        row.add_widget(tray_input)
-        row.add_widget(btn)
-        self.ids.shelf_box.add_widget(row)
+            self.layout[shelf]['trays'][tray]['label'] = text
+        # keep the view data current so a recycled row shows the edit
+        self.ids.shelf_rv.data[index]['text'] = text
 
     def add_shelf(self):
-        self._add_row()
+        self.layout.append({'name': '', 'trays': [{'label': ''}]})
+        self._sync_view()
 
-    def remove_shelf(self, row):
-        self.ids.shelf_box.remove_widget(row)
+    def add_tray(self, shelf):
+        self.layout[shelf]['trays'].append({'label': ''})
+        self._sync_view()
 
-    def save_layout(self):
-        data = []
-        for row in self.ids.shelf_box.children[::-1]:
-            name_input = row.children[2]
-            tray_input = row.children[1]
-            data.append({'name': name_input.text, 'trays': [{'label': tray_input.text}]})
-        save_system_layout('default', data)
+    def remove_row(self, shelf, tray):
+        if tray < 0:
+            del self.layout[shelf]
+        else:
+            del self.layout[shelf]['trays'][tray]
+        self._sync_view()
+
+    def save_layout(self, delete_logs=False):
+        if self._saving:
+            # new rows need the ids of the running save, so go again after it
+            self._save_again = True
+            return
+        self._saving = True
+        # the rows being saved; edits during the save keep these objects
+        rows = [(shelf, list(shelf['trays'])) for shelf in self.layout]
+        get_io_executor().submit(
+            save_system_layout, 'default', copy.deepcopy(self.layout), delete_logs=delete_logs,
+            callback=lambda saved: self._on_saved(rows, saved),
+            errback=self._on_save_failed,
+        )
+
+    def _on_saved(self, rows, saved):
+        for (shelf, trays), saved_shelf in zip(rows, saved):
+            shelf['id'] = saved_shelf['id']
+            for tray, saved_tray in zip(trays, saved_shelf['trays']):
+                tray['id'] = saved_tray['id']
+        self._finish_save()
+
+    def _on_save_failed(self, exc):
+        if isinstance(exc, TrayHasLogs):
+            self._save_again = False
+            self._saving = False
+            self._confirm_log_deletion(len(exc.tray_ids))
+            return
+        Logger.error(f"GardenPip: saving the shelf layout failed: {exc}")
+        self._finish_save()
+
+    def _confirm_log_deletion(self, count):
+        from kivy.uix.button import Button
+        from kivy.uix.label import Label
+        from kivy.uix.popup import Popup
+
+        content = BoxLayout(orientation='vertical', spacing=10)
+        content.add_widget(Label(text=f'{count} removed tray(s) have nutrient logs.\n'
+                                      'Delete the trays and their logs?'))
+        buttons = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        popup = Popup(title='Delete logs?', content=content, size_hint=(0.8, 0.4), auto_dismiss=False)
+
+        def confirm(_button):
+            popup.dismiss()
+            self.save_layout(delete_logs=True)
+
+        buttons.add_widget(Button(text='Delete', on_press=confirm))
+        buttons.add_widget(Button(text='Keep', on_press=lambda _button: popup.dismiss()))
+        content.add_widget(buttons)
+        popup.open()
+
+    def _finish_save(self):
+        self._saving = False
+        if self._save_again:
+            self._save_again = False
+            self.save_layout()
+
+
+def _log_row(log) -> dict:
+    return {
+        "id": log.id,
+        "date": log.date,
+        "notes": log.notes,
+        "text": f"{log.date.date()} | Tray {log.tray_id} pH {log.ph} ppm {log.ppm} - {log.notes}",
+    }
 
 
 class NutrientLogScreen(Screen):
     def on_kv_post(self, base_widget):
-        here = os.path.dirname(__file__)
-        db_path = os.path.join(here, "gardenpip.db")
-        self.session = get_session(db_path)
+        self.db_path = _db().DEFAULT_DB_PATH
+        self._query = None
+        self._rows = []          # loaded rows, in display order
+        self._has_more = False   # more pages available in the database
+        self._loading = False
+        self._generation = 0     # bumped on every new query; stale pages are dropped
+        self._search_ev = None
         self.refresh_logs()
 
+    @timed('ui.nutrient_log.refresh')
     def refresh_logs(self, query: str | None = None) -> None:
-        logs = search_nutrient_logs(self.session, query)
-        self.ids.log_list.data = [
-            {
-                "text": f"{log.date.date()} | Tray {log.tray_id} pH {log.ph} ppm {log.ppm} - {log.notes}",
-                "on_press": lambda log_id=log.id: self.edit_log(log_id),
-            }
-            for log in logs
-        ]
+        """Reload logs matching ``query`` starting from the first page."""
+        self._generation += 1
+        self._query = query or None
+        self._rows = []
+        self._has_more = False
+        self.ids.log_list.data = []
+        self._fetch_page(None)
 
     def on_search(self, text: str) -> None:
+        if self._search_ev is not None:
+            self._search_ev.cancel()
+        self._search_ev = Clock.schedule_once(lambda dt: self._apply_search(text), SEARCH_DELAY)
+
+    def _apply_search(self, text: str) -> None:
+        self._search_ev = None
+        text = text.strip() or None
+        prev = self._query
+        if text and prev and text.startswith(prev) and not self._has_more and not self._loading:
+            # The previous result set was complete and the new query only
+            # extends it, so narrow what we already have.
+            self._generation += 1
+            self._query = text
+            notes_match = _db().notes_match
+            self._rows = [row for row in self._rows if notes_match(text, row["notes"])]
+            self.ids.log_list.data = [self._view_item(row) for row in self._rows]
+            return
         self.refresh_logs(text)
 
+    def on_log_scroll(self, scroll_y: float) -> None:
+        if scroll_y <= 0.1 and self._has_more and not self._loading:
+            last = self._rows[-1]
+            self._fetch_page((last["date"], last["id"]))
+
+    def _fetch_page(self, after) -> None:
+        self._loading = True
+        generation = self._generation
+        query = self._query
+
+        db = _db()
+        db_path = self.db_path
+
+        def work():
+            rows = []
+            try:
+                with db.session_scope(db_path) as session:
+                    logs = db.search_nutrient_logs_page(session, query, after=after, limit=LOG_PAGE_SIZE + 1)
+                    rows = [_log_row(log) for log in logs]
+            except Exception:
+                Logger.exception("GardenPip: log search failed")
+            return rows
+
+        # a newer query replaces a fetch that hasn't started yet
+        get_io_executor().submit(work, callback=lambda rows: self._on_page(generation, rows),
+                                 key='nutrient_log.page')
+
+    @timed('ui.nutrient_log.page')
+    def _on_page(self, generation: int, rows: list) -> None:
+        if generation != self._generation:
+            return
+        self._loading = False
+        self._has_more = len(rows) > LOG_PAGE_SIZE
+        rows = rows[:LOG_PAGE_SIZE]
+        self._rows.extend(rows)
+        self.ids.log_list.data.extend(self._view_item(row) for row in rows)
+
+    def _view_item(self, row: dict) -> dict:
+        return {"text": row["text"], "on_press": lambda log_id=row["id"]: self.edit_log(log_id)}
+
+    def _write(self, fn, *args, **kwargs) -> None:
+        """Run ``fn(session, ...)`` in the background, then reload the logs."""
+        db = _db()
+        db_path = self.db_path
+
+        def work():
+            with db.session_scope(db_path) as session:
+                fn(session, *args, **kwargs)
+
+        get_io_executor().submit(work, callback=lambda _: self.refresh_logs(self._query))
+
     def add_log(self) -> None:
-        tray = self.session.query(Tray).first()
-        if not tray:
-            system = ShelfSystem(name="Default")
-            shelf = Shelf(label="S1", system=system)
-            tray = Tray(label="T1", shelf=shelf)
-            self.session.add(system)
-            self.session.commit()
-        add_nutrient_log(self.session, tray.id, ph=6.0, ppm=1000, notes="New entry")
-        self.refresh_logs()
+        db = _db()
+
+        def add(session):
+            tray = session.query(db.Tray).first()
+            if not tray:
+                system = db.ShelfSystem(name="Default")
+                shelf = db.Shelf(label="S1", system=system)
+                tray = db.Tray(label="T1", shelf=shelf)
+                session.add(system)
+                session.flush()
+            db.add_nutrient_log(session, tray.id, ph=6.0, ppm=1000, notes="New entry")
+
+        self._write(add)
 
     def edit_log(self, log_id: int) -> None:
-        update_nutrient_log(self.session, log_id, notes="edited")
-        self.refresh_logs()
+        self._write(_db().update_nutrient_log, log_id, notes="edited")
 
     def delete_log(self, log_id: int) -> None:
-        delete_nutrient_log(self.session, log_id)
-        self.refresh_logs()
+        self._write(_db().delete_nutrient_log, log_id)
+
+
+class DiagnosticsScreen(Screen):
+    """Timings collected by ``gardenpip.instrument``, refreshed every second."""
+
+    def on_pre_enter(self):
+        self.refresh()
+        self._refresh_ev = Clock.schedule_interval(lambda dt: self.refresh(), 1.0)
+
+    def on_leave(self):
+        self._refresh_ev.cancel()
+
+    def refresh(self):
+        self.ids.toggle.text = 'Disable' if instrument.is_enabled() else 'Enable'
+        lines = instrument.report_lines()
+        if not lines:
+            lines = ['Nothing recorded.' if instrument.is_enabled() else 'Instrumentation is off.']
+        self.ids.diag_rv.data = [{'text': line} for line in lines]
+
+    def toggle(self):
+        if instrument.is_enabled():
+            instrument.disable()
+        else:
+            instrument.enable()
+        self.refresh()
+
+    def reset(self):
+        instrument.reset()
+        self.refresh()
+
+    def export(self):
+        path = os.path.join(os.path.dirname(__file__), 'data', time.strftime('diagnostics-%Y%m%d-%H%M%S.json'))
+        get_io_executor().submit(
+            instrument.export, path,
+            callback=lambda _: setattr(self.ids.status, 'text', f'Saved {path}'),
+            errback=lambda exc: setattr(self.ids.status, 'text', f'Export failed: {exc}'),
+        )
+
+
+class LazyScreenManager(ScreenManager):
+    """ScreenManager that builds registered screens on first navigation."""
+
+    def __init__(self, factories, **kwargs):
+        self._factories = dict(factories)
+        super().__init__(**kwargs)
+
+    def on_current(self, instance, value):
+        factory = self._factories.pop(value, None)
+        if factory is not None:
+            with span(f'ui.build_screen:{value}'):
+                self.add_widget(factory(name=value))
+        super().on_current(instance, value)
 
 
 class GardenPipApp(App):
@@ -224,16 +443,29 @@ class GardenPipApp(App):
         self.selected_manufacturer = ''
         self.selected_series       = ''
         self.selected_calmag       = ''
-        sm = ScreenManager()
+        sm = LazyScreenManager({
+            'nutrient_select': NutrientSelectScreen,
+            'nutrient_stage': NutrientStageScreen,
+            'nutrient_log': NutrientLogScreen,
+            'shelf_layout': ShelfLayoutScreen,
+            'diagnostics': DiagnosticsScreen,
+        })
         sm.add_widget(MenuScreen(name='menu'))
-        sm.add_widget(NutrientSelectScreen(name='nutrient_select'))
-        sm.add_widget(NutrientStageScreen(name='nutrient_stage'))
+        return sm
 
-        sm.add_widget(NutrientLogScreen(name='nutrient_log'))
+    def on_start(self):
+        # Used by benchmarks/startup.py to measure time to first frame.
+        if os.environ.get('GARDENPIP_STARTUP_PROBE'):
+            Clock.schedule_once(self._report_first_frame, 0)
 
-        sm.add_widget(ShelfLayoutScreen(name='shelf_layout'))
+    def on_stop(self):
+        # finish queued writes before the window goes away
+        get_io_executor().shutdown(wait=True)
 
-        return sm
+    def _report_first_frame(self, _dt):
+        sys.stdout.write(json.dumps({'first_frame': time.time()}) + '\n')
+        sys.stdout.flush()
+        self.stop()
 
 if __name__ == '__main__':
     GardenPipApp().run()
@@ -0,0 +1,8 @@
+from benchmarks import hotpaths
+
+
+def test_hotpath_benchmarks_run(tmp_path):
+    results = hotpaths.run(str(tmp_path / "data"), scale="tiny", repeat=1)
+    areas = {name.split(":")[0] for name in results}
+    assert areas == {"nutrients", "problems", "schedule", "logs", "layout", "configs"}
+    assert all(r["runs"] == 1 and r["median"] >= 0 for r in results.values())
@@ -1,14 +1,37 @@
+import datetime as dt
 import os
+import sqlite3
+import time
+
+from sqlalchemy.exc import OperationalError
+
 from gardenpip.db import (
+    LATEST_VERSION,
+    NutrientLog,
+    NutrientLogWriter,
     ShelfSystem,
     Shelf,
     Tray,
+    TrayStats,
+    add_alert_listener,
     add_nutrient_log,
+    add_nutrient_logs,
     delete_nutrient_log,
+    dispose_engines,
+    get_engine,
     get_session,
+    notes_match,
+    nutrient_history,
+    recent_alerts,
+    remove_alert_listener,
     search_nutrient_logs,
+    search_nutrient_logs_page,
+    session_scope,
     update_nutrient_log,
+    upsert_nutrient_logs,
 )
+from gardenpip.db import logs
+from gardenpip.db.migrations import import_legacy_layout
 
 
 def test_crud_nutrient_log(tmp_path):
@@ -32,3 +55,337 @@ def test_crud_nutrient_log(tmp_path):
 
     assert delete_nutrient_log(session, log.id)
     assert search_nutrient_logs(session) == []
+
+
+def test_search_pages_are_contiguous(tmp_path):
+    session = get_session(str(tmp_path / "test.db"))
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    start = dt.datetime(2024, 1, 1)
+    for i in range(7):
+        # longer notes rank lower, and pairs of logs share a date
+        add_nutrient_log(session, tray.id, date=start + dt.timedelta(hours=i // 2),
+                         ph=6.0, ppm=900 + i, notes="note" + " filler" * i)
+
+    seen = []
+    after = None
+    while True:
+        page = search_nutrient_logs_page(session, "note", after=after, limit=3)
+        if not page:
+            break
+        seen.extend(log.id for log in page)
+        after = (page[-1].date, page[-1].id)
+
+    # pages are newest first, ties broken by id, whatever the relevance
+    ranked = [log.id for log in search_nutrient_logs(session, "note")]
+    rows = session.query(NutrientLog).all()
+    assert seen == [log.id for log in sorted(rows, key=lambda log: (log.date, log.id), reverse=True)]
+    assert ranked != seen and sorted(ranked) == sorted(seen)
+    assert len(seen) == 7
+
+
+def test_notes_search_uses_token_prefixes(tmp_path):
+    session = get_session(str(tmp_path / "test.db"))
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    root = add_nutrient_log(session, tray.id, notes="root rot spotted, added peroxide")
+    add_nutrient_log(session, tray.id, notes="topped up reservoir")
+    both = add_nutrient_log(session, tray.id, notes="root rot again; root zone dark")
+
+    assert [log.id for log in search_nutrient_logs(session, "roo")] == [both.id, root.id]
+    assert [log.id for log in search_nutrient_logs(session, "perox root")] == [root.id]
+    assert search_nutrient_logs(session, "serv") == []
+
+    update_nutrient_log(session, root.id, notes="cleared")
+    assert [log.id for log in search_nutrient_logs(session, "root")] == [both.id]
+    assert notes_match("root da", both.notes)
+    assert not notes_match("rot x", both.notes)
+
+
+def test_substring_search_takes_wildcards_literally(tmp_path, monkeypatch):
+    session = get_session(str(tmp_path / "test.db"))
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    percent = add_nutrient_log(session, tray.id, notes="cut feed 50% today")
+    add_nutrient_log(session, tray.id, notes="500 ppm, tank_a")
+    under = add_nutrient_log(session, tray.id, notes="tank_b topped up")
+
+    # text without words never reaches the FTS index
+    assert [log.id for log in search_nutrient_logs(session, "%")] == [percent.id]
+    monkeypatch.setattr(logs, "_uses_fts", lambda session: False)
+    assert [log.id for log in search_nutrient_logs(session, "50%")] == [percent.id]
+    assert [log.id for log in search_nutrient_logs_page(session, "k_b")] == [under.id]
+
+
+def test_bulk_insert_upsert_and_buffered_writer(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    session = get_session(db_path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+
+    assert add_nutrient_logs(session, [{"tray_id": tray.id, "ph": 6.0, "ppm": i} for i in range(500)]) == 500
+    first = search_nutrient_logs(session)[-1]
+    upsert_nutrient_logs(session, [
+        {"id": first.id, "tray_id": tray.id, "ph": 5.5, "ppm": 1.0, "notes": "fixed"},
+        {"tray_id": tray.id, "ph": 7.0, "ppm": 2.0, "notes": "fresh"},
+    ])
+    assert len(search_nutrient_logs(session)) == 501
+    session.expire_all()
+    assert [log.id for log in search_nutrient_logs(session, "fixed")] == [first.id]
+
+    # a partial row replaces only the columns it carries
+    before = (first.tray_id, first.date, first.ph, first.notes)
+    upsert_nutrient_logs(session, [{"id": first.id, "ppm": 950}])
+    session.expire_all()
+    assert (first.tray_id, first.date, first.ph, first.notes, first.ppm) == before + (950,)
+
+    with NutrientLogWriter(db_path, max_rows=10, max_delay=60) as writer:
+        for i in range(25):
+            writer.write(tray.id, 6.2, 800 + i)
+        # two full batches are written straight away, the rest on close
+        assert len(search_nutrient_logs(session)) == 521
+    assert len(search_nutrient_logs(session)) == 526
+
+
+def test_buffered_writer_keeps_rows_when_a_flush_fails(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "test.db")
+    session = get_session(db_path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+
+    failures = []
+    real_add = logs.add_nutrient_logs
+
+    def flaky_add(session, rows):
+        if not failures:
+            failures.append(len(rows))
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return real_add(session, rows)
+
+    monkeypatch.setattr(logs, "add_nutrient_logs", flaky_add)
+    with NutrientLogWriter(db_path, max_rows=100, max_delay=0.05) as writer:
+        for i in range(5):
+            writer.write(tray.id, 6.0, 900 + i)
+        deadline = time.monotonic() + 5
+        while len(search_nutrient_logs(session)) < 5 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert failures == [5]
+        assert len(search_nutrient_logs(session)) == 5
+        # the background thread is still flushing on time
+        writer.write(tray.id, 6.0, 1000)
+        deadline = time.monotonic() + 5
+        while len(search_nutrient_logs(session)) < 6 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert len(search_nutrient_logs(session)) == 6
+
+
+def test_sessions_share_one_engine(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    engine = get_engine(db_path)
+    assert get_engine(str(tmp_path / "." / "test.db")) is engine
+    assert get_session(db_path).get_bind() is engine
+
+    with session_scope(db_path) as session:
+        session.add(ShelfSystem(name="Sys"))
+    try:
+        with session_scope(db_path) as session:
+            session.add(ShelfSystem(name="Other"))
+            raise ValueError
+    except ValueError:
+        pass
+    with session_scope(db_path) as session:
+        assert [s.name for s in session.query(ShelfSystem)] == ["Sys"]
+
+
+def test_legacy_layout_database_is_migrated(tmp_path):
+    db_path = tmp_path / "old.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE shelf_systems (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE);
+        CREATE TABLE shelves (id INTEGER PRIMARY KEY, system_id INTEGER, name VARCHAR);
+        CREATE TABLE trays (id INTEGER PRIMARY KEY, shelf_id INTEGER, label VARCHAR);
+        INSERT INTO shelf_systems VALUES (1, 'default');
+        INSERT INTO shelves VALUES (1, 1, 'Top');
+        INSERT INTO trays VALUES (1, 1, 'T1');
+    """)
+    conn.commit()
+    conn.close()
+
+    with session_scope(str(db_path)) as session:
+        assert session.get(Shelf, 1).label == "Top"
+        add_nutrient_log(session, 1, notes="after migration")
+        assert len(search_nutrient_logs(session, "migration")) == 1
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT version FROM schema_version").fetchall() == [(LATEST_VERSION,)]
+    conn.close()
+
+
+def test_legacy_layout_is_merged_into_existing_systems(tmp_path):
+    legacy = tmp_path / "garden.db"
+    conn = sqlite3.connect(legacy)
+    conn.executescript("""
+        CREATE TABLE shelf_systems (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE);
+        CREATE TABLE shelves (id INTEGER PRIMARY KEY, system_id INTEGER, name VARCHAR);
+        CREATE TABLE trays (id INTEGER PRIMARY KEY, shelf_id INTEGER, label VARCHAR);
+        INSERT INTO shelf_systems VALUES (1, 'Default'), (2, 'Tent');
+        INSERT INTO shelves VALUES (1, 1, 'S1'), (2, 1, 'Top'), (3, 2, 'Low');
+        INSERT INTO trays VALUES (1, 1, 'T1'), (2, 1, 'Basil'), (3, 2, 'Kale'), (4, 3, 'Mint');
+    """)
+    conn.commit()
+    conn.close()
+
+    db_path = str(tmp_path / "test.db")
+    with session_scope(db_path) as session:
+        # what the old log screen created on first use
+        session.add(ShelfSystem(name="Default", shelves=[Shelf(label="S1", trays=[Tray(label="T1")])]))
+        session.add(ShelfSystem(name="Other", shelves=[Shelf(label="X", trays=[Tray(label="X1")])]))
+
+    assert import_legacy_layout(get_engine(db_path), str(legacy)) == 6
+    assert not legacy.exists() and (tmp_path / "garden.db.migrated").exists()
+    with session_scope(db_path) as session:
+        layout = {
+            system.name: {shelf.label: [t.label for t in shelf.trays] for shelf in system.shelves}
+            for system in session.query(ShelfSystem)
+        }
+    assert layout == {
+        "Default": {"S1": ["T1", "Basil"], "Top": ["Kale"]},
+        "Other": {"X": ["X1"]},
+        "Tent": {"Low": ["Mint"]},
+    }
+
+
+def test_rollups_follow_writes_and_history_downsamples(tmp_path):
+    session = get_session(str(tmp_path / "test.db"))
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    start = dt.datetime(2024, 1, 1)  # a Monday
+    add_nutrient_logs(session, [
+        {"tray_id": tray.id, "date": start + dt.timedelta(minutes=15 * i), "ph": 6.0 + (i % 4) / 10, "ppm": 800 + i}
+        for i in range(4 * 24 * 14)  # two weeks of 15-minute readings
+    ])
+    end = start + dt.timedelta(days=14)
+
+    resolution, points = nutrient_history(session, tray.id, start, start + dt.timedelta(hours=2))
+    assert resolution == "raw" and len(points) == 8
+
+    resolution, points = nutrient_history(session, tray.id, start, end, max_points=400)
+    assert resolution == "hour" and len(points) == 14 * 24
+    assert points[0].count == 4 and points[0].ph_min == 6.0 and points[0].ph_max == 6.3
+
+    resolution, points = nutrient_history(session, tray.id, start, end, max_points=20)
+    assert resolution == "day" and len(points) == 14
+
+    resolution, points = nutrient_history(session, tray.id, start, end, max_points=5)
+    assert resolution == "week" and [p.count for p in points] == [4 * 24 * 7] * 2
+
+    first = search_nutrient_logs_page(session, limit=1)[0]  # newest reading
+    delete_nutrient_log(session, first.id)
+    _, points = nutrient_history(session, tray.id, start, end, max_points=5)
+    assert [p.count for p in points] == [4 * 24 * 7, 4 * 24 * 7 - 1]
+    assert points[1].ppm_max == first.ppm - 1
+
+
+def test_anomalies_are_flagged_as_readings_are_logged(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    session = get_session(db_path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    start = dt.datetime(2024, 1, 1)
+    add_nutrient_logs(session, [
+        {"tray_id": tray.id, "date": start + dt.timedelta(hours=i), "ph": 6.0 + (i % 3) / 100, "ppm": 900 + i % 5}
+        for i in range(30)
+    ])
+    assert recent_alerts(session) == []
+
+    seen = []
+    add_alert_listener(seen.append)
+    try:
+        # the state survives a restart; no history is replayed
+        session.close()
+        dispose_engines()
+        session = get_session(db_path)
+        log = add_nutrient_log(session, tray.id, date=start + dt.timedelta(hours=30), ph=7.2, ppm=901)
+    finally:
+        remove_alert_listener(seen.append)
+    alerts = recent_alerts(session, tray_id=tray.id)
+    assert {(a.metric, a.kind) for a in alerts} == {("ph", "level"), ("ph", "rate")}
+    assert all(a.log_id == log.id for a in alerts)
+    assert [a.id for a in seen[0]] == [a.id for a in sorted(alerts, key=lambda a: a.id)]
+    assert session.get(TrayStats, tray.id).count == 31
+
+
+def test_anomaly_state_is_seeded_from_existing_logs(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    session = get_session(db_path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    add_nutrient_logs(session, [{"tray_id": tray.id, "ph": ph, "ppm": 1000} for ph in (5.0, 7.0)])
+    session.close()
+    dispose_engines()
+
+    # roll the database back to before the anomaly migration
+    conn = sqlite3.connect(db_path)
+    conn.executescript("DROP TABLE tray_stats; DROP TABLE nutrient_alerts; UPDATE schema_version SET version = 4;")
+    conn.close()
+    with session_scope(db_path) as session:
+        stats = session.get(TrayStats, tray.id)
+        assert (stats.count, stats.ph_mean, stats.ph_var, stats.ppm_var) == (2, 6.0, 1.0, 0.0)
+        assert stats.last_date is not None
+
+
+def test_deleted_tray_takes_its_anomaly_state_along(tmp_path):
+    from gardenpip.shelf_logic import get_system_layout, save_system_layout
+
+    db_path = str(tmp_path / "test.db")
+    layout = save_system_layout("default", [{"name": "S1", "trays": [{"label": "T1"}, {"label": "T2"}]}], db_path)
+    tray_id = layout[0]["trays"][1]["id"]
+    start = dt.datetime(2024, 1, 1)
+    session = get_session(db_path)
+    add_nutrient_logs(session, [
+        {"tray_id": tray_id, "date": start + dt.timedelta(hours=i), "ph": 6.0, "ppm": 900} for i in range(20)
+    ])
+    add_nutrient_log(session, tray_id, date=start + dt.timedelta(hours=20), ph=7.5, ppm=900)
+    assert recent_alerts(session, tray_id=tray_id)
+
+    del layout[0]["trays"][1]
+    save_system_layout("default", layout, db_path, delete_logs=True)
+    layout[0]["trays"].append({"label": "NewTray"})
+    layout = save_system_layout("default", layout, db_path)
+    assert layout[0]["trays"][1]["id"] == tray_id  # SQLite reused the id
+
+    session.expire_all()
+    assert session.get(TrayStats, tray_id) is None and recent_alerts(session, tray_id=tray_id) == []
+    add_nutrient_log(session, tray_id, date=start + dt.timedelta(hours=21), ph=5.5, ppm=1400)
+    assert recent_alerts(session, tray_id=tray_id) == []
+    assert session.get(TrayStats, tray_id).count == 1
+    session.close()
+
+
+def test_upserted_rows_with_new_ids_reach_the_detector(tmp_path):
+    session = get_session(str(tmp_path / "test.db"))
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    start = dt.datetime(2024, 1, 1)
+    upsert_nutrient_logs(session, [
+        {"id": 100 + i, "tray_id": tray.id, "date": start + dt.timedelta(hours=i), "ph": 6.0, "ppm": 900}
+        for i in range(20)
+    ])
+    assert session.get(TrayStats, tray.id).count == 20
+    # replacing an existing row is a correction, not a new reading
+    upsert_nutrient_logs(session, [{"id": 100, "tray_id": tray.id, "ph": 6.1, "ppm": 900}])
+    session.expire_all()
+    assert session.get(TrayStats, tray.id).count == 20
+    upsert_nutrient_logs(session, [
+        {"id": 200, "tray_id": tray.id, "date": start + dt.timedelta(hours=20), "ph": 7.5, "ppm": 900}
+    ])
+    assert {(a.metric, a.kind, a.log_id) for a in recent_alerts(session)} == {("ph", "level", 200), ("ph", "rate", 200)}
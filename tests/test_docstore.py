@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+import pytest
+
+from gardenpip import docstore
+from gardenpip.config_logic import flush_configs, get_config, load_configs, save_configs, set_config
+from gardenpip.docstore import DocumentStore
+
+
+def test_per_key_writes_match_json_dump(tmp_path):
+    path = str(tmp_path / 'cfg.json')
+    store = DocumentStore(path)
+    store.save({'a': {'x': [1, 2], 'y': 'é'}, 'b': 2, 'empty': {}})
+    store.set('b', {'nested': [None, True]})
+    store.set('c', [])
+    store.delete('a')
+    expected = {'b': {'nested': [None, True]}, 'empty': {}, 'c': []}
+    with open(path, encoding='utf-8') as fh:
+        assert fh.read() == json.dumps(expected, indent=2)
+    assert not [n for n in os.listdir(tmp_path) if n.endswith('.tmp')]
+
+
+def test_external_edit_invalidates_cache(tmp_path):
+    path = str(tmp_path / 'cfg.json')
+    store = DocumentStore(path)
+    assert store.load() == {}
+    store.save({'a': 1})
+    loaded = store.load()
+    loaded['a'] = 99  # callers get their own copy
+    assert store.get('a') == 1
+    time.sleep(0.01)
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump({'a': 2, 'b': 3}, fh)
+    assert store.load() == {'a': 2, 'b': 3}
+
+
+def test_saves_are_coalesced(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cfg.json')
+    writes = []
+    real = docstore.atomic_write
+    monkeypatch.setattr(docstore, 'atomic_write', lambda p, d: (writes.append(p), real(p, d)))
+    for i in range(5):
+        save_configs(path, {'default': {'n': i}})
+    set_config(path, 'other', 1)
+    assert load_configs(path) == {'default': {'n': 4}, 'other': 1}
+    assert get_config(path, 'other') == 1
+    assert writes == []
+    flush_configs(path)
+    assert len(writes) == 1
+    with open(path, encoding='utf-8') as fh:
+        assert json.load(fh) == {'default': {'n': 4}, 'other': 1}
+
+
+def test_failed_write_keeps_old_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cfg.json')
+    store = DocumentStore(path)
+    store.save({'a': 1})
+
+    def boom(fd):
+        raise OSError('disk gone')
+
+    monkeypatch.setattr(docstore.os, 'fsync', boom)
+    with pytest.raises(OSError):
+        store.save({'a': 2})
+    with open(path, encoding='utf-8') as fh:
+        assert json.load(fh) == {'a': 1}
+    assert os.listdir(tmp_path) == ['cfg.json']
+
+
+def test_unencodable_changes_fail_in_the_caller(tmp_path, monkeypatch, caplog):
+    path = str(tmp_path / 'cfg.json')
+    store = DocumentStore(path, save_delay=60)
+    store.save({'a': 1})
+    with pytest.raises(TypeError):
+        store.save({'a': {1, 2}})
+    with pytest.raises(TypeError):
+        store.set('b', {1, 2})
+    assert store.load() == {'a': 1}
+    store.flush()
+    with open(path, encoding='utf-8') as fh:
+        assert json.load(fh) == {'a': 1}
+
+    # a write that fails on the timer is logged and retried by the next flush
+    real = docstore.atomic_write
+
+    def full_disk(path, data):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(docstore, 'atomic_write', full_disk)
+    store.save_delay = 0.01
+    store.set('a', 2)
+    deadline = time.monotonic() + 5
+    while 'disk full' not in caplog.text and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert 'saving' in caplog.text and 'disk full' in caplog.text
+    monkeypatch.setattr(docstore, 'atomic_write', real)
+    store.flush()
+    with open(path, encoding='utf-8') as fh:
+        assert json.load(fh) == {'a': 2}
@@ -0,0 +1,64 @@
+import csv
+import datetime as dt
+
+import pytest
+
+from gardenpip.db import Shelf, ShelfSystem, Tray, add_nutrient_logs, get_session
+from gardenpip.export import LOG_COLUMNS, export_nutrient_logs, export_schedule, iter_nutrient_logs
+from gardenpip.schedule_log import ScheduleLog
+
+
+def _db(path):
+    session = get_session(path)
+    shelf = Shelf(label="S1", system=ShelfSystem(name="Sys"))
+    trays = [Tray(label=f"T{i}", shelf=shelf) for i in range(2)]
+    session.add_all(trays)
+    session.commit()
+    start = dt.datetime(2024, 1, 1)
+    add_nutrient_logs(session, [
+        {"tray_id": trays[i % 2].id, "date": start + dt.timedelta(days=i), "ph": 6.0, "ppm": 900 + i,
+         "notes": f"day {i}"}
+        for i in range(10)
+    ])
+    return [t.id for t in trays]
+
+
+def test_export_logs_csv_with_filters(tmp_path):
+    db_path = str(tmp_path / "logs.db")
+    trays = _db(db_path)
+    out = str(tmp_path / "out" / "logs.csv")
+    count = export_nutrient_logs(out, db_path, start=dt.date(2024, 1, 3), end=dt.date(2024, 1, 9),
+                                 tray_ids=[trays[0]], chunk_size=2)
+    with open(out, newline="", encoding="utf-8") as fh:
+        rows = list(csv.DictReader(fh))
+    assert count == len(rows) == 3
+    assert [r["notes"] for r in rows] == ["day 2", "day 4", "day 6"]
+    assert rows[0]["tray"] == "T0" and rows[0]["shelf"] == "S1"
+    assert rows[0]["date"] == "2024-01-03T00:00:00"
+    # chunked reads return everything, in date order
+    ppm = LOG_COLUMNS.index("ppm")
+    assert [r[ppm] for r in iter_nutrient_logs(db_path, chunk_size=3)] == [900.0 + i for i in range(10)]
+
+
+def test_export_schedule_csv(tmp_path):
+    base = str(tmp_path / "data")
+    log = ScheduleLog(base)
+    for day, tray in ((1, 1), (2, 2), (3, 1)):
+        log.append({"date": f"2024-01-0{day}", "tray_id": tray, "manufacturer": "M", "lines": ["a", "b"]})
+    log.close()
+    out = str(tmp_path / "schedule.csv")
+    assert export_schedule(out, base, start=dt.date(2024, 1, 2), tray_ids=[1]) == 1
+    with open(out, newline="", encoding="utf-8") as fh:
+        rows = list(csv.DictReader(fh))
+    assert rows == [dict(rows[0], date="2024-01-03", tray_id="1", manufacturer="M", lines="a\nb")]
+
+
+def test_export_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    db_path = str(tmp_path / "logs.db")
+    _db(db_path)
+    out = str(tmp_path / "logs.parquet")
+    assert export_nutrient_logs(out, db_path, chunk_size=4) == 10
+    table = pq.read_table(out)
+    assert table.num_rows == 10
+    assert table.column("ppm").to_pylist()[:2] == [900.0, 901.0]
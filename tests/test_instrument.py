@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from gardenpip import instrument
+from gardenpip.config_logic import load_configs, save_configs
+from gardenpip.shelf_logic import get_system_layout, save_system_layout
+
+
+@pytest.fixture
+def instrumented():
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.disable()
+    instrument.reset()
+
+
+def test_nothing_recorded_while_disabled(tmp_path):
+    instrument.reset()
+    instrument.disable()
+    save_configs(str(tmp_path / "cfg.json"), {"a": 1})
+    with instrument.span("block"):
+        pass
+    assert instrument.snapshot() == {}
+
+
+def test_spans_functions_and_sql(tmp_path, instrumented):
+    path = str(tmp_path / "cfg.json")
+    save_configs(path, {"a": 1})
+    for _ in range(3):
+        load_configs(path)
+    with instrument.span("block"):
+        pass
+    db_path = str(tmp_path / "test.db")
+    save_system_layout("default", [{"name": "S1", "trays": [{"label": "T1"}]}], db_path)
+    get_system_layout("default", db_path)
+
+    stats = instrument.snapshot()
+    assert stats["gardenpip.config_logic.load_configs"]["count"] == 3
+    assert stats["block"]["count"] == 1
+    assert stats["gardenpip.shelf_logic.save_system_layout"]["count"] == 1
+    assert stats["sql:INSERT"]["count"] >= 2
+    assert stats["sql:SELECT"]["count"] >= 1
+    assert sum(stats["sql:SELECT"]["buckets"]) == stats["sql:SELECT"]["count"]
+
+    out = tmp_path / "diag.json"
+    instrument.export(str(out))
+    exported = json.loads(out.read_text())
+    assert set(exported["operations"]) == set(stats)
+    assert instrument.report_lines(limit=1)
@@ -0,0 +1,32 @@
+import threading
+
+from gardenpip.io_worker import IOExecutor
+
+
+def test_jobs_run_in_order_and_dispatch_results():
+    dispatched = []
+    executor = IOExecutor(dispatch=lambda fn: dispatched.append(fn))
+    results, errors = [], []
+    for i in range(5):
+        executor.submit(lambda i=i: i * i, callback=results.append)
+    executor.submit(lambda: 1 / 0, errback=errors.append)
+    assert executor.wait_idle(5)
+    assert results == []  # nothing runs until the main loop dispatches
+    for fn in dispatched:
+        fn()
+    assert results == [0, 1, 4, 9, 16]
+    assert isinstance(errors[0], ZeroDivisionError)
+    executor.shutdown()
+
+
+def test_keyed_jobs_are_coalesced():
+    executor = IOExecutor(dispatch=lambda fn: fn())
+    release = threading.Event()
+    ran = []
+    executor.submit(release.wait)
+    for i in range(10):
+        executor.submit(ran.append, i, key="refresh")
+    executor.submit(ran.append, "write")
+    release.set()
+    executor.shutdown(wait=True)
+    assert ran == [9, "write"]
@@ -1,7 +1,29 @@
 import os
-from gardenpip.nutrient_logic import load_nutrient_data, calculate_nutrients
-from gardenpip.problem_logic import load_problem_data, search_problems
-from gardenpip.shelf_logic import load_shelves, save_shelves
+
+import pytest
+
+from gardenpip.nutrient_logic import (
+    DoseRequest,
+    calculate_batch,
+    calculate_nutrients,
+    format_dose_table,
+    get_catalog,
+    load_nutrient_data,
+)
+from gardenpip.problem_logic import (
+    get_diagnosis_index,
+    get_problem_index,
+    load_problem_data,
+    search_problems,
+)
+from gardenpip.shelf_logic import (
+    flatten_layout,
+    get_system_layout,
+    load_shelves,
+    save_shelves,
+    TrayHasLogs,
+    save_system_layout,
+)
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 
@@ -24,6 +46,37 @@ def test_calculate_nutrients_basic():
     assert any('Bloom' in l for l in lines)
 
 
+def test_catalog_matches_raw_data_and_is_shared():
+    path = os.path.join(ROOT, 'nutrients.json')
+    data = load_nutrient_data(path)
+    catalog = get_catalog(path)
+    assert get_catalog(path) is catalog
+    for unit in ('metric', 'imperial'):
+        for man in catalog.manufacturers():
+            for series in catalog.series(man):
+                for stage in catalog.stages(man, series):
+                    args = (man, series, stage, '', unit, 37.5, 'CaliMagic')
+                    assert calculate_nutrients(catalog, *args) == calculate_nutrients(data, *args)
+    for source in (catalog, data):
+        assert calculate_nutrients(source, 'Nope', 'Nope', 'Seedling', '', 'metric', 1, None) == []
+
+
+def test_batch_matches_single_calculation():
+    catalog = get_catalog(os.path.join(ROOT, 'nutrients.json'))
+    requests = [
+        DoseRequest('General Hydroponics', 'Flora Series', 'Seedling', 'metric', 100),
+        DoseRequest('FoxFarm', 'Trio', 'Flowering', 'imperial', 5, 'CaliMagic'),
+        DoseRequest('Nope', 'Nope', 'Seedling', 'metric', 1, 'CaliMagic'),
+    ]
+    table = calculate_batch(catalog, requests)
+    lines = format_dose_table(table, len(requests))
+    for req, got in zip(requests, lines):
+        expected = calculate_nutrients(
+            catalog, req.manufacturer, req.series, req.stage, '', req.unit, req.volume, req.cal_mag
+        )
+        assert got == expected
+
+
 def test_problem_search_by_plant():
     path = os.path.join(ROOT, 'hydroponicProblems.json')
     problems = load_problem_data(path)
@@ -31,9 +84,166 @@ def test_problem_search_by_plant():
     assert any('Cucumber' in p['title'] or 'cucumber' in p['title'].lower() for p in matches)
 
 
+def test_problem_index_ranks_and_filters():
+    index = get_problem_index(os.path.join(ROOT, 'hydroponicProblems.json'))
+    assert get_problem_index(os.path.join(ROOT, 'hydroponicProblems.json')) is index
+    matches = index.search('burnt leaf tips')
+    assert matches[0]['title'] == 'Burnt Leaf Tips in Cucumbers'
+    filtered = index.search('leaf', plant='tomato', stage='vegetative')
+    assert filtered
+    assert all('Tomato' in p['applicablePlants'] and 'Vegetative' in p['growthStages'] for p in filtered)
+    assert any('Cucumber' in p['applicablePlants'] for p in search_problems(index, 'Cucumber'))
+
+
+def test_diagnosis_ranks_by_symptom_overlap():
+    path = os.path.join(ROOT, 'hydroponicProblems.json')
+    index = get_diagnosis_index(path)
+    assert get_diagnosis_index(path) is index
+    first = load_problem_data(path)[0]
+    observed = [s.upper() for s in first['symptoms']] + ['not a real symptom']
+    ranked = index.diagnose_ids(observed)
+    assert ranked[0] == (0, len(first['symptoms']))
+    assert all(a[1] >= b[1] for a, b in zip(ranked, ranked[1:]))
+    # Generic problems still match a specific plant filter
+    filtered = index.diagnose(observed, plant='Cucumber', medium='hydroton')
+    assert filtered[0]['title'] == first['title']
+    assert first not in index.diagnose(observed, stage='flowering')
+    assert first['symptoms'][0] in index.symptoms()
+
+
 def test_shelf_save_and_load(tmp_path):
     data = [{'pos': [1, 2], 'size': [3, 4]}]
     json_path = tmp_path / 'shelves.json'
     save_shelves(str(json_path), data)
     loaded = load_shelves(str(json_path))
     assert loaded == data
+
+
+def test_save_system_layout_keeps_ids(tmp_path):
+    from gardenpip.db import add_nutrient_log, search_nutrient_logs, session_scope
+
+    db_path = str(tmp_path / 'layout.db')
+    saved = save_system_layout('default', [
+        {'name': 'Top', 'trays': [{'label': 'T1'}, {'label': 'T2'}]},
+        {'name': 'Bottom', 'trays': [{'label': 'B1'}]},
+    ], db_path)
+    assert saved == get_system_layout('default', db_path)
+    tray_id = saved[0]['trays'][0]['id']
+    with session_scope(db_path) as session:
+        add_nutrient_log(session, tray_id, notes='kept')
+
+    saved[0]['trays'][0]['label'] = 'T1 renamed'
+    del saved[1]
+    saved.append({'name': 'New', 'trays': [{'label': 'N1'}]})
+    again = save_system_layout('default', saved, db_path)
+
+    layout = get_system_layout('default', db_path)
+    assert layout == again
+    assert [s['name'] for s in layout] == ['Top', 'New']
+    assert layout[0]['trays'][0] == {'id': tray_id, 'label': 'T1 renamed'}
+    with session_scope(db_path) as session:
+        assert [log.tray_id for log in search_nutrient_logs(session, 'kept')] == [tray_id]
+
+
+def test_layout_order_is_kept_and_logged_trays_need_confirmation(tmp_path):
+    from gardenpip.db import add_nutrient_log, search_nutrient_logs, session_scope
+
+    db_path = str(tmp_path / 'layout.db')
+    saved = save_system_layout('default', [
+        {'name': 'Top', 'trays': [{'label': 'T1'}, {'label': 'T2'}]},
+        {'name': 'Bottom', 'trays': [{'label': 'B1'}]},
+    ], db_path)
+    saved.reverse()
+    saved[1]['trays'].reverse()
+    save_system_layout('default', saved, db_path)
+    layout = get_system_layout('default', db_path)
+    assert [s['name'] for s in layout] == ['Bottom', 'Top']
+    assert [t['label'] for t in layout[1]['trays']] == ['T2', 'T1']
+
+    logged = layout[1]['trays'][0]['id']
+    with session_scope(db_path) as session:
+        add_nutrient_log(session, logged, notes='history')
+    del layout[1]['trays'][0]
+    layout[0]['name'] = 'Bottom renamed'
+    with pytest.raises(TrayHasLogs) as excinfo:
+        save_system_layout('default', layout, db_path)
+    assert excinfo.value.tray_ids == [logged]
+    # nothing was saved
+    assert get_system_layout('default', db_path)[0]['name'] == 'Bottom'
+    with session_scope(db_path) as session:
+        assert len(search_nutrient_logs(session, 'history')) == 1
+
+    save_system_layout('default', layout, db_path, delete_logs=True)
+    assert get_system_layout('default', db_path) == layout
+    with session_scope(db_path) as session:
+        assert search_nutrient_logs(session, 'history') == []
+
+
+def test_system_layout_is_cached_until_saved(tmp_path):
+    from sqlalchemy import event
+
+    from gardenpip.db import get_engine
+
+    db_path = str(tmp_path / 'layout.db')
+    save_system_layout('default', [{'name': f'S{i}', 'trays': [{'label': 'A'}, {'label': 'B'}]}
+                                   for i in range(20)], db_path)
+    statements = []
+    event.listen(get_engine(db_path), 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    layout = get_system_layout('default', db_path)
+    assert len(layout) == 20 and all(len(s['trays']) == 2 for s in layout)
+    assert len(statements) == 3  # system, shelves, trays
+
+    layout[0]['name'] = 'mutated'
+    assert get_system_layout('default', db_path)[0]['name'] == 'S0'
+    assert len(statements) == 3
+
+    save_system_layout('default', layout, db_path)
+    assert get_system_layout('default', db_path)[0]['name'] == 'mutated'
+
+
+def test_layout_read_overlapping_a_save_is_not_cached(tmp_path):
+    import threading
+
+    from sqlalchemy import event
+
+    from gardenpip.db import get_engine
+
+    db_path = str(tmp_path / 'layout.db')
+    saved = save_system_layout('default', [{'name': 'Old', 'trays': [{'label': 'A'}]}], db_path)
+    saved[0]['name'] = 'New'
+    engine = get_engine(db_path)
+
+    done = []
+
+    def save_midway(conn, cursor, statement, *args):
+        # the shelves are already read when the trays are loaded
+        if 'FROM trays' in statement and not done:
+            done.append(True)
+            thread = threading.Thread(target=save_system_layout, args=('default', saved, db_path))
+            thread.start()
+            thread.join()
+
+    event.listen(engine, 'before_cursor_execute', save_midway)
+    assert get_system_layout('default', db_path)[0]['name'] == 'Old'
+    assert get_system_layout('default', db_path)[0]['name'] == 'New'
+
+
+def test_layout_cache_key_resolves_the_default_database():
+    from gardenpip.db import DEFAULT_DB_PATH
+    from gardenpip.shelf_logic import _cache_key
+
+    assert _cache_key('default', None) == _cache_key('default', DEFAULT_DB_PATH)
+
+
+def test_flatten_layout_lists_every_tray():
+    rows = flatten_layout([
+        {'name': 'Top', 'trays': [{'label': 'T1'}, {'label': 'T2'}]},
+        {'name': 'Empty', 'trays': []},
+    ])
+    assert [(r['kind'], r['shelf'], r['tray'], r['text']) for r in rows] == [
+        ('shelf', 0, -1, 'Top'),
+        ('tray', 0, 0, 'T1'),
+        ('tray', 0, 1, 'T2'),
+        ('shelf', 1, -1, 'Empty'),
+    ]
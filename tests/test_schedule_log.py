@@ -1,6 +1,11 @@
 import json
 import os
-from gardenpip.schedule_log import log_schedule
+from gardenpip.schedule_log import (
+    ScheduleLog,
+    iter_schedule,
+    list_segments,
+    log_schedule,
+)
 
 
 def test_log_written_when_base_dir_missing(tmp_path):
@@ -19,8 +24,36 @@ def test_log_written_when_base_dir_missing(tmp_path):
 
     log_schedule(entry, str(base))
 
-    log_file = base / 'schedule_log.json'
-    assert log_file.exists()
-    with open(log_file, 'r', encoding='utf-8') as fh:
-        data = json.load(fh)
-    assert entry in data
+    assert list_segments(str(base))
+    assert entry in list(iter_schedule(str(base)))
+
+
+def test_legacy_log_migrated_and_segments_rotate(tmp_path):
+    legacy = [{'date': '2023-12-31', 'stage': 'Old'}]
+    with open(tmp_path / 'schedule_log.json', 'w', encoding='utf-8') as fh:
+        json.dump(legacy, fh)
+
+    log = ScheduleLog(str(tmp_path), segment_max_bytes=64)
+    for i in range(5):
+        log.append({'date': '2024-01-01', 'n': i})
+    log.close()
+
+    assert not os.path.exists(tmp_path / 'schedule_log.json')
+    assert len(list_segments(str(tmp_path))) > 1
+    entries = list(iter_schedule(str(tmp_path)))
+    assert entries[0] == legacy[0]
+    assert [e['n'] for e in entries[1:]] == list(range(5))
+
+
+def test_torn_line_dropped_on_reopen(tmp_path):
+    log = ScheduleLog(str(tmp_path))
+    log.append({'n': 1})
+    log.close()
+    with open(list_segments(str(tmp_path))[-1], 'ab') as fh:
+        fh.write(b'{"n": 2')
+
+    log = ScheduleLog(str(tmp_path))
+    log.append({'n': 3})
+    log.close()
+
+    assert [e['n'] for e in iter_schedule(str(tmp_path))] == [1, 3]
@@ -0,0 +1,143 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from gardenpip import sensors
+from gardenpip.db import NutrientLog, Shelf, ShelfSystem, Tray, session_scope
+from gardenpip.sensors import FakeSerialDevice, FrameError, IngestService, ProbeConfig, parse_frame
+
+
+def test_parse_frame():
+    assert parse_frame(b"ph=6.02 ppm=950\n") == (6.02, 950.0)
+    assert parse_frame(b"PH:5.8,TDS:700\r\n") == (5.8, 700.0)
+    assert parse_frame(b"ph=6.00 ppm=900*74\n") == (6.0, 900.0)
+    for bad in (b"ph=6.0\n", b"ph=15 ppm=900\n", b"ph=6.00 ppm=900*00\n", b"\xff\xfe\n"):
+        with pytest.raises(FrameError):
+            parse_frame(bad)
+
+
+def test_ingest_from_fake_devices(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    with session_scope(db_path) as session:
+        shelf = Shelf(label="S1", system=ShelfSystem(name="Sys"))
+        trays = [Tray(label="T1", shelf=shelf), Tray(label="T2", shelf=shelf)]
+        session.add_all(trays)
+        session.flush()
+        tray_ids = [t.id for t in trays]
+
+    devices = [FakeSerialDevice(), FakeSerialDevice()]
+    service = IngestService(
+        [ProbeConfig(d.port, t) for d, t in zip(devices, tray_ids)],
+        db_path=db_path, queue_size=4, batch_size=8, batch_delay=0.05,
+    )
+    thread = service.start_in_thread()
+    try:
+        # opening a port drops whatever was sent before
+        deadline = time.monotonic() + 10
+        while service.stats["connected"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i in range(20):
+            for device in devices:
+                device.send_reading(6.0, 800 + i, checksum=i % 2 == 0)
+        devices[0].send("garbage")
+        deadline = time.monotonic() + 10
+        while service.stats["stored"] < 40 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        service.stop()
+        thread.join(5)
+        for device in devices:
+            device.close()
+
+    assert service.stats["stored"] == 40
+    assert service.stats["rejected"] == 1
+    with session_scope(db_path) as session:
+        for tray_id in tray_ids:
+            ppms = [log.ppm for log in session.query(NutrientLog).filter_by(tray_id=tray_id)]
+            assert sorted(ppms) == [800.0 + i for i in range(20)]
+
+
+def test_ingest_retries_locked_writes_and_drains_on_stop(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    with session_scope(db_path) as session:
+        tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+        session.add(tray)
+        session.flush()
+        tray_id = tray.id
+
+    device = FakeSerialDevice()
+    # batches never fill up or time out, so only stop() can write them
+    service = IngestService([ProbeConfig(device.port, tray_id)], db_path=db_path,
+                            batch_size=1000, batch_delay=60, retry_delay=0.01)
+    store = service._store
+    failures = []
+
+    def flaky_store(batch):
+        if not failures:
+            failures.append(len(batch))
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return store(batch)
+
+    service._store = flaky_store
+    thread = service.start_in_thread()
+    try:
+        deadline = time.monotonic() + 10
+        while service.stats["connected"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i in range(5):
+            device.send_reading(6.0, 800 + i)
+        deadline = time.monotonic() + 10
+        while service.stats["received"] < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        service.stop()
+        thread.join(5)
+        device.close()
+
+    assert failures == [5]
+    assert service.stats["stored"] == 5 and service.stats["dropped"] == 0
+    with session_scope(db_path) as session:
+        assert session.query(NutrientLog).filter_by(tray_id=tray_id).count() == 5
+
+
+def test_main_stores_pending_readings_on_ctrl_c(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "test.db")
+    with session_scope(db_path) as session:
+        tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+        session.add(tray)
+        session.flush()
+        tray_id = tray.id
+
+    device = FakeSerialDevice()
+    services = []
+
+    def service_factory(probes, db_path=None):
+        # batches only get written when the service stops
+        services.append(IngestService(probes, db_path=db_path, batch_size=1000, batch_delay=60))
+        return services[0]
+
+    def interrupt():
+        deadline = time.monotonic() + 10
+        while (not services or services[0].stats["connected"] < 1) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i in range(5):
+            device.send_reading(6.0, 800 + i)
+        while services[0].stats["received"] < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGINT)
+
+    monkeypatch.setattr(sensors, "IngestService", service_factory)
+    helper = threading.Thread(target=interrupt)
+    helper.start()
+    try:
+        sensors.main([f"{device.port}:{tray_id}", "--db", db_path])
+    finally:
+        helper.join()
+        device.close()
+
+    with session_scope(db_path) as session:
+        assert session.query(NutrientLog).filter_by(tray_id=tray_id).count() == 5
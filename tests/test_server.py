@@ -0,0 +1,119 @@
+import datetime as dt
+import http.client
+import json
+import socket
+
+import pytest
+
+from gardenpip.db import Shelf, ShelfSystem, Tray, add_nutrient_log, get_session
+from gardenpip.server import APIServer
+
+
+@pytest.fixture
+def api(tmp_path):
+    server = APIServer(host="127.0.0.1", port=0, db_path=str(tmp_path / "api.db"))
+    server.start_in_thread()
+    conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+
+    def get(path, headers=None):
+        conn.request("GET", path, headers=headers or {})
+        resp = conn.getresponse()
+        body = resp.read()
+        return resp.status, resp.getheader("ETag"), json.loads(body) if body else None
+
+    yield server, get
+    conn.close()
+    server.stop()
+
+
+def test_calculator_and_search_with_etags(api):
+    server, get = api
+    status, etag, data = get("/api/nutrients/calculate?manufacturer=General+Hydroponics"
+                             "&series=Flora+Series&stage=Seedling&volume=10&cal_mag=CaliMagic")
+    assert status == 200 and data["doses"] and data["supplement"]["name"] == "CaliMagic"
+    assert data["lines"][-1].startswith("CaliMagic:")
+
+    status, etag, data = get("/api/problems/search?q=leaf+tips&plant=Cucumber&limit=5")
+    assert status == 200 and data["results"][0]["title"] == "Burnt Leaf Tips in Cucumbers"
+    assert get("/api/problems/search?q=leaf+tips&plant=Cucumber&limit=5", {"If-None-Match": etag}) \
+        == (304, etag, None)
+    assert server.stats["hits"] == 1 and server.stats["not_modified"] == 1
+
+    status, _, data = get("/api/problems/diagnose?symptom=Brown+leaf+edges&symptom=Burnt+or+crispy+leaf+tips")
+    assert data["results"][0]["matched"] == 2
+    assert get("/api/nutrients/calculate?series=x")[0] == 400
+    calc = "/api/nutrients/calculate?manufacturer=General+Hydroponics&series=Flora+Series&volume=10"
+    assert get(calc + "&stage=Nope")[0] == 400
+    assert get(calc + "&stage=Seedling&unit=bogus")[0] == 400
+    for volume in ("nan", "inf", "-5", "0"):
+        assert get(calc.replace("volume=10", f"volume={volume}") + "&stage=Seedling")[0] == 400
+    assert get("/api/problems/search?q=leaf&offset=-1")[0] == 400
+    assert get("/api/nope")[0] == 404
+
+
+def test_log_responses_follow_database_changes(api, tmp_path):
+    server, get = api
+    session = get_session(server.db_path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="default")))
+    session.add(tray)
+    session.commit()
+    add_nutrient_log(session, tray.id, ph=6.1, ppm=900, notes="first")
+
+    status, etag, data = get(f"/api/logs?tray_id={tray.id}")
+    assert [log["notes"] for log in data["logs"]] == ["first"]
+    assert get(f"/api/logs?tray_id={tray.id}", {"If-None-Match": etag})[0] == 304
+
+    add_nutrient_log(session, tray.id, ph=6.2, ppm=950, notes="second")
+    status, new_etag, data = get(f"/api/logs?tray_id={tray.id}", {"If-None-Match": etag})
+    assert status == 200 and new_etag != etag
+    assert [log["notes"] for log in data["logs"]] == ["second", "first"]
+
+    assert get("/api/alerts")[2] == {"alerts": []}
+    status, _, data = get("/api/layout?system=default")
+    assert data["layout"][0]["trays"][0]["label"] == "T1"
+
+
+def test_bad_content_length_and_stop_with_idle_client(tmp_path, caplog):
+    server = APIServer(host="127.0.0.1", port=0, db_path=str(tmp_path / "api.db"))
+    server.start_in_thread()
+    with socket.create_connection(("127.0.0.1", server.port), timeout=10) as bad:
+        bad.sendall(b"GET /api/health HTTP/1.1\r\nContent-Length: abc\r\n\r\n")
+        assert bad.recv(4096).startswith(b"HTTP/1.1 400 ")
+
+    conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+    conn.request("GET", "/api/health")
+    assert conn.getresponse().read() == b'{"ok": true}'
+    server.stop()
+    # the idle keep-alive connection is closed rather than left to be cancelled
+    assert conn.sock.recv(1) == b""
+    conn.close()
+    assert not [r for r in caplog.records if r.name == "asyncio"]
+
+
+def test_history_windows_and_caching(api):
+    server, get = api
+    session = get_session(server.db_path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="default")))
+    session.add(tray)
+    session.commit()
+    now = dt.datetime.utcnow()
+    for hours in (3, 2, 1):
+        add_nutrient_log(session, tray.id, date=now - dt.timedelta(hours=hours), ph=6.0, ppm=900 + hours)
+
+    window = f"/api/logs/history?tray_id={tray.id}&start={(now - dt.timedelta(days=1)).isoformat()}" \
+             f"&end={now.isoformat()}"
+    status, _, data = get(window)
+    assert status == 200 and data["resolution"] == "raw"
+    assert [p["ppm_mean"] for p in data["points"]] == [903, 902, 901]
+    hits = server.stats["hits"]
+    get(window)
+    assert server.stats["hits"] == hits + 1
+
+    # without an end the window moves with the clock, so nothing is reused
+    status, _, data = get(f"/api/logs/history?tray_id={tray.id}")
+    assert status == 200 and len(data["points"]) == 3
+    get(f"/api/logs/history?tray_id={tray.id}")
+    assert server.stats["hits"] == hits + 1
+
+    for max_points in ("0", "-3", "100000"):
+        assert get(f"{window}&max_points={max_points}")[0] == 400
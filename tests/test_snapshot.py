@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+
+from gardenpip.nutrient_logic import NutrientCatalog, get_catalog, load_nutrient_data
+from gardenpip.problem_logic import ProblemIndex, get_problem_index, load_problem_data
+from gardenpip.snapshot import _HEADER, build_snapshot, open_snapshot
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+
+
+def _copy(tmp_path, name):
+    path = str(tmp_path / name)
+    shutil.copy(os.path.join(ROOT, name), path)
+    return path
+
+
+def test_nutrient_snapshot_matches_json(tmp_path):
+    path = _copy(tmp_path, 'nutrients.json')
+    with open(path, encoding='utf-8') as fh:
+        data = json.load(fh)
+    build_snapshot(path)
+    assert load_nutrient_data(path) == data
+
+    from_json = NutrientCatalog(data)
+    catalog = get_catalog(path)
+    assert catalog.manufacturers() == from_json.manufacturers()
+    for man in from_json.manufacturers():
+        for series in from_json.series(man):
+            for stage in from_json.stages(man, series):
+                for unit in ('metric', 'imperial'):
+                    assert catalog.doses(man, series, stage, unit, 3) == from_json.doses(man, series, stage, unit, 3)
+    for product in from_json.supplements():
+        assert catalog.supplement_dose(product, 'metric', 2) == from_json.supplement_dose(product, 'metric', 2)
+
+
+def test_problem_snapshot_matches_json_and_goes_stale(tmp_path):
+    path = _copy(tmp_path, 'hydroponicProblems.json')
+    with open(path, encoding='utf-8') as fh:
+        problems = json.load(fh)['problems']
+    build_snapshot(path)
+
+    records = load_problem_data(path)
+    assert not isinstance(records, list)
+    assert list(records) == problems
+
+    index = get_problem_index(path)
+    expected = ProblemIndex(problems)
+    for query, filters in [('burnt leaf tips', {}), ('leaf', {'plant': 'tomato', 'stage': 'vegetative'}),
+                           (None, {'medium': 'hydroton'})]:
+        assert index.search_ids(query, **filters) == expected.search_ids(query, **filters)
+    assert index.facet_values('plant') == expected.facet_values('plant')
+
+    # editing the JSON makes the snapshot stale, so the JSON is read again
+    problems[0]['title'] = 'Changed'
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump({'problems': problems}, fh)
+    assert open_snapshot(path) is None
+    assert load_problem_data(path)[0]['title'] == 'Changed'
+
+
+def test_damaged_snapshot_falls_back_to_json(tmp_path):
+    path = _copy(tmp_path, 'nutrients.json')
+    with open(path, encoding='utf-8') as fh:
+        data = json.load(fh)
+    snap_path = build_snapshot(path)
+    with open(snap_path, 'rb') as fh:
+        blob = fh.read()
+    header = _HEADER.unpack_from(blob)
+    damaged = [
+        blob[:_HEADER.size + 10],  # cut inside the section table
+        blob[:len(blob) // 2],  # cut inside the sections
+        _HEADER.pack(*header[:-1], 2) + blob[_HEADER.size:],  # sections left out
+    ]
+    for content in damaged:
+        with open(snap_path, 'wb') as fh:
+            fh.write(content)
+        assert open_snapshot(path) is None
+        assert load_nutrient_data(path) == data
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+
+
+def test_logic_modules_import_without_sqlalchemy():
+    code = (
+        "import sys\n"
+        "import gardenpip.config_logic, gardenpip.nutrient_logic, gardenpip.problem_logic\n"
+        "import gardenpip.shelf_logic, gardenpip.schedule_log, gardenpip.io_worker, gardenpip.server\n"
+        "print('sqlalchemy' in sys.modules)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    assert out.strip() == "False"
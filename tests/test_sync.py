@@ -0,0 +1,130 @@
+import json
+import os
+
+import pytest
+
+from gardenpip.db import (
+    ReplicatedLog, ReplicatedScheduleEntry, Shelf, ShelfSystem, Tray, add_nutrient_logs,
+    delete_nutrient_log, get_session, session_scope, update_nutrient_log,
+)
+from gardenpip.schedule_log import ScheduleLog
+from gardenpip.sync import (
+    DirectoryTransport, OutOfOrderBatch, SocketTransport, SyncServer, apply_batch, default_origin,
+    encode_batch, import_directory, log_batches, push,
+)
+
+
+def _origin_db(path, logs=3):
+    session = get_session(path)
+    tray = Tray(label="T1", shelf=Shelf(label="S1", system=ShelfSystem(name="Sys")))
+    session.add(tray)
+    session.commit()
+    add_nutrient_logs(session, [{"tray_id": tray.id, "ph": 6.0, "ppm": 900 + i, "notes": f"n{i}"}
+                                for i in range(logs)])
+    return session
+
+
+def _replicated(db_path):
+    with session_scope(db_path) as session:
+        logs = {(r.origin, r.origin_id): (r.ppm, r.tray_label) for r in session.query(ReplicatedLog)}
+        entries = [json.loads(r.entry)["n"] for r in
+                   session.query(ReplicatedScheduleEntry).order_by("segment", "offset")]
+    return logs, entries
+
+
+def test_directory_push_sends_only_deltas(tmp_path):
+    origin_db, central_db = str(tmp_path / "room.db"), str(tmp_path / "central.db")
+    outbox, sched = str(tmp_path / "outbox"), str(tmp_path / "data")
+    session = _origin_db(origin_db)
+    log = ScheduleLog(sched, segment_max_bytes=40)
+    for n in range(3):
+        log.append({"n": n})
+    log.sync()
+
+    transport = DirectoryTransport(outbox)
+    sent = push(transport, "central", origin_db, sched, origin="room1", batch_size=2)
+    assert sent == {"logs": 3, "schedule": 3}
+    assert import_directory(outbox, central_db) == 6
+    logs, entries = _replicated(central_db)
+    assert logs == {("room1", 1): (900, "T1"), ("room1", 2): (901, "T1"), ("room1", 3): (902, "T1")}
+    assert entries == [0, 1, 2]
+
+    update_nutrient_log(session, 2, ppm=1200.0)
+    delete_nutrient_log(session, 3)
+    log.append({"n": 3})
+    log.close()
+    assert push(transport, "central", origin_db, sched, origin="room1") == {"logs": 2, "schedule": 1}
+    assert push(transport, "central", origin_db, sched, origin="room1") == {"logs": 0, "schedule": 0}
+    import_directory(outbox, central_db)
+    logs, entries = _replicated(central_db)
+    assert logs == {("room1", 1): (900, "T1"), ("room1", 2): (1200, "T1")}
+    assert entries == [0, 1, 2, 3]
+
+
+def test_socket_server_merges_origins_and_skips_replays(tmp_path):
+    central_db = str(tmp_path / "central.db")
+    server = SyncServer(central_db, host="127.0.0.1")
+    server.start_in_thread()
+    try:
+        for name in ("room1", "room2"):
+            path = str(tmp_path / f"{name}.db")
+            _origin_db(path, logs=5)
+            transport = SocketTransport("127.0.0.1", server.port)
+            try:
+                assert push(transport, "central", path, origin=name)["logs"] == 5
+            finally:
+                transport.close()
+    finally:
+        server.stop()
+    assert server.applied == 10 and server.errors == 0
+    logs, _ = _replicated(central_db)
+    assert len(logs) == 10
+
+    # an old batch delivered again must not undo anything
+    old = next(log_batches(str(tmp_path / "room1.db"), "room1", 0))
+    assert apply_batch(central_db, encode_batch(old)) == 0
+
+
+def test_default_origin_is_unique_per_database(tmp_path):
+    first, second = str(tmp_path / "a.db"), str(tmp_path / "b.db")
+    assert default_origin(first) == default_origin(first)
+    assert default_origin(first) != default_origin(second)
+
+
+def test_late_batch_file_is_kept_until_its_predecessors_arrive(tmp_path):
+    origin_db, central_db = str(tmp_path / "room.db"), str(tmp_path / "central.db")
+    outbox, share = tmp_path / "outbox", tmp_path / "share"
+    _origin_db(origin_db, logs=4)
+    push(DirectoryTransport(str(outbox)), "central", origin_db, origin="room1", batch_size=2)
+    first, second = sorted(os.listdir(outbox))
+
+    share.mkdir()
+    os.replace(outbox / second, share / second)
+    assert import_directory(str(share), central_db) == 0
+    assert os.listdir(share) == [second]
+    with pytest.raises(OutOfOrderBatch):
+        apply_batch(central_db, (share / second).read_bytes())
+
+    os.replace(outbox / first, share / first)
+    assert import_directory(str(share), central_db) == 4
+    assert os.listdir(share) == []
+    assert len(_replicated(central_db)[0]) == 4
+
+
+def test_unreadable_batch_file_is_set_aside(tmp_path, caplog):
+    origin_db, central_db = str(tmp_path / "room.db"), str(tmp_path / "central.db")
+    outbox = tmp_path / "outbox"
+    _origin_db(origin_db, logs=2)
+    push(DirectoryTransport(str(outbox)), "central", origin_db, origin="room1")
+    # sorts before the real batch
+    (outbox / "aaa-logs-000000000001.batch").write_bytes(b"garbage")
+    (outbox / "aab-logs-000000000001.batch").write_bytes(encode_batch({"origin": "x", "stream": "logs"}))
+
+    stats = {}
+    assert import_directory(str(outbox), central_db, stats) == 2
+    assert stats == {"rejected": 2}
+    assert sorted(os.listdir(outbox)) == ["rejected"]
+    assert sorted(os.listdir(outbox / "rejected")) == ["aaa-logs-000000000001.batch",
+                                                       "aab-logs-000000000001.batch"]
+    assert "rejecting batch file" in caplog.text
+    assert len(_replicated(central_db)[0]) == 2